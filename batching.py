@@ -0,0 +1,37 @@
+import asyncio
+from typing import Awaitable, Callable, Optional, Set
+
+
+class BatchTimer:
+    """Run flush() once, `window` seconds after the first item of a batch arrived.
+
+    For collectors that gather work for a short window and send it together:
+    call schedule() whenever an item is queued; later calls within the window
+    join the batch. The flush runs as a background task.
+    """
+
+    def __init__(self, window: float, flush: Callable[[], Awaitable[None]]):
+        self.window = window
+        self.flush = flush
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def schedule(self) -> None:
+        """Make sure a flush is due at the end of the current window."""
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._start_flush)
+
+    def _start_flush(self) -> None:
+        self._timer = None
+        task = asyncio.create_task(self.flush())
+        # Keep a reference so the task is not garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self) -> None:
+        """Cancel the pending flush and wait for running ones; the owner flushes the rest itself."""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
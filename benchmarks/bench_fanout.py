@@ -0,0 +1,92 @@
+"""Compare broadcast fan-out methods against the mock Bot API.
+
+"send" re-sends every photo to every chat (one sendPhoto or sendMediaGroup per
+chat), "copy" copies the channel posts (one copyMessage or copyMessages per
+chat). Reports wall time, API calls and request bytes for each.
+
+    python benchmarks/bench_fanout.py [--chats 2000] [--photos 5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# The bot keeps its databases in the working directory; keep them out of the repo
+os.chdir(tempfile.mkdtemp(prefix="bot-bench-"))
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+
+from telegram import Bot  # noqa: E402
+from telegram.request import HTTPXRequest  # noqa: E402
+
+import bot_script  # noqa: E402
+from broadcast import BroadcastEngine, RateLimiter  # noqa: E402
+from mock_bot_api import MockBotAPI  # noqa: E402
+
+CHANNEL_ID = -1001234567890
+
+
+def payloads(photos):
+    """(label, kind, payload) for each method at the given batch size."""
+    file_ids = [f"photo-{i}" for i in range(photos)]
+    message_ids = list(range(1, photos + 1))
+    if photos == 1:
+        return [
+            ("send", "photo", {"photo": file_ids[0], "caption": "bench"}),
+            ("copy", "copy", {"from_chat_id": CHANNEL_ID, "message_ids": message_ids, "caption": "bench"}),
+        ]
+    return [
+        ("send", "media_group", {"photos": file_ids, "caption": "bench"}),
+        ("copy", "copy", {"from_chat_id": CHANNEL_ID, "message_ids": message_ids}),
+    ]
+
+
+async def run(args):
+    api = MockBotAPI(port=args.api_port)
+    await api.start()
+    bot = Bot(
+        os.environ["BOT_TOKEN"],
+        base_url=api.base_url,
+        request=HTTPXRequest(connection_pool_size=args.concurrency),
+    )
+    await bot.initialize()
+    # No real rate limit here: the point is the per-chat request cost
+    engine = BroadcastEngine(RateLimiter(rate=1e6, per_chat_interval=0), concurrency=args.concurrency)
+    chat_ids = list(range(1, args.chats + 1))
+
+    try:
+        for photos in sorted({1, args.photos}):
+            print(f"\n{args.chats} chats, {photos} photo(s) per broadcast")
+            for label, kind, payload in payloads(photos):
+                api.calls.clear()
+                api.bytes_received = 0
+                start = time.perf_counter()
+                result = await engine.broadcast(chat_ids, bot_script.make_sender(bot, kind, payload))
+                elapsed = time.perf_counter() - start
+                calls = sum(api.calls.values())
+                print(
+                    f"  {label:5s} {elapsed:7.2f}s  {calls / elapsed:8.0f} calls/s  "
+                    f"{calls:6d} calls  {api.bytes_received / calls:6.0f} B/call  "
+                    f"{api.bytes_received / 1024:8.0f} KiB  failed={len(result.failed)}"
+                )
+    finally:
+        await bot.shutdown()
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument("--photos", type=int, default=5, help="album / batch size to compare besides 1")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--api-port", type=int, default=8091)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Measure cold start with a large stored user base.
+
+Fills a fresh store with --users users (all verified and in the forward
+list), then times importing bot_script and loading the state the way
+`python bot_script.py` does, with the per-step breakdown from load_state().
+
+    python benchmarks/bench_startup.py [--users 100000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# The bot keeps its databases in the working directory; keep them out of the repo
+os.chdir(tempfile.mkdtemp(prefix="bot-bench-"))
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+
+from storage import Store  # noqa: E402
+
+
+def populate(users):
+    store = Store()
+    first_user = 40_000_000
+    ids = range(first_user, first_user + users)
+    store.users.upsert_many(
+        (user_id, {
+            "username": f"user{user_id}",
+            "full_name": f"Test User {user_id}",
+            "chat_id": user_id,
+            "start_time": "2024-12-26 17:10:36",
+        })
+        for user_id in ids
+    )
+    store.verified_users.upsert_many((str(user_id), {"username": f"user{user_id}", "chat_id": user_id}) for user_id in ids)
+    store.forward_list.upsert_many(
+        (user_id, {"user_id": user_id, "chat_id": user_id, "username": f"user{user_id}", "display_name": None})
+        for user_id in ids
+    )
+    store.set_meta("json_migrated", "1")
+    store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    args = parser.parse_args()
+
+    populate(args.users)
+
+    started = time.perf_counter()
+    import bot_script
+    imported = time.perf_counter() - started
+    timings = bot_script.load_state()
+    total = time.perf_counter() - started
+
+    print(f"{args.users} users: ready in {total:.2f}s (import {imported:.2f}s, state {sum(timings.values()):.2f}s)")
+    for name, seconds in sorted(timings.items(), key=lambda item: -item[1]):
+        print(f"  {name:<17} {seconds * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Compare the cost of persisting one /start at 100k stored users.
+
+Runs the old whole-file JSON rewrite (what save_user_data used to do) against
+a keyed upsert plus lookup in the SQLite store and an upsert into the
+snapshot-and-log table, and reports the latency and the bytes each one writes
+per /start (SQLite: growth of its write-ahead log; snapshot-and-log: the
+appended frame, and with the snapshot rewrites it causes amortized in).
+
+    python benchmarks/bench_store.py [--users 100000] [--rounds 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logstore import STORE_COMPACT_RATIO, LogTable  # noqa: E402
+from storage import Store  # noqa: E402
+
+
+def make_user(user_id):
+    return {
+        "username": f"user{user_id}",
+        "full_name": f"Test User {user_id}",
+        "chat_id": user_id,
+        "start_time": "2024-12-26 17:10:36",
+    }
+
+
+def legacy_start(path, user_data, user_id):
+    """The old save_user_data(): re-read the file, merge and rewrite it whole."""
+    with open(path, "r") as f:
+        existing = json.load(f)
+    user_data.update(existing)
+    user_data[str(user_id)] = make_user(user_id)
+    with open(path, "w") as f:
+        json.dump(user_data, f, indent=4)
+
+
+def store_start(store, user_id):
+    store.users.get(user_id)
+    store.users.upsert(user_id, make_user(user_id))
+
+
+def log_start(table, user_id):
+    table.upsert(user_id, make_user(user_id))
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p50 = statistics.median(samples) * 1000
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000
+    print(f"{name:<14} p50={p50:9.3f} ms   p99={p99:9.3f} ms   n={len(samples)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        users = {str(i): make_user(i) for i in range(args.users)}
+
+        json_path = os.path.join(tmp, "user_data.json")
+        with open(json_path, "w") as f:
+            json.dump(users, f, indent=4)
+        store = Store(os.path.join(tmp, "bot_data.db"), log_tables=())
+        store.users.upsert_many(users.items())
+        # Keep every page written in the WAL so its growth is what was written
+        store.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        store.conn.execute("PRAGMA wal_autocheckpoint=0")
+        wal_path = store.path + "-wal"
+        log_table = LogTable(os.path.join(tmp, "bot_data.users"), "users")
+        log_table.write_snapshot(users)
+
+        legacy = []
+        for i in range(args.rounds):
+            started = time.perf_counter()
+            legacy_start(json_path, {}, args.users + i)
+            legacy.append(time.perf_counter() - started)
+        json_bytes = os.path.getsize(json_path)
+
+        starts = args.rounds * 50
+        keyed = []
+        wal_before = os.path.getsize(wal_path)
+        for i in range(starts):
+            started = time.perf_counter()
+            store_start(store, args.users + i)
+            keyed.append(time.perf_counter() - started)
+        wal_bytes = (os.path.getsize(wal_path) - wal_before) / starts
+
+        logged = []
+        log_before = log_table.log_bytes
+        for i in range(starts):
+            started = time.perf_counter()
+            log_start(log_table, args.users + i)
+            logged.append(time.perf_counter() - started)
+        frame_bytes = (log_table.log_bytes - log_before) / starts
+        log_table.close()
+
+        print(f"/start persistence cost with {args.users} stored users")
+        report("json rewrite", legacy)
+        report("sqlite upsert", keyed)
+        report("log append", logged)
+        print("bytes written per /start")
+        print(f"{'json rewrite':<14} {json_bytes:12,.0f}")
+        print(f"{'sqlite upsert':<14} {wal_bytes:12,.0f}")
+        # Every log_bytes / ratio bytes of log cost one snapshot rewrite of about the same size
+        print(f"{'log append':<14} {frame_bytes:12,.0f}   ({frame_bytes * (1 + 1 / STORE_COMPACT_RATIO):,.0f} with compaction)")
+
+
+if __name__ == "__main__":
+    main()
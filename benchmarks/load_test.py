@@ -0,0 +1,318 @@
+"""Load-test the bot against the mock Bot API with scripted scenarios.
+
+Scenarios:
+    start         a burst of /start commands from distinct new users
+    broadcast     one photo broadcast to a large forward list
+    bulk_approve  /bulk_approve commands from an admin over many stored users
+    spam          the start burst while one user floods the bot with /start and photos
+
+Each reports throughput, p50/p99 latency and memory. Latency is measured per
+update for "start" (update served -> reply sent), per recipient for
+"broadcast" (broadcast started -> photo delivered) and per command for
+"bulk_approve". Results can be saved with --json and compared with a previous
+run with --compare.
+
+    python benchmarks/load_test.py --scenario all
+    python benchmarks/load_test.py --scenario broadcast --latency 0.05 --flood-rate 0.01 --json after.json --compare before.json
+    python benchmarks/load_test.py --scenario broadcast --recipients 50000 --workers 4
+    python benchmarks/load_test.py --scenario broadcast --dead 0.3 --rounds 3
+    python benchmarks/load_test.py --scenario broadcast --broadcast-rate 100 --flood-limit 30
+    python benchmarks/load_test.py --scenario spam --users 2000 --spam 20000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# The bot keeps its databases in the working directory; keep them out of the repo.
+# File arguments are resolved against the directory the script was started from.
+START_DIR = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix="bot-bench-"))
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+
+import bot_script  # noqa: E402
+from broadcast import BroadcastEngine, RateLimiter  # noqa: E402
+from broadcast_workers import BroadcastWorkerPool, shared_limiter  # noqa: E402
+from mock_bot_api import MockBotAPI, make_command_update, make_photo_update, make_start_update  # noqa: E402
+from storage import Store  # noqa: E402
+from subscribers import Subscriber  # noqa: E402
+
+SCENARIOS = ("start", "broadcast", "bulk_approve", "spam")
+
+
+def rss_mb():
+    """Current resident set size in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        # ru_maxrss is the peak, not the current size, but better than nothing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def wait_for(progress, target, args):
+    """Wait until progress() reaches target, giving up on timeout or when it stalls."""
+    deadline = time.perf_counter() + args.timeout
+    last, last_change = progress(), time.perf_counter()
+    while last < target:
+        await asyncio.sleep(0.02)
+        now, current = time.perf_counter(), progress()
+        if current != last:
+            last, last_change = current, now
+        # Injected errors can drop replies for good; don't wait for them forever
+        elif now - last_change > args.stall or now > deadline:
+            return
+
+
+async def scenario_start(application, api, args):
+    """Push args.users /start updates at once and wait for every reply."""
+    first_user = 10_000_000
+    updates = [make_start_update(i + 1, first_user + i) for i in range(args.users)]
+    released = time.perf_counter()
+    api.push_updates(updates)
+    chats = range(first_user, first_user + args.users)
+    # Admins get verification requests too, so count only the new users' chats
+    await wait_for(lambda: sum(chat in api.first_reply for chat in chats), args.users, args)
+    latencies = [api.first_reply[chat] - released for chat in chats if chat in api.first_reply]
+    return latencies, len(latencies), args.users
+
+
+async def scenario_broadcast(application, api, args):
+    """Broadcast one photo to args.recipients subscribers."""
+    first_user = 20_000_000
+    bot_script.FORWARD_LIST.clear()
+    for user_id in range(first_user, first_user + args.recipients):
+        bot_script.FORWARD_LIST.add(Subscriber(user_id, user_id, f"load{user_id}"))
+    if args.workers:
+        bot_script.WORKER_POOL = BroadcastWorkerPool(
+            bot_script.BOT_TOKEN, api.base_url, workers=args.workers, rate=args.broadcast_rate, min_recipients=0
+        )
+        bot_script.BROADCASTER = BroadcastEngine(shared_limiter(args.broadcast_rate))
+    else:
+        bot_script.BROADCASTER = BroadcastEngine(RateLimiter(rate=args.broadcast_rate, adaptive=not args.fixed_rate))
+
+    # Every n-th recipient has blocked the bot
+    if args.dead:
+        step = max(1, round(1 / args.dead))
+        api.blocked = set(range(first_user, first_user + args.recipients, step))
+
+    # Later rounds skip the recipients that failed in earlier ones
+    for round_number in range(1, args.rounds + 1):
+        api.delivered.clear()
+        calls = api.calls["sendPhoto"]
+        started = time.perf_counter()
+        counts = await bot_script.broadcast_photo(application.bot, "mock-photo", "load test")
+        if args.rounds > 1:
+            print(
+                f"  round {round_number}: {time.perf_counter() - started:.2f}s, "
+                f"{api.calls['sendPhoto'] - calls} sendPhoto calls, {counts}"
+            )
+    delivered = api.delivered["sendPhoto"]
+    latencies = [at - started for at in delivered.values()]
+    return latencies, counts.get("sent", 0), args.recipients - len(api.blocked)
+
+
+async def scenario_bulk_approve(application, api, args):
+    """Approve args.bulk stored users through /bulk_approve, args.batch ids per command."""
+    first_user = 30_000_000
+    for user_id in range(first_user, first_user + args.bulk):
+        bot_script.USER_DATA[user_id] = {
+            "username": f"load{user_id}",
+            "full_name": f"Load {user_id}",
+            "chat_id": user_id,
+            "start_time": "2024-12-26 17:10:36",
+        }
+    admin = min(bot_script.AUTHORIZED_USERS)
+    ids = [str(user_id) for user_id in range(first_user, first_user + args.bulk)]
+
+    latencies = []
+    for index, start in enumerate(range(0, len(ids), args.batch)):
+        text = "/bulk_approve " + " ".join(ids[start:start + args.batch])
+        released = time.perf_counter()
+        api.push_updates([make_command_update(1_000_000 + index, admin, text)])
+        await wait_for(lambda: len(api.replies[admin]), index + 1, args)
+        if len(api.replies[admin]) > index:
+            latencies.append(api.replies[admin][index] - released)
+    approved = sum(1 for user_id in ids if user_id in bot_script.VERIFIED_USERS)
+    return latencies, approved, args.bulk
+
+
+async def scenario_spam(application, api, args):
+    """Run the start burst with args.spam /start and photo updates from one user mixed in."""
+    spammer = 5_000_000
+    first_user = 40_000_000
+    senders = [spammer] * args.spam
+    # Spread the legitimate users through the flood
+    every = max(1, args.spam // max(1, args.users))
+    for i in range(args.users):
+        senders.insert(min(len(senders), i * (every + 1)), first_user + i)
+    # getUpdates offsets assume update ids grow in delivery order
+    updates = []
+    for index, user_id in enumerate(senders):
+        update_id = 2_000_000 + index
+        if user_id == spammer and index % 2:
+            updates.append(make_photo_update(update_id, spammer, f"spam{index}"))
+        else:
+            updates.append(make_start_update(update_id, user_id))
+    api.reset_stats()
+    released = time.perf_counter()
+    api.push_updates(updates)
+    chats = range(first_user, first_user + args.users)
+    await wait_for(lambda: sum(chat in api.first_reply for chat in chats), args.users, args)
+    # The flood counts as handled once every update passed the throttle (allowed or dropped)
+    throttle = bot_script.THROTTLE
+    await wait_for(lambda: throttle.allowed + sum(throttle.shed.values()), len(updates), args)
+    await bot_script.PERSISTENCE.flush()
+    latencies = [api.first_reply[chat] - released for chat in chats if chat in api.first_reply]
+    print(
+        f"  spammer: {len(api.replies[spammer])} replies, {api.calls['setMyCommands']} setMyCommands calls in total, "
+        f"{bot_script.VERIFICATIONS.stats()['requests']} access requests, throttle {bot_script.THROTTLE.stats()}"
+    )
+    return latencies, len(latencies), args.users
+
+
+async def run_scenario(name, args):
+    api = MockBotAPI(
+        port=args.api_port,
+        latency=args.latency,
+        jitter=args.jitter,
+        flood_rate=args.flood_rate,
+        flood_limit=args.flood_limit,
+        retry_after=args.retry_after,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    await api.start()
+    application = bot_script.build_application(api.base_url)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    await application.updater.start_polling(poll_interval=0, timeout=1)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    try:
+        latencies, done, total = await globals()[f"scenario_{name}"](application, api, args)
+        elapsed = time.perf_counter() - started
+        rss_after = rss_mb()
+        heap_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20 if args.tracemalloc else None
+    finally:
+        if args.tracemalloc:
+            tracemalloc.stop()
+        await application.updater.stop()
+        await application.stop()
+        await application.post_stop(application)
+        await application.shutdown()
+        await application.post_shutdown(application)
+        await api.stop()
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "done": done,
+        "total": total,
+        "elapsed_s": round(elapsed, 3),
+        "throughput": round(done / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        "api_calls": sum(api.calls.values()),
+        "injected_429": sum(api.floods.values()),
+        "injected_500": sum(api.errors.values()),
+        "rss_mb": round(rss_after, 1),
+        "rss_growth_mb": round(rss_after - rss_before, 1),
+        "heap_peak_mb": round(heap_peak, 1) if heap_peak is not None else None,
+    }
+
+
+def report(result, previous=None):
+    p50 = "-" if result["p50_ms"] is None else f"{result['p50_ms']:.1f}"
+    p99 = "-" if result["p99_ms"] is None else f"{result['p99_ms']:.1f}"
+    line = (
+        f"{result['scenario']:<13} {result['done']}/{result['total']} in {result['elapsed_s']:7.2f}s  "
+        f"{result['throughput']:8.1f}/s  p50={p50} ms  p99={p99} ms  "
+        f"calls={result['api_calls']} 429s={result['injected_429']} 500s={result['injected_500']}  "
+        f"rss={result['rss_mb']} MB (+{result['rss_growth_mb']})"
+    )
+    if result["heap_peak_mb"] is not None:
+        line += f" heap_peak={result['heap_peak_mb']} MB"
+    print(line)
+    if previous:
+        changes = []
+        for key in ("throughput", "p50_ms", "p99_ms", "rss_mb"):
+            before, after = previous.get(key), result[key]
+            if before and after is not None:
+                changes.append(f"{key} {100 * (after - before) / before:+.1f}%")
+        print(f"{'':<13} vs previous: " + ", ".join(changes))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--users", type=int, default=10_000, help="/start updates in the start burst")
+    parser.add_argument("--recipients", type=int, default=5_000, help="forward list size for the broadcast")
+    parser.add_argument("--bulk", type=int, default=5_000, help="users approved in the bulk_approve scenario")
+    parser.add_argument("--spam", type=int, default=20_000, help="updates from the flooding user in the spam scenario")
+    parser.add_argument("--batch", type=int, default=500, help="ids per /bulk_approve command")
+    parser.add_argument("--broadcast-rate", type=float, default=1000.0, help="global messages/s for the broadcast")
+    parser.add_argument("--dead", type=float, default=0.0, help="share of broadcast recipients that blocked the bot")
+    parser.add_argument("--rounds", type=int, default=1, help="broadcasts sent one after another in the broadcast scenario")
+    parser.add_argument("--workers", type=int, default=0, help="broadcast worker processes (0: in the bot process)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds, up to this much")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of calls answered with 429")
+    parser.add_argument("--flood-limit", type=float, default=0.0, help="calls/s above which the API answers 429")
+    parser.add_argument("--fixed-rate", action="store_true", help="don't adapt the broadcast rate to 429s")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after sent with injected 429s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with 500")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--stall", type=float, default=10.0, help="stop waiting after this long without progress")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report the Python heap peak (slower)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to compare against")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    # The bot logs every /start at INFO; at load-test volume that is the bottleneck
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger("httpx").setLevel(args.log_level)
+
+    previous = {}
+    if args.compare:
+        with open(os.path.join(START_DIR, args.compare)) as f:
+            previous = {result["scenario"]: result for result in json.load(f)}
+
+    results = []
+    for index, name in enumerate(SCENARIOS if args.scenario == "all" else (args.scenario,)):
+        if index:
+            # post_shutdown of the previous scenario closed the store; reopen it like a restarted bot
+            bot_script.STORE = bot_script.PERSISTENCE.store = Store()
+        result = await run_scenario(name, args)
+        report(result, previous.get(name))
+        results.append(result)
+
+    if args.json:
+        with open(os.path.join(START_DIR, args.json), "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
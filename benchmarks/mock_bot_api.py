@@ -0,0 +1,261 @@
+"""A small in-process stand-in for the Telegram Bot API, for offline benchmarks.
+
+Only the methods the bot uses are implemented, and only well enough for
+python-telegram-bot to parse the answers. Every call is counted, and the time
+each chat first gets a sendMessage is recorded so the benchmarks can measure
+end-to-end handler latency.
+
+Faults can be injected into every method except getMe and getUpdates: a fixed
+latency (plus random jitter), a share of calls answered with 429 and a
+retry_after, and a share answered with a 500 error.
+"""
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+# Methods the bot needs to start at all; never slowed down or failed
+FAULT_FREE_METHODS = {"getMe", "getUpdates", "deleteWebhook", "setWebhook"}
+
+
+class MockBotAPI:
+    """Fake Bot API server serving a queue of updates through getUpdates."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8081,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        flood_rate: float = 0.0,
+        flood_limit: float = 0.0,
+        retry_after: int = 1,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        # Calls per second above which every further call gets a 429, like Telegram (0: no limit)
+        self.flood_limit = flood_limit
+        self._recent_calls: Deque[float] = deque()
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.floods: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.first_reply: Dict[int, float] = {}
+        self.replies: Dict[int, List[float]] = defaultdict(list)
+        # method -> chat id -> time of the first successful call for that chat
+        self.delivered: Dict[str, Dict[int, float]] = defaultdict(dict)
+        # Last command list set per scope, as JSON of the scope object
+        self.commands: Dict[str, List[Dict[str, Any]]] = {}
+        self.bytes_received = 0
+        # Chats that blocked the bot: every send to them is answered with 403
+        self.blocked: Set[int] = set()
+        self._updates: List[Dict[str, Any]] = []
+        self._new_updates = asyncio.Event()
+        self._message_id = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        """Value to pass to ApplicationBuilder.base_url()."""
+        return f"http://{self.host}:{self.port}/bot"
+
+    def reset_stats(self) -> None:
+        """Forget the counters from a previous scenario."""
+        self.calls.clear()
+        self.floods.clear()
+        self.errors.clear()
+        self.first_reply.clear()
+        self.replies.clear()
+        self.delivered.clear()
+        self.bytes_received = 0
+
+    def push_updates(self, updates: List[Dict[str, Any]]) -> None:
+        """Make updates available to the next getUpdates calls."""
+        self._updates.extend(updates)
+        self._new_updates.set()
+
+    async def start(self) -> None:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._dispatch)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _params(self, request: web.Request) -> Dict[str, Any]:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    async def _dispatch(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        self.bytes_received += request.content_length or 0
+        params = await self._params(request)
+
+        if method not in FAULT_FREE_METHODS:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            if delay:
+                await asyncio.sleep(delay)
+            roll = self._random.random()
+            if roll < self.flood_rate or self._over_limit():
+                self.floods[method] += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }, status=429)
+            if roll < self.flood_rate + self.error_rate:
+                self.errors[method] += 1
+                return web.json_response(
+                    {"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500
+                )
+
+        chat_id = params.get("chat_id")
+        if self.blocked and chat_id is not None and str(chat_id).lstrip("-").isdigit() and int(chat_id) in self.blocked:
+            return web.json_response(
+                {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}, status=403
+            )
+
+        handler = getattr(self, f"api_{method.lower()}", None)
+        result = await handler(params) if handler else True
+        if chat_id is not None and str(chat_id).lstrip("-").isdigit():
+            self.delivered[method].setdefault(int(chat_id), time.perf_counter())
+        return web.json_response({"ok": True, "result": result})
+
+    def _over_limit(self) -> bool:
+        if not self.flood_limit:
+            return False
+        now = time.perf_counter()
+        while self._recent_calls and self._recent_calls[0] < now - 1.0:
+            self._recent_calls.popleft()
+        if len(self._recent_calls) >= self.flood_limit:
+            return True
+        self._recent_calls.append(now)
+        return False
+
+    def _message(self, chat_id: Any, **fields: Any) -> Dict[str, Any]:
+        self._message_id += 1
+        chat_id = int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **fields,
+        }
+
+    async def api_getme(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return BOT_USER
+
+    async def api_getupdates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def api_sendmessage(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params["chat_id"])
+        now = time.perf_counter()
+        self.first_reply.setdefault(chat_id, now)
+        self.replies[chat_id].append(now)
+        return self._message(chat_id, text=params.get("text", ""))
+
+    async def api_sendphoto(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        photo = {"file_id": "mock-photo", "file_unique_id": "mock-photo", "width": 1, "height": 1}
+        return self._message(params["chat_id"], photo=[photo])
+
+    async def api_getchat(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params["chat_id"])
+        return {
+            "id": chat_id,
+            "type": "private",
+            "username": f"load{chat_id}",
+            "first_name": "Load",
+            "last_name": str(chat_id),
+        }
+
+    async def api_setmycommands(self, params: Dict[str, Any]) -> bool:
+        scope = params.get("scope") or {"type": "default"}
+        self.commands[json.dumps(scope, sort_keys=True)] = params.get("commands") or []
+        return True
+
+    async def api_sendmediagroup(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        photo = {"file_id": "mock-photo", "file_unique_id": "mock-photo", "width": 1, "height": 1}
+        return [self._message(params["chat_id"], photo=[photo]) for _ in params.get("media") or []]
+
+    async def api_copymessage(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        self._message_id += 1
+        return {"message_id": self._message_id}
+
+    async def api_copymessages(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [await self.api_copymessage(params) for _ in params.get("message_ids") or []]
+
+
+def make_command_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    """Build an update carrying a command message from a private chat with user_id."""
+    user = {"id": user_id, "is_bot": False, "first_name": "Load", "last_name": str(user_id), "username": f"load{user_id}"}
+    command = text.split(maxsplit=1)[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+
+def make_start_update(update_id: int, user_id: int) -> Dict[str, Any]:
+    """Build a /start update from a private chat with user_id."""
+    return make_command_update(update_id, user_id, "/start")
+
+
+def make_photo_update(update_id: int, user_id: int, file_unique_id: str) -> Dict[str, Any]:
+    """Build an update carrying an uncaptioned photo from a private chat with user_id."""
+    user = {"id": user_id, "is_bot": False, "first_name": "Load", "last_name": str(user_id), "username": f"load{user_id}"}
+    photo = {"file_id": f"photo-{file_unique_id}", "file_unique_id": file_unique_id, "width": 90, "height": 90, "file_size": 1000}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "photo": [photo],
+        },
+    }
@@ -0,0 +1,160 @@
+"""Replay updates through polling and webhook mode against the mock Bot API.
+
+Updates are either read from a JSONL file (one Update object per line, e.g.
+captured from getUpdates) or generated as /start commands from distinct users.
+Each update's latency is measured from the moment it is handed to the bot
+(served by getUpdates, or POSTed to the webhook) until the first sendMessage
+for its chat reaches the mock server.
+
+    python benchmarks/replay_updates.py --mode both --count 2000
+    python benchmarks/replay_updates.py --mode webhook --updates recorded.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# The bot keeps its databases in the working directory; keep them out of the repo.
+# File arguments are resolved against the directory the script was started from.
+START_DIR = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix="bot-bench-"))
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+
+import aiohttp  # noqa: E402
+
+import bot_script  # noqa: E402
+from mock_bot_api import MockBotAPI, make_start_update  # noqa: E402
+from webhook import SECRET_HEADER, start_webhook_server  # noqa: E402
+
+WEBHOOK_SECRET = "benchmark-secret"
+
+
+def load_updates(path, count, first_user_id):
+    """Return the updates to replay, renumbered so update ids are increasing."""
+    if path:
+        with open(os.path.join(START_DIR, path)) as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        updates = [make_start_update(0, first_user_id + i) for i in range(count)]
+    for update_id, update in enumerate(updates, start=1):
+        update["update_id"] = update_id
+    return updates
+
+
+def chat_of(update):
+    for key in ("message", "edited_message", "channel_post"):
+        if key in update:
+            return update[key]["chat"]["id"]
+    return None
+
+
+async def wait_for_replies(mock, released, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if all(chat in mock.first_reply for chat in released):
+            return
+        await asyncio.sleep(0.05)
+
+
+async def replay_polling(application, mock, updates):
+    await application.updater.start_polling(poll_interval=0, timeout=1)
+    released = {}
+    now = time.perf_counter()
+    for update in updates:
+        released.setdefault(chat_of(update), now)
+    mock.push_updates(updates)
+    return released
+
+
+async def replay_webhook(application, mock, updates, port, concurrency):
+    runner = await start_webhook_server(
+        application, "127.0.0.1", port, "/telegram", WEBHOOK_SECRET, concurrency
+    )
+    released = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    url = f"http://127.0.0.1:{port}/telegram"
+
+    async with aiohttp.ClientSession(headers={SECRET_HEADER: WEBHOOK_SECRET}) as session:
+        async def post(update):
+            async with semaphore:
+                released.setdefault(chat_of(update), time.perf_counter())
+                async with session.post(url, json=update) as response:
+                    response.raise_for_status()
+
+        await asyncio.gather(*(post(update) for update in updates))
+    return released, runner
+
+
+async def run_mode(mode, updates, args):
+    mock = MockBotAPI(port=args.api_port)
+    await mock.start()
+    application = bot_script.build_application(mock.base_url)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+
+    runner = None
+    started = time.perf_counter()
+    if mode == "polling":
+        released = await replay_polling(application, mock, updates)
+    else:
+        released, runner = await replay_webhook(application, mock, updates, args.webhook_port, args.concurrency)
+    await wait_for_replies(mock, released, args.timeout)
+    elapsed = time.perf_counter() - started
+
+    if application.updater.running:
+        await application.updater.stop()
+    if runner:
+        await runner.cleanup()
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+    await mock.stop()
+
+    latencies = sorted(
+        mock.first_reply[chat] - at for chat, at in released.items() if chat in mock.first_reply
+    )
+    return elapsed, latencies, len(released)
+
+
+def report(mode, elapsed, latencies, total):
+    if not latencies:
+        print(f"{mode:<8} no replies received")
+        return
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(
+        f"{mode:<8} {len(latencies)}/{total} handled in {elapsed:6.2f}s  "
+        f"{len(latencies) / elapsed:8.1f} updates/s  p50={p50:8.1f} ms  p99={p99:8.1f} ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("polling", "webhook", "both"), default="both")
+    parser.add_argument("--updates", help="JSONL file of recorded updates")
+    parser.add_argument("--count", type=int, default=2000, help="number of synthetic /start updates")
+    parser.add_argument("--concurrency", type=int, default=40, help="parallel webhook requests")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-port", type=int, default=8443)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    modes = ("polling", "webhook") if args.mode == "both" else (args.mode,)
+    for index, mode in enumerate(modes):
+        # Use fresh users per mode so both runs see the same amount of work
+        updates = load_updates(args.updates, args.count, 10_000_000 * (index + 1))
+        report(mode, *await run_mode(mode, updates, args))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
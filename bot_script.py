@@ -1,15 +1,39 @@
 import logging
-from telegram import BotCommand, Update, InputFile, BotCommandScopeChat, BotCommandScopeDefault, Bot
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram import BotCommand, Update, InputFile, Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import (
+    ApplicationBuilder, ApplicationHandlerStop, CallbackQueryHandler, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes,
+)
 from telegram.error import TelegramError, RetryAfter, TimedOut
-from telegram.request import HTTPXRequest
-from telegram.helpers import escape_markdown
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple, Union
+import asyncio
+import csv
+import io
 import os
-import re
+import time
 from dotenv import load_dotenv
 import json
 from datetime import datetime
+from broadcast import BroadcastEngine, PacedBucket, RateLimiter
+from broadcast_workers import BROADCAST_WORKERS, BroadcastWorkerPool, shared_limiter
+from delivery_queue import SENT, DeliveryQueue
+from storage import Store
+from persistence import WriteBehind
+from update_processor import BackpressureQueue, ChatOrderedUpdateProcessor
+from chat_cache import ChatCache, ChatProfile
+from subscribers import Subscriber, SubscriberRegistry
+from media_cache import MediaCache, content_hash, download, is_url
+from media_groups import MediaGroupAggregator
+from senders import album_media, make_sender
+from command_scopes import CommandScopeManager
+from user_views import SHOW_USERS_PAGE_SIZE, UserListView, UserRow, export_csv, parse_filter, view_state
+from scheduler import Scheduler, split_schedule
+from transport import configure_transport
+from recipient_health import HEALTH_PRUNE, RecipientHealth
+from verification import VerificationNotifier
+from throttle import InboundThrottle
+from metrics import (
+    METRICS_LISTEN, METRICS_PORT, PERSIST_PENDING, STARTUP_SECONDS, UPDATE_QUEUE_DEPTH, UPDATES_IN_FLIGHT, start_metrics_server, timed_handler,
+)
 
 
 
@@ -28,10 +52,25 @@ FORWARD_LIST_FILE = "forward_list.json"
 
 # Assuming these are globally defined
 USER_DATA: Dict[int, Dict[str, Any]] = {}
-FORWARD_LIST: Dict[str, int] = {}
+# The forward list: one entry per user, keyed by user id
+FORWARD_LIST = SubscriberRegistry()
+
+# How broadcasts reach recipients by default: "send" re-sends the media to every
+# chat, "copy" copies the channel post. Can be overridden per broadcast with
+# --send / --copy in the /send_image arguments or the photo caption.
+BROADCAST_METHOD = os.getenv("BROADCAST_METHOD", "send")
+# Seconds copied channel posts are collected before going out in one copy_messages
+COPY_BATCH_WINDOW = float(os.getenv("COPY_BATCH_WINDOW", "2.0"))
+# Bot API limit on message ids per copy_messages call
+COPY_MESSAGES_LIMIT = 100
+# Seconds a scheduled broadcast is spread over when no --over is given (0 sends at full rate)
+SCHEDULE_DEFAULT_SPREAD = float(os.getenv("SCHEDULE_DEFAULT_SPREAD", "0"))
+
+# Parallel profile lookups allowed while running a bulk command
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "10"))
 
 # Replace these with the user IDs of authorized users
-AUTHORIZED_USERS = [1704356941, 7484493290, 265243029, 6564890289]  # Replace with actual Telegram user IDs
+AUTHORIZED_USERS = {1704356941, 7484493290, 265243029, 6564890289}  # Replace with actual Telegram user IDs
 
 CHANNEL_ID = "-1002454781187"  # Example channel ID
 
@@ -41,7 +80,66 @@ VERIFIED_USERS = {}
 
 USER_DATA_FILE = "user_data.json"
 
-request = HTTPXRequest(read_timeout=60)
+# "polling" (default) or "webhook"; webhook settings live in webhook.py
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Broadcast worker processes are started with spawn, which runs this file again (as
+# __mp_main__) in every worker before worker_main. They only need worker_main, so the
+# stores, the delivery queue and the shared rate file are not opened there.
+IN_BROADCAST_WORKER = __name__ == "__mp_main__"
+
+# Keyed SQLite store backing USER_DATA, VERIFIED_USERS and FORWARD_LIST.
+# The JSON files above are only read once, to migrate existing data.
+STORE = None if IN_BROADCAST_WORKER else Store()
+# Handlers only mark records dirty; changes are flushed to STORE in batches
+PERSISTENCE = WriteBehind(STORE)
+
+# Cached get_chat lookups, pre-warmed from USER_DATA at startup
+CHAT_CACHE = ChatCache()
+
+# Content hash -> file_id of images already uploaded to Telegram
+MEDIA_CACHE = MediaCache()
+
+# Shared fan-out engine used by every broadcast (see broadcast.py for tuning).
+# With worker processes enabled it draws from the same send budget as they do.
+BROADCASTER = BroadcastEngine(shared_limiter() if BROADCAST_WORKERS and not IN_BROADCAST_WORKER else None)
+
+# Worker processes taking over large broadcasts (BROADCAST_WORKERS=0 disables them)
+WORKER_POOL = BroadcastWorkerPool(BOT_TOKEN)
+
+# Durable record of every broadcast so an interrupted one can be resumed
+DELIVERY_QUEUE = None if IN_BROADCAST_WORKER else DeliveryQueue()
+
+
+def save_health(chat_id, record):
+    """Persist (or forget) the failure record of one chat."""
+    if record is None:
+        PERSISTENCE.delete("recipient_health", chat_id)
+    else:
+        PERSISTENCE.upsert("recipient_health", chat_id, record)
+
+
+def drop_dead_chat(chat_id, kind):
+    """Remove a chat that can no longer be reached from the forward list.
+
+    Its dead health record is kept, so the chat stays skipped if it is added
+    back; /start from the user clears it.
+    """
+    if not HEALTH_PRUNE:
+        return
+    subscriber = FORWARD_LIST.by_chat(chat_id)
+    if subscriber:
+        remove_from_forward_list(subscriber.user_id)
+        logger.info(f"Removed @{subscriber.username} (Chat ID: {chat_id}) from the forward list: {kind}.")
+
+
+# Failing recipients are skipped with a back-off; dead ones are pruned
+HEALTH = RecipientHealth(on_change=save_health, on_dead=drop_dead_chat)
+
+# Access requests from new users, sent to the admins in batches
+VERIFICATIONS = VerificationNotifier(AUTHORIZED_USERS)
+# Per-user limits on inbound updates, checked before any handler (see throttle.py)
+THROTTLE = InboundThrottle(AUTHORIZED_USERS)
 
 # Configure logging
 logging.basicConfig(
@@ -54,37 +152,301 @@ def is_authorized(user_id: int) -> bool:
     """Check if the user is authorized."""
     return user_id in AUTHORIZED_USERS
 
-async def safe_send_photo(bot, chat_id, file_id, caption=""):
+def paced_engine(pending, spread_until):
+    """Return an engine that spreads `pending` sends evenly until the spread_until timestamp."""
+    window = spread_until - time.time()
+    if window <= 0 or not pending:
+        return BROADCASTER
+    shared = BROADCASTER.limiter.bucket
+    rate = min(shared.rate, max(pending, 1) / window)
+    # Paced sends still draw from the shared budget, so other broadcasts keep their share
+    return BroadcastEngine(RateLimiter(rate, bucket=PacedBucket(rate, shared)))
+
+
+async def run_broadcast_job(bot, job_id):
+    """Deliver the pending recipients of a stored broadcast job."""
+    job = DELIVERY_QUEUE.get_job(job_id)
+    pending = DELIVERY_QUEUE.counts(job_id).get("pending", 0)
+    # Only this run's failures; a resumed job must not count earlier ones again
+    failures = []
+
+    def on_result(chat_id, error):
+        if error is not None:
+            failures.append((chat_id, error))
+
+    # Stored with the job, so a resumed job keeps to its original window
+    spread_until = job["payload"].get("spread_until")
+    if spread_until:
+        engine = paced_engine(pending, spread_until)
+    elif WORKER_POOL.wants(pending):
+        # Large audiences are sent from other processes so update handling stays responsive
+        counts = await WORKER_POOL.run(job_id, DELIVERY_QUEUE, on_failure=on_result)
+        update_health(job_id, failures, pending)
+        return counts
+    else:
+        engine = BROADCASTER
+    counts = await DELIVERY_QUEUE.run(job_id, engine, make_sender(bot, job["kind"], job["payload"]), on_result=on_result)
+    update_health(job_id, failures, pending)
+    return counts
+
+
+def update_health(job_id, failures, attempted):
+    """Feed the failures of one run of a job, and the job's successes, to the recipient health tracker."""
+    HEALTH.record_run(failures, attempted)
+    if len(HEALTH):
+        # Recording a success twice is harmless
+        for chat_id, _ in DELIVERY_QUEUE.results(job_id, SENT):
+            HEALTH.record_success(chat_id)
+
+
+def recipients():
+    """Chat ids the next broadcast goes to: the forward list minus failing chats."""
+    return HEALTH.filter(FORWARD_LIST.chat_ids())  # Exactly one entry per chat
+
+
+def broadcast_payload(payload, spread=None):
+    """Add the end of the delivery window to a job payload when a spread (seconds) is given."""
+    if spread:
+        payload["spread_until"] = time.time() + spread
+    return payload
+
+
+def create_broadcast_job(kind, payload, chat_ids, on_queued=None):
+    """Store a delivery job; on_queued() is called once it is stored (and so resumable)."""
+    job_id = DELIVERY_QUEUE.create_job(kind, payload, chat_ids)
+    if on_queued:
+        on_queued()
+    return job_id
+
+
+async def broadcast_photo(bot, file_id, caption="", spread=None, on_queued=None):
+    """Queue a photo for every chat in the forward list and deliver it."""
+    payload = broadcast_payload({"photo": file_id, "caption": caption}, spread)
+    chat_ids = recipients()
+    job_id = create_broadcast_job("photo", payload, chat_ids, on_queued)
+    logger.info(f"Created broadcast job {job_id} for {len(chat_ids)} chats.")
+    return await run_broadcast_job(bot, job_id)
+
+
+async def broadcast_media_group(bot, file_ids, caption="", spread=None, on_queued=None):
+    """Queue an album for every chat in the forward list and deliver it, one send per chat."""
+    payload = broadcast_payload({"photos": file_ids, "caption": caption}, spread)
+    chat_ids = recipients()
+    job_id = create_broadcast_job("media_group", payload, chat_ids, on_queued)
+    logger.info(f"Created album broadcast job {job_id} ({len(file_ids)} photos) for {len(chat_ids)} chats.")
+    return await run_broadcast_job(bot, job_id)
+
+
+async def broadcast_copies(bot, message_ids, caption=None, spread=None, on_queued=None):
+    """Copy channel posts to every chat in the forward list, batching up to 100 per call."""
+    chat_ids = recipients()
+    counts: Dict[str, int] = {}
+    chunks = range(0, len(message_ids), COPY_MESSAGES_LIMIT)
+    for start in chunks:
+        payload = {
+            "from_chat_id": CHANNEL_ID,
+            "message_ids": message_ids[start:start + COPY_MESSAGES_LIMIT],
+            "caption": caption,
+        }
+        # Every chunk gets its share of the window
+        broadcast_payload(payload, spread / len(chunks) if spread else None)
+        job_id = create_broadcast_job("copy", payload, chat_ids, on_queued)
+        logger.info(f"Created copy broadcast job {job_id} ({len(payload['message_ids'])} posts) for {len(chat_ids)} chats.")
+        for state, count in (await run_broadcast_job(bot, job_id)).items():
+            counts[state] = counts.get(state, 0) + count
+    return counts
+
+
+def split_broadcast_method(words):
+    """Pull a --send / --copy flag out of a list of words; returns (method, remaining words)."""
+    method = BROADCAST_METHOD
+    remaining = []
+    for word in words:
+        if word in ("--send", "--copy"):
+            method = word[2:]
+        else:
+            remaining.append(word)
+    return method, remaining
+
+
+async def deliver_album(bot, file_ids, caption="", method=BROADCAST_METHOD, spread=None, on_queued=None):
+    """Post an album to the channel and broadcast it; returns the delivery counts."""
+    messages = []
     try:
-        await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption)
-    except Exception as e:
-        logger.error(f"Failed to send photo to {chat_id}: {e}")
-
-
-async def set_bot_commands(application, user_id=None, is_authorized=False) -> None:
-    """Set up bot commands based on user roles."""
-    if is_authorized:
-        # Commands for authorized users
-        commands = [
-            BotCommand("start", "Start the bot and display the menu"),
-            BotCommand("add_user", "Add a username to the forward list"),
-            BotCommand("show_users", "Show all usernames in the forward list"),
-            BotCommand("remove_user", "Remove a username from the forward list"),
-            BotCommand("clear_users", "Clear the forward list"),
-            BotCommand("authorize_user", "Authorize user"),
-            BotCommand("send_image", "Manually send an image to the forward list"),  # New command
-        ]
-        scope = BotCommandScopeChat(user_id)
+        messages = await bot.send_media_group(chat_id=CHANNEL_ID, media=album_media(file_ids, caption))
+        logger.info(f"Album of {len(file_ids)} photos sent to channel {CHANNEL_ID}.")
+    except TelegramError as e:
+        logger.error(f"Failed to send album to channel {CHANNEL_ID}: {e}")
+
+    if method == "copy" and messages:
+        # copy_messages keeps the posts grouped as an album
+        return await broadcast_copies(bot, [message.message_id for message in messages], spread=spread, on_queued=on_queued)
+    return await broadcast_media_group(bot, file_ids, caption, spread=spread, on_queued=on_queued)
+
+
+async def forward_album(context, photos) -> None:
+    """Send a buffered album to the channel and the forward list, or schedule it."""
+    file_ids = [file_id for file_id, _, _ in photos]
+    caption, chat_id = next(((caption, chat_id) for _, caption, chat_id in photos if caption), ("", None))
+    method, words = split_broadcast_method(caption.split())
+    try:
+        due, spread, words = split_schedule(words)
+    except ValueError as e:
+        # handle_image already rejected bad captions; anything left is sent now
+        logger.warning(f"Ignoring album schedule: {e}")
+        due = spread = None
+    caption = " ".join(words)
+    if due:
+        payload = {"photos": file_ids, "caption": caption, "method": method}
+        job_id = schedule_broadcast(due, "album", payload, spread, chat_id)
+        # handle_image acknowledged the first photo before the caption was known
+        try:
+            await context.bot.send_message(chat_id=chat_id, text=f"Album scheduled for {format_due(due)} (id {job_id}).")
+        except TelegramError as e:
+            logger.warning(f"Could not confirm scheduled album {job_id}: {e}")
+        return
+    await deliver_album(context.bot, file_ids, caption, method, spread)
+
+
+async def forward_copies(context, message_ids) -> None:
+    """Copy a batch of channel posts to the forward list in one call per chat."""
+    await broadcast_copies(context.bot, message_ids)
+
+
+# Photos of one album arrive as separate updates; send them on together
+MEDIA_GROUPS = MediaGroupAggregator(forward_album)
+# Channel posts broadcast in copy mode are collected and copied together
+COPY_BATCHES = MediaGroupAggregator(forward_copies, window=COPY_BATCH_WINDOW)
+
+
+def save_scheduled(job_id, record):
+    """Persist (or forget) a scheduled broadcast."""
+    if record is None:
+        PERSISTENCE.delete("scheduled", job_id)
+    else:
+        PERSISTENCE.upsert("scheduled", job_id, record)
+
+
+async def run_scheduled(bot, job_id, record):
+    """Deliver a scheduled broadcast and report the result to the chat that scheduled it."""
+    payload = record["payload"]
+    spread = record.get("spread") or SCHEDULE_DEFAULT_SPREAD
+    logger.info(f"Running scheduled broadcast {job_id} ({record['action']}).")
+    # Kept until the delivery job exists: a restart while the photo is being
+    # published runs it again, one after that is resumed by the delivery queue
+    def on_queued():
+        SCHEDULER.done(job_id)
+
+    if record["action"] == "album":
+        counts = await deliver_album(bot, payload["photos"], payload["caption"], payload["method"], spread, on_queued)
+    else:
+        counts = await deliver_image(bot, payload["image"], payload["caption"], payload["method"], spread, on_queued)
+    if record.get("report_chat"):
+        try:
+            await bot.send_message(
+                chat_id=record["report_chat"],
+                text=f"Scheduled broadcast {job_id} sent to {counts.get('sent', 0)} users ({counts.get('failed', 0)} failed).",
+            )
+        except TelegramError as e:
+            logger.warning(f"Could not report scheduled broadcast {job_id}: {e}")
+
+
+# Broadcasts waiting for their send time; stored in STORE so they survive restarts
+SCHEDULER = Scheduler(run_scheduled, on_change=save_scheduled)
+
+
+def format_due(due: float) -> str:
+    return datetime.fromtimestamp(due).strftime("%Y-%m-%d %H:%M")
+
+
+def schedule_broadcast(due, action, payload, spread=None, report_chat=None) -> str:
+    """Store a broadcast to be delivered at the due timestamp; returns the job id."""
+    job_id = SCHEDULER.add(due, {"action": action, "payload": payload, "spread": spread, "report_chat": report_chat})
+    logger.info(f"Scheduled {action} broadcast {job_id} for {format_due(due)}.")
+    return job_id
+
+
+async def post_init(application) -> None:
+    """Start background services once the application is initialized."""
+    PERSISTENCE.start()
+    SCHEDULER.start(application.bot)
+    if METRICS_PORT:
+        try:
+            application.bot_data["metrics_server"] = await start_metrics_server(METRICS_LISTEN, METRICS_PORT)
+        except OSError as e:
+            logger.error(f"Could not serve metrics on {METRICS_LISTEN}:{METRICS_PORT}: {e}")
+    await resume_broadcasts(application)
+
+
+async def post_stop(application) -> None:
+    """Send queued API calls while the bot can still make them (shutdown closes its client)."""
+    SCHEDULER.stop()
+    try:
+        await VERIFICATIONS.close()
+    finally:
+        await COMMAND_SCOPES.close()
+
+
+async def post_shutdown(application) -> None:
+    """Write any pending changes before the process exits."""
+    try:
+        await PERSISTENCE.close()
+    finally:
+        # Let a running snapshot compaction finish
+        STORE.close()
+        server = application.bot_data.pop("metrics_server", None)
+        if server:
+            server.close()
+            await server.wait_closed()
+
+
+async def resume_broadcasts(application) -> None:
+    """Resume broadcast jobs that were interrupted by a restart."""
+    # Also covers bots that have not finished a broadcast in a while
+    DELIVERY_QUEUE.purge_finished()
+    for job_id in DELIVERY_QUEUE.unfinished_jobs():
+        logger.info(f"Resuming interrupted broadcast job {job_id}.")
+        application.create_task(run_broadcast_job(application.bot, job_id))
+
+
+# Commands for authorized users
+ADMIN_COMMANDS = [
+    BotCommand("start", "Start the bot and display the menu"),
+    BotCommand("add_user", "Add a username to the forward list"),
+    BotCommand("show_users", "Show all usernames in the forward list"),
+    BotCommand("remove_user", "Remove a username from the forward list"),
+    BotCommand("clear_users", "Clear the forward list"),
+    BotCommand("authorize_user", "Authorize user"),
+    BotCommand("send_image", "Manually send an image to the forward list"),  # New command
+    BotCommand("scheduled", "List scheduled broadcasts"),
+    BotCommand("unschedule", "Cancel a scheduled broadcast"),
+]
+
+# Commands for public users; this is also the default menu
+PUBLIC_COMMANDS = [
+    BotCommand("start", "Start the bot and display the menu"),
+]
+
+
+def save_command_scope(key, record):
+    """Persist (or forget) the menu applied to one chat."""
+    if record is None:
+        PERSISTENCE.delete("command_scopes", key)
     else:
-        # Commands for public users
-        commands = [
-            BotCommand("start", "Start the bot and display the menu"),
-        ]
-        scope = BotCommandScopeChat(user_id) if user_id else BotCommandScopeDefault()
+        PERSISTENCE.upsert("command_scopes", key, record)
+
+
+# Remembers each chat's menu so set_my_commands is only called when a role changes
+COMMAND_SCOPES = CommandScopeManager(
+    {"public": PUBLIC_COMMANDS, "admin": ADMIN_COMMANDS}, "public", on_applied=save_command_scope
+)
+
 
-    # Apply commands for the given scope
-    await application.bot.set_my_commands(commands, scope=scope)
-    await application.bot.set_my_commands(commands)
+def refresh_commands(bot, user_id: int) -> None:
+    """Queue a menu update for a user whose role may have changed."""
+    subscriber = FORWARD_LIST.get(user_id)
+    chat_id = subscriber.chat_id if subscriber else user_id  # Private chat ids equal user ids
+    COMMAND_SCOPES.set_role(bot, chat_id, "admin" if user_id in AUTHORIZED_USERS else "public")
 
 async def authorize_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Authorize a user (admin-only)."""
@@ -112,14 +474,17 @@ async def authorize_user(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     try:
         # Fetch user details from Telegram
-        target_user_chat = await context.bot.get_chat(target_user_id)
+        target_user_chat = await CHAT_CACHE.get(context.bot, target_user_id)
         target_username = target_user_chat.username or None
         target_first_name = target_user_chat.first_name or "Unknown"
         target_display_name = f"@{target_username}" if target_username else target_first_name
 
         # Authorize the user and add them to the forward list
         AUTHORIZED_USERS.add(target_user_id)
-        FORWARD_LIST[target_user_id] = target_display_name  # Use user ID as the key
+        add_to_forward_list(Subscriber(target_user_id, target_user_chat.id, target_username, target_display_name))
+        # Listed users show as admins now even though the list itself did not change
+        USER_VIEW.invalidate()
+        refresh_commands(context.bot, target_user_id)
 
         await update.message.reply_text(f"✅ {target_display_name} (ID: {target_user_id}) has been authorized.")
         logger.info(f"Admin @{admin_username} (ID: {admin_id}) authorized user {target_display_name} (ID: {target_user_id}).")
@@ -129,11 +494,6 @@ async def authorize_user(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text(f"❌ Failed to authorize user ID {target_user_id}. Error logged.")
 
 
-def escape_markdown(text: str) -> str:
-    """Escape special characters for MarkdownV2."""
-    special_chars = r"_*[]()~`>#+-=|{}.!"
-    return re.sub(f"([{re.escape(special_chars)}])", r"\\\1", text)
-
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a welcome message, dynamically set commands, and request verification for new users."""
     user_id = update.effective_user.id
@@ -157,95 +517,80 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "chat_id": chat_id,
         "start_time": start_time,
     }
-    save_user_data()  # Save to JSON file
+    save_user_data(user_id)  # Persist this user only
+    USER_VIEW.invalidate()
+    CHAT_CACHE.put(user_id, ChatProfile.from_user_data(user_id, USER_DATA[user_id]))
+    # A user who blocked the bot and came back is reachable again
+    HEALTH.forget(chat_id)
 
-    logger.info(f"Saved user: {full_name} (@{username}, ID: {user_id}, Chat ID: {chat_id}, Started at: {start_time})")
+    # Runs for every /start; keep it cheap when debug logging is off
+    logger.debug("Saved user: %s (@%s, ID: %s, Chat ID: %s, Started at: %s)", full_name, username, user_id, chat_id, start_time)
 
     # Check if the user is already verified
     if str(user_id) in VERIFIED_USERS:
-        if username not in FORWARD_LIST:
-            FORWARD_LIST[username] = chat_id
-            logger.info(f"Verified user @{username} (Chat ID: {chat_id}) added to forward list.")
-        await set_bot_commands(context.application, user_id=user_id, is_authorized=False)
+        if add_to_forward_list(Subscriber(user_id, chat_id, username)):
+            logger.info("Verified user @%s (Chat ID: %s) added to forward list.", username, chat_id)
+        COMMAND_SCOPES.set_role(context.bot, chat_id, "public")
         await update.message.reply_text("Welcome back! We are preparing your slips.")
         return
 
     # If user is authorized
     if user_id in AUTHORIZED_USERS:
-        await set_bot_commands(context.application, user_id=user_id, is_authorized=True)
+        COMMAND_SCOPES.set_role(context.bot, chat_id, "admin")
         await update.message.reply_text(
             "Welcome! You are authorized to manage this bot. Full menu enabled."
         )
         # Automatically add authorized users to the forward list
-        if username not in FORWARD_LIST:
-            FORWARD_LIST[username] = chat_id
+        if add_to_forward_list(Subscriber(user_id, chat_id, username)):
             logger.info(f"Authorized user @{username} (Chat ID: {chat_id}) added to forward list.")
         return
 
-    # Handle unauthorized users: send a verification request to authorized users
-    verification_request = (
-        f"🔔 *Access Request*\n"
-        f"{escape_markdown(full_name)} "
-        f"@{escape_markdown(username)}\n"
-        f"ID: {user_id}\n\n"
-        f"Approve: `/add_user {user_id}`\n"
-        f"Reject: `/reject {user_id}`"
-    )
-
-    logger.debug(f"Verification message: {verification_request}")
-
-    for auth_user_id in AUTHORIZED_USERS:
-        try:
-            await context.bot.send_message(
-                chat_id=auth_user_id,
-                text=verification_request,
-                parse_mode="MarkdownV2"
-            )
-        except Exception as e:
-            logger.error(f"Failed to send verification request to authorized user {auth_user_id}: {e}")
-
-    await set_bot_commands(context.application, user_id=user_id, is_authorized=False)
+    # Handle unauthorized users: queue a verification request for the authorized users
+    COMMAND_SCOPES.set_role(context.bot, chat_id, "public")
+    if not VERIFICATIONS.submit(context.bot, user_id, full_name, username):
+        await update.message.reply_text("Your access request is already waiting for the admins.")
+        return
     await update.message.reply_text(
         "Welcome! Your access request has been sent to the admins for verification."
     )
-    logger.info(f"Verification request for {full_name} (@{username}, ID: {user_id}) sent to admins.")
+    logger.info("Verification request for %s (@%s, ID: %s) queued for admins.", full_name, username, user_id)
 
-# Load forward list from file
+# Load forward list from the store
 def load_forward_list():
-    global FORWARD_LIST
-    if os.path.exists(FORWARD_LIST_FILE):
-        with open(FORWARD_LIST_FILE, "r") as file:
-            try:
-                FORWARD_LIST = json.load(file)
-                print("Forward list loaded successfully.")
-            except json.JSONDecodeError:
-                print("Forward list file is empty or corrupted.")
-                FORWARD_LIST = {}
-    else:
-        FORWARD_LIST = {}
-
-
-# Save forward list to file
-def save_forward_list():
-    with open(FORWARD_LIST_FILE, "w") as file:
-        json.dump(FORWARD_LIST, file, indent=4)
-
-
-async def add_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Add a user to the forward list based on user ID."""
-    if not context.args:
-        await update.message.reply_text("⚠️ Please provide a user ID. Example: /add_user <user_id>")
-        return
-
-    try:
-        user_id = int(context.args[0])  # Extract user ID from command arguments
-    except ValueError:
-        await update.message.reply_text("❌ Invalid user ID. Please provide a numeric user ID.")
-        return
-
+    for key, record in STORE.forward_list.load_all().items():
+        if "user_id" not in record:
+            # Legacy entry keyed by username or id; private chat ids equal user ids
+            chat_id = record.get("chat_id")
+            if not isinstance(chat_id, int):
+                PERSISTENCE.delete("forward_list", key)
+                continue
+            username = None if key.lstrip("-").isdigit() else key
+            record = {"user_id": chat_id, "chat_id": chat_id, "username": username}
+            PERSISTENCE.delete("forward_list", key)
+            FORWARD_LIST.add(Subscriber.from_record(record))
+            save_forward_list(chat_id)
+            continue
+        FORWARD_LIST.add(Subscriber.from_record(record))
+    logger.info(f"Forward list loaded successfully. Total entries: {len(FORWARD_LIST)}")
+
+
+# Save forward list entries to the store
+def save_forward_list(user_id=None):
+    """Schedule one forward list entry (or all of them) to be written."""
+    subscribers = [FORWARD_LIST.get(user_id)] if user_id is not None else FORWARD_LIST
+    for subscriber in subscribers:
+        PERSISTENCE.upsert("forward_list", subscriber.user_id, subscriber.to_record())
+
+
+async def resolve_user(bot, user_id):
+    """Look up a user (cached), record them in USER_DATA and return them as a Subscriber.
+
+    Falls back to the stored USER_DATA when the lookup fails; returns None if
+    nothing is known about the user.
+    """
     try:
         # Attempt to fetch user details from Telegram API
-        user_details = await context.bot.get_chat(user_id)
+        user_details = await CHAT_CACHE.get(bot, user_id)
         username = user_details.username or None
         first_name = user_details.first_name or "Unknown"
         last_name = user_details.last_name or ""
@@ -262,62 +607,154 @@ async def add_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             "chat_id": chat_id,
             "user_id": chat_id
         }
-        save_user_data()  # Persist updated user data
+        save_user_data(user_id)  # Persist updated user data
+        USER_VIEW.invalidate()
     except Exception as e:
         # Handle cases where `getChat` fails
         logger.error(f"Error fetching details for user ID {user_id}: {e}")
 
         # Fallback to use data from `USER_DATA`
         user_data = USER_DATA.get(user_id)
-        if user_data:
-            username = user_data.get("username", None)
-            full_name = user_data.get("full_name", "Unknown")
-            display_name = f"@{username}" if username else full_name
-            chat_id = user_data.get("chat_id", user_id)
-        else:
-            await update.message.reply_text(f"❌ Failed to fetch or retrieve saved details for user ID {user_id}.")
-            return
+        if not user_data:
+            return None
+        username = user_data.get("username", None)
+        full_name = user_data.get("full_name", "Unknown")
+        display_name = f"@{username}" if username else full_name
+        chat_id = user_data.get("chat_id", user_id)
+
+    return Subscriber(user_id, chat_id, username, display_name)
+
+def add_to_forward_list(subscriber: Subscriber) -> bool:
+    """Add a user to the forward list; returns False if they were already in it."""
+    if subscriber.user_id in FORWARD_LIST:
+        return False
+    FORWARD_LIST.add(subscriber)
+    save_forward_list(subscriber.user_id)
+    VERIFICATIONS.resolve(subscriber.user_id)
+    return True
+
+async def add_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Add a user to the forward list based on user ID."""
+    if not context.args:
+        await update.message.reply_text("⚠️ Please provide a user ID. Example: /add_user <user_id>")
+        return
+
+    try:
+        user_id = int(context.args[0])  # Extract user ID from command arguments
+    except ValueError:
+        await update.message.reply_text("❌ Invalid user ID. Please provide a numeric user ID.")
+        return
+
+    subscriber = await resolve_user(context.bot, user_id)
+    if subscriber is None:
+        await update.message.reply_text(f"❌ Failed to fetch or retrieve saved details for user ID {user_id}.")
+        return
+    display_name = subscriber.display_name
 
     # Add to FORWARD_LIST if not already present
-    if user_id in FORWARD_LIST:
+    if not add_to_forward_list(subscriber):
         await update.message.reply_text(f"⚠️ User {display_name} (ID: {user_id}) is already in the forward list.")
     else:
-        FORWARD_LIST[user_id] = display_name
         await update.message.reply_text(f"✅ Added user {display_name} (ID: {user_id}) to the forward list.")
         logger.info(f"✅ Added user {display_name} (ID: {user_id}) to the forward list.")
 
+def describe_subscriber(subscriber: Subscriber) -> UserRow:
+    """Build the /show_users row for a forward list entry from USER_DATA."""
+    user_data = USER_DATA.get(subscriber.user_id, {})
+    if subscriber.user_id in AUTHORIZED_USERS:
+        status = "admin"
+    elif str(subscriber.user_id) in VERIFIED_USERS:
+        status = "verified"
+    else:
+        status = "listed"
+    return UserRow(subscriber, user_data.get("full_name", subscriber.display_name), status, user_data.get("start_time", ""))
+
+
+# Sorted forward list snapshot behind /show_users, rebuilt when the list changes or is
+# invalidated (admin, verified and USER_DATA changes the list version does not see)
+USER_VIEW = UserListView(FORWARD_LIST, describe_subscriber)
+
+
+def render_users_page(status, text, page):
+    """Return the text and keyboard of one /show_users page."""
+    rows = USER_VIEW.rows(status, text)
+    items, page, pages = USER_VIEW.page(rows, page)
+    filters_used = ", ".join(part for part in (f"status: {status}" if status else "", f'"{text}"' if text else "") if part)
+    header = f"Forward list: {len(rows)} users" + (f" ({filters_used})" if filters_used else "") + f", page {page + 1}/{pages}"
+    lines = [header, ""] + [row.line() for row in items] if items else [header, "", "No matching users."]
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️ Prev", callback_data=f"users:page:{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Next ▶️", callback_data=f"users:page:{page + 1}"))
+    keyboard = [buttons] if buttons else []
+    keyboard.append([InlineKeyboardButton("⬇️ Export CSV", callback_data="users:csv")])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+
+async def send_users_csv(bot, chat_id, status, text) -> None:
+    """Send the (filtered) forward list to chat_id as a CSV document."""
+    rows = USER_VIEW.rows(status, text)
+    with export_csv(rows) as document:
+        await bot.send_document(
+            chat_id=chat_id,
+            document=InputFile(document, filename="forward_list.csv"),
+            caption=f"Forward list export: {len(rows)} users.",
+        )
+
+
 async def show_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Show the forward list with display names and their chat IDs."""
+    """Show the forward list one page at a time.
 
-    global USER_DATA1
+    Usage: /show_users [search text] [status:admin|verified|listed] [--csv]
+    """
+    if not is_authorized(update.effective_user.id):
+        await update.message.reply_text("⛔ You are not authorized to use this command.")
+        return
 
-    if FORWARD_LIST:
-        with open(USER_DATA_FILE, "r") as f:
-            USER_DATA1 = json.load(f)
-            logger.info("User data loaded successfully.")
+    if not FORWARD_LIST:
+        await update.message.reply_text("The forward list is empty.")
+        return
 
-        response_lines = ["Forward list:"]
-        for user_id, chat_id in FORWARD_LIST.items():
-            # Retrieve details from USER_DATA
-            user_data = USER_DATA1.get(user_id, {})
-            username = user_data.get("username", "Unknown")
-            full_name = user_data.get("full_name", "Unknown User")
+    words = list(context.args or [])
+    export = "--csv" in words
+    status, text = parse_filter([word for word in words if word != "--csv"])
+    if export:
+        await send_users_csv(context.bot, update.effective_chat.id, status, text)
+        return
 
-            # Format display name
-            if username != "Unknown":
-                display_name = f"@{username} ({full_name})"
-            else:
-                display_name = full_name
+    message_text, keyboard = render_users_page(status, text, 0)
+    message = await update.message.reply_text(message_text, reply_markup=keyboard)
+    view_state(context.chat_data, message.message_id, (status, text))
 
-            response_lines.append(f"{full_name}: {chat_id}")
 
-            logger.info(f"USER_DATA1: {USER_DATA1}")
-            logger.info(f"USER_DATA for testing: {user_data}")
+async def show_users_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the Prev / Next / Export CSV buttons of a /show_users message."""
+    query = update.callback_query
+    if not is_authorized(update.effective_user.id):
+        await query.answer("You are not authorized to do this.", show_alert=True)
+        return
 
-        # Send the response to the user
-        await update.message.reply_text("\n".join(response_lines))
-    else:
-        await update.message.reply_text("The forward list is empty.")
+    status, text = view_state(context.chat_data, query.message.message_id)
+    action = query.data.split(":")
+    if action[1] == "csv":
+        await query.answer("Preparing the export…")
+        await send_users_csv(context.bot, query.message.chat_id, status, text)
+        return
+
+    await query.answer()
+    message_text, keyboard = render_users_page(status, text, int(action[2]))
+    await query.edit_message_text(message_text, reply_markup=keyboard)
+
+def remove_from_forward_list(key) -> bool:
+    """Remove a user by id or username; returns False if they were not listed."""
+    subscriber = FORWARD_LIST.resolve(key)
+    if subscriber is None:
+        return False
+    FORWARD_LIST.remove(subscriber.user_id)
+    PERSISTENCE.delete("forward_list", subscriber.user_id)
+    return True
 
 async def remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Remove a username from the forward list."""
@@ -329,26 +766,84 @@ async def remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     if username.startswith("@"):
         username = username[1:]  # Remove '@' if provided
 
-    if username in FORWARD_LIST:
-        del FORWARD_LIST[username]
+    if remove_from_forward_list(username):
         await update.message.reply_text(f"Removed @{username} from the forward list.")
         logger.info(f"Removed @{username} from the forward list.")
     else:
         await update.message.reply_text(f"Username @{username} is not in the forward list.")
 
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show hit/miss counters of the chat profile cache (admin-only)."""
+    if not is_authorized(update.effective_user.id):
+        await update.message.reply_text("⛔ You are not authorized to use this command.")
+        return
+
+    stats = CHAT_CACHE.stats()
+    scopes = COMMAND_SCOPES.stats()
+    health = HEALTH.stats()
+    requests = VERIFICATIONS.stats()
+    throttle = THROTTLE.stats()
+    await update.message.reply_text(
+        f"Chat cache: {stats['size']}/{stats['maxsize']} entries\n"
+        f"Hits: {stats['hits']}, misses: {stats['misses']}, coalesced: {stats['coalesced']}\n"
+        f"Evictions: {stats['evictions']}, hit rate: {stats['hit_rate']:.1%}\n"
+        f"Command menus: {scopes['scoped_chats']} chats scoped, {scopes['pending']} pending, "
+        f"{scopes['api_calls']} API calls, {scopes['skipped']} skipped\n"
+        f"Failing recipients: {health['tracked']} tracked, {health['backing_off']} backing off, {health['dead']} dead\n"
+        f"Access requests: {requests['pending']} pending, {requests['requests']} sent to admins "
+        f"in {requests['messages']} messages, {requests['duplicates']} repeats dropped\n"
+        f"Inbound: {throttle['allowed']} updates allowed, {throttle['rate']} over the rate limit, "
+        f"{throttle['duplicate']} repeats and {throttle['redelivered']} redeliveries dropped "
+        f"({throttle['tracked']} users tracked)"
+    )
+
 async def clear_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Clear all usernames from the forward list."""
+    for subscriber in FORWARD_LIST:
+        PERSISTENCE.delete("forward_list", subscriber.user_id)
     FORWARD_LIST.clear()
     await update.message.reply_text("Cleared the forward list.")
     logger.info("Cleared the forward list.")
 
-async def send_image_to_channel(bot: Bot, image_file_id: str, caption: str = "") -> None:
-    """Send an image to the specified channel."""
+async def send_image_to_channel(bot: Bot, image_file_id: Union[str, bytes], caption: str = ""):
+    """Send an image to the specified channel and return the posted message."""
     try:
-        await bot.send_photo(chat_id=CHANNEL_ID, photo=image_file_id, caption=caption)
-        logging.info(f"Image sent to channel {CHANNEL_ID} successfully.")
+        message = await bot.send_photo(chat_id=CHANNEL_ID, photo=image_file_id, caption=caption)
+        logger.debug("Image sent to channel %s successfully.", CHANNEL_ID)
+        return message
     except TelegramError as e:
         logging.error(f"Failed to send image to channel {CHANNEL_ID}: {e}")
+        return None
+
+async def publish_photo(bot: Bot, image: str, caption: str = "") -> Tuple[str, Any]:
+    """Post an image to the channel, uploading it at most once.
+
+    Returns a reusable file_id and the channel message (None if posting
+    failed). URLs are downloaded and hashed; an image whose content was
+    uploaded before is posted by its cached file_id instead of being uploaded
+    again.
+    """
+    if not is_url(image):
+        return image, await send_image_to_channel(bot, image_file_id=image, caption=caption)
+
+    try:
+        data = await download(image)
+    except Exception as e:
+        logger.error(f"Failed to download {image}, letting Telegram fetch it: {e}")
+        return image, await send_image_to_channel(bot, image_file_id=image, caption=caption)
+
+    digest = content_hash(data)
+    file_id = MEDIA_CACHE.get(digest)
+    if file_id:
+        logger.info(f"Reusing uploaded file_id for {image}.")
+        return file_id, await send_image_to_channel(bot, image_file_id=file_id, caption=caption)
+
+    message = await send_image_to_channel(bot, image_file_id=data, caption=caption)
+    if message is None or not message.photo:
+        return image, message
+    file_id = message.photo[-1].file_id
+    PERSISTENCE.upsert("media_cache", digest, MEDIA_CACHE.remember(digest, file_id))
+    return file_id, message
 
 async def send_to_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Command to send an image to the channel."""
@@ -383,28 +878,58 @@ async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         largest_photo = max(update.message.photo, key=lambda p: p.file_size)
         file_id = largest_photo.file_id
 
+        method, words = split_broadcast_method((update.message.caption or "").split())
+        try:
+            due, spread, _ = split_schedule(words)
+        except ValueError as e:
+            await update.message.reply_text(str(e))
+            return
+
+        # Photos that belong to an album are buffered and sent as one group
+        media_group_id = update.message.media_group_id
+        if media_group_id:
+            item = (file_id, update.message.caption, update.effective_chat.id)
+            if MEDIA_GROUPS.add(media_group_id, update.message.message_id, item, context):
+                await update.message.reply_text("Album received and being forwarded!")
+            return
+
+        if due:
+            payload = {"image": file_id, "caption": "", "method": method}
+            job_id = schedule_broadcast(due, "image", payload, spread, update.effective_chat.id)
+            await update.message.reply_text(f"Image scheduled for {format_due(due)} (id {job_id}).")
+            return
+
         # Acknowledge receipt
         await update.message.reply_text("Image received and being forwarded!")
 
         # Send the image to the channel
-        await send_image_to_channel(context.bot, image_file_id=file_id, caption=f"")
+        channel_message = await send_image_to_channel(context.bot, image_file_id=file_id, caption=f"")
+
+        logger.info("Image from @%s (User ID: %s) forwarded to the channel.", username, user_id)
+
+        if method == "copy" and channel_message and not spread:
+            # Posts arriving close together are copied to each chat in one call
+            COPY_BATCHES.add("copy", channel_message.message_id, channel_message.message_id, context)
+            logger.info(f"Image sent by @{username} (User ID: {user_id}) queued for copying.")
+            return
+
+        # Forward the image to everyone in FORWARD_LIST in the background so
+        # other updates keep being handled while the fan-out runs
+        context.application.create_task(broadcast_photo(context.bot, file_id, spread=spread), update=update)
+        logger.info(f"Image sent by @{username} (User ID: {user_id}) queued for forwarding.")
 
-        logging.info(f"Image from @{username} (User ID: {user_id}) forwarded to the channel.")
 
-        # Forward the image to authorized users in FORWARD_LIST
-        for forward_username, forward_chat_id in FORWARD_LIST.items():
-            try:
-                logger.info(f"Forwarding image to @{forward_username} (Chat ID: {forward_chat_id})")
-                await safe_send_photo(
-                    context.bot, 
-                    forward_chat_id, 
-                    file_id, 
-                    # f"Forwarded image from @{username}"
-                )
-            except Exception as e:
-                logger.error(f"Failed to forward image to @{forward_username} (Chat ID: {forward_chat_id}): {e}")
+async def broadcast_published(bot, file_id, channel_message, caption, method=BROADCAST_METHOD, spread=None, on_queued=None):
+    """Broadcast a photo already posted to the channel; returns the delivery counts."""
+    if method == "copy" and channel_message:
+        return await broadcast_copies(bot, [channel_message.message_id], caption, spread=spread, on_queued=on_queued)
+    return await broadcast_photo(bot, file_id, caption, spread=spread, on_queued=on_queued)
 
-        logger.info(f"Image sent by @{username} (User ID: {user_id}) forwarded successfully.")
+
+async def deliver_image(bot, image, caption, method=BROADCAST_METHOD, spread=None, on_queued=None):
+    """Post an image to the channel and broadcast it; returns the delivery counts."""
+    file_id, channel_message = await publish_photo(bot, image)
+    return await broadcast_published(bot, file_id, channel_message, caption, method, spread, on_queued)
 
 
 async def send_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -421,81 +946,129 @@ async def send_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         await update.message.reply_text("Please provide a file ID or URL.")
         return
 
-    image = context.args[0]
-    caption = " ".join(context.args[1:]) if len(context.args) > 1 else "Image sent manually."
+    method, args = split_broadcast_method(context.args)
+    try:
+        due, spread, args = split_schedule(args)
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+    if not args:
+        await update.message.reply_text("Please provide a file ID or URL.")
+        return
+
+    image = args[0]
+    caption = " ".join(args[1:]) if len(args) > 1 else "Image sent manually."
 
-    for username, chat_id in FORWARD_LIST.items():
-        logger.info(f"Sending image to @{username} (Chat ID: {chat_id})")
-        await safe_send_photo(context.bot, chat_id, image, caption)
+    if due:
+        payload = {"image": image, "caption": caption, "method": method}
+        job_id = schedule_broadcast(due, "image", payload, spread, update.effective_chat.id)
+        await update.message.reply_text(f"Image scheduled for {format_due(due)} (id {job_id}).")
+        return
 
-    await send_image_to_channel(context.bot, image_file_id=image_file_id, caption="")
+    # Upload once to the channel, then reuse the resulting file_id for everyone
+    file_id, channel_message = await publish_photo(context.bot, image)
     await update.message.reply_text("Image sent to the channel.")
-    await update.message.reply_text("Image sent successfully.")
 
+    async def broadcast_and_report():
+        counts = await broadcast_published(context.bot, file_id, channel_message, caption, method, spread)
+        await update.message.reply_text(f"Image sent successfully to {counts.get('sent', 0)} users ({counts.get('failed', 0)} failed).")
 
-def save_user_data():
-    """Save USER_DATA to a JSON file without overwriting existing data."""
-    global USER_DATA
-    try:
-        # Check if the file exists and load existing data
-        if os.path.exists(USER_DATA_FILE):
-            with open(USER_DATA_FILE, "r") as f:
-                try:
-                    existing_data = json.load(f)
-                except json.JSONDecodeError:
-                    existing_data = {}  # Handle empty or corrupted files
-            USER_DATA.update(existing_data)  # Merge existing data with current USER_DATA
-
-        # Save updated USER_DATA back to the file
-        with open(USER_DATA_FILE, "w") as f:
-            json.dump(USER_DATA, f, indent=4)
-
-        logger.info(f"User data saved successfully. Total users: {len(USER_DATA)}")
-        logger.debug(f"Before save, USER_DATA: {USER_DATA}")
-        logger.debug(f"Existing data in file: {existing_data}")
+    # Run the fan-out off the update path; the summary is sent when it is done
+    context.application.create_task(broadcast_and_report(), update=update)
 
-    except Exception as e:
-        logger.error(f"Failed to save user data: {e}")
+
+async def list_scheduled(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """List pending scheduled broadcasts (admin-only)."""
+    if not is_authorized(update.effective_user.id):
+        await update.message.reply_text("You are not authorized to view scheduled broadcasts.")
+        return
+
+    jobs = SCHEDULER.pending()
+    if not jobs:
+        await update.message.reply_text("No broadcasts are scheduled.")
+        return
+    lines = [f"{len(jobs)} scheduled broadcasts:"]
+    for job_id, record in jobs[:SHOW_USERS_PAGE_SIZE]:
+        spread = f", spread over {int(record['spread'])}s" if record.get("spread") else ""
+        lines.append(f"{job_id}: {record['action']} at {format_due(record['due'])}{spread}")
+    if len(jobs) > SHOW_USERS_PAGE_SIZE:
+        lines.append(f"... and {len(jobs) - SHOW_USERS_PAGE_SIZE} more")
+    await update.message.reply_text("\n".join(lines))
+
+
+async def unschedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Cancel a scheduled broadcast by id (admin-only)."""
+    if not is_authorized(update.effective_user.id):
+        await update.message.reply_text("You are not authorized to cancel scheduled broadcasts.")
+        return
+
+    if not context.args:
+        await update.message.reply_text("Usage: /unschedule <id>")
+        return
+    job_id = context.args[0]
+    if SCHEDULER.cancel(job_id):
+        await update.message.reply_text(f"Cancelled scheduled broadcast {job_id}.")
+    else:
+        await update.message.reply_text(f"No scheduled broadcast with id {job_id}.")
+
+
+def save_user_data(user_id=None):
+    """Schedule one user's data, or every user in USER_DATA, to be written."""
+    if user_id is not None:
+        PERSISTENCE.upsert("users", user_id, USER_DATA[user_id])
+        return
+    for key, data in USER_DATA.items():
+        PERSISTENCE.upsert("users", key, data)
 
 def load_user_data():
-    """Load USER_DATA from a JSON file."""
-    global USER_DATA, FORWARD_LIST
+    """Load USER_DATA from the store."""
+    global USER_DATA
     try:
-        with open(USER_DATA_FILE, "r") as f:
-            USER_DATA = json.load(f)
-        logger.info("User data loaded successfully.")
-
-        # Add all users from USER_DATA to FORWARD_LIST
-        for user_id, data in USER_DATA.items():
-            username = data.get("username", None) or f"User_{user_id}"  # Use a fallback if no username
-            full_name = data.get("full_name", None)
-            chat_id = data.get("chat_id", None)
-            if chat_id and username not in FORWARD_LIST:
-                FORWARD_LIST[user_id] = chat_id
-                logger.info(f"Loaded user {username} (ID: {user_id}, Chat ID: {chat_id}) to forward list.")
-    except FileNotFoundError:
-        logger.warning(f"No existing {USER_DATA_FILE} found. Starting fresh.")
-        USER_DATA = {}
+        USER_DATA = {int(user_id): data for user_id, data in STORE.users.load_all().items()}
+        logger.info(f"User data loaded successfully. Total users: {len(USER_DATA)}")
     except Exception as e:
         logger.error(f"Failed to load user data: {e}")
         USER_DATA = {}
 
 def load_verified_users():
-    """Load verified users from a JSON file."""
+    """Load verified users from the store."""
     global VERIFIED_USERS
-    if os.path.exists(VERIFIED_USERS_FILE):
-        with open(VERIFIED_USERS_FILE, "r") as file:
-            VERIFIED_USERS = json.load(file)
-            logger.info("Verified users loaded successfully.")
-    else:
-        VERIFIED_USERS = {}
-        logger.info("No verified users file found. Starting with an empty list.")
+    VERIFIED_USERS = STORE.verified_users.load_all()
+    logger.info(f"Verified users loaded successfully. Total: {len(VERIFIED_USERS)}")
+
+def save_verified_users(user_id=None):
+    """Schedule one verified user, or all of them, to be written."""
+    if user_id is not None:
+        PERSISTENCE.upsert("verified_users", user_id, VERIFIED_USERS[user_id])
+        return
+    for key, data in VERIFIED_USERS.items():
+        PERSISTENCE.upsert("verified_users", key, data)
+
+def approve(user_id: str):
+    """Verify a user who has started the bot and add them to the forward list.
+
+    Returns a (status, username) pair where status is "approved",
+    "already_verified" or "not_found".
+    """
+    if user_id in VERIFIED_USERS:
+        return "already_verified", VERIFIED_USERS[user_id].get("username")
+
+    # Check if user exists in USER_DATA
+    user_details = USER_DATA.get(int(user_id))
+    if not user_details:
+        return "not_found", None
+
+    username = user_details["username"]
+    chat_id = user_details["chat_id"]
 
-def save_verified_users():
-    """Save verified users to a JSON file."""
-    with open(VERIFIED_USERS_FILE, "w") as file:
-        json.dump(VERIFIED_USERS, file, indent=4)
-    logger.info("Verified users saved successfully.")
+    # Add user to VERIFIED_USERS and FORWARD_LIST
+    VERIFIED_USERS[user_id] = {"username": username, "chat_id": chat_id}
+    FORWARD_LIST.add(Subscriber(int(user_id), chat_id, username, user_details.get("full_name")))
+    save_verified_users(user_id)
+    save_forward_list(int(user_id))  # Persist the new forward list entry
+    USER_VIEW.invalidate()
+    VERIFICATIONS.resolve(user_id)
+    return "approved", username
 
 async def approve_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Approve a user and add them to the forward list."""
@@ -504,81 +1077,325 @@ async def approve_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
     
     user_id = context.args[0]
-    if user_id in VERIFIED_USERS:
+    status, username = approve(user_id)
+    if status == "already_verified":
         await update.message.reply_text(f"User {user_id} is already verified.")
         return
-    
-    # Check if user exists in USER_DATA
-    user_details = USER_DATA.get(int(user_id))
-    if not user_details:
+    if status == "not_found":
         await update.message.reply_text("User ID not found. Ensure they have started the bot.")
         return
 
-    username = user_details["username"]
-    chat_id = user_details["chat_id"]
-
-    # Add user to VERIFIED_USERS and FORWARD_LIST
-    VERIFIED_USERS[user_id] = {"username": username, "chat_id": chat_id}
-    FORWARD_LIST[username] = chat_id
-    save_verified_users()
-    save_forward_list()  # Persist the list to file
-
+    refresh_commands(context.bot, int(user_id))
     await update.message.reply_text(f"User @{username} (ID: {user_id}) has been approved and added to the forward list.")
     logger.info(f"User @{username} (ID: {user_id}) approved by {update.effective_user.username}.")
 
 async def reject_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Reject a user's verification request."""
+    if not is_authorized(update.effective_user.id):
+        await update.message.reply_text("⛔ You are not authorized to use this command.")
+        return
+
     if not context.args:
         await update.message.reply_text("Please provide a user ID. Example: /reject <user_id>")
         return
     
-    user_id = context.args[0]
+    try:
+        user_id = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("❌ Invalid user ID. Please provide a numeric user ID.")
+        return
+
     if user_id in USER_DATA:
-        del USER_DATA[int(user_id)]
+        del USER_DATA[user_id]
+        PERSISTENCE.delete("users", user_id)
+        USER_VIEW.invalidate()
+        # The cached profile may have been rebuilt from the record just deleted
+        CHAT_CACHE.invalidate(user_id)
+    VERIFICATIONS.resolve(user_id)
     await update.message.reply_text(f"User ID {user_id} has been rejected.")
     logger.info(f"User ID {user_id} rejected by {update.effective_user.username}.")
 
 
+def parse_id_document(text: str, file_name: str = "") -> List[str]:
+    """Extract user ids (or usernames) from an uploaded CSV or JSON document.
+
+    JSON may be a list of ids, a list of objects with a user_id/id/username
+    field, or an object keyed by id. For CSV the first column of each row is
+    used and a header row is skipped.
+    """
+    stripped = text.lstrip()
+    if file_name.lower().endswith(".json") or stripped.startswith(("[", "{")):
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return [str(key) for key in data]
+        values = []
+        for item in data:
+            if isinstance(item, dict):
+                item = item.get("user_id") or item.get("id") or item.get("username")
+            if item is not None:
+                values.append(str(item))
+        return values
+
+    values = []
+    for row in csv.reader(io.StringIO(text)):
+        if not row or not row[0].strip():
+            continue
+        value = row[0].strip()
+        if value.lower() in ("user_id", "id", "username", "chat_id"):
+            continue  # header row
+        values.append(value)
+    return values
+
+async def collect_bulk_ids(update: Update, context: ContextTypes.DEFAULT_TYPE) -> List[str]:
+    """Gather ids from the command arguments and an attached or replied-to document."""
+    values = [value.strip() for arg in (context.args or []) for value in arg.split(",") if value.strip()]
+
+    message = update.message
+    document = message.document
+    if not document and message.reply_to_message:
+        document = message.reply_to_message.document
+    if document:
+        data = await (await document.get_file()).download_as_bytearray()
+        values.extend(parse_id_document(bytes(data).decode("utf-8-sig"), document.file_name or ""))
+
+    return list(dict.fromkeys(values))  # Drop duplicates, keep order
+
+def split_numeric_ids(values: List[str]):
+    """Split raw values into numeric user ids and invalid entries."""
+    user_ids, invalid = [], []
+    for value in values:
+        (user_ids if value.lstrip("-").isdigit() else invalid).append(value)
+    return user_ids, invalid
+
+def bulk_summary(title: str, groups: Dict[str, List[Any]]) -> str:
+    """Format the single reply sent at the end of a bulk command."""
+    lines = [title]
+    for label, items in groups.items():
+        if not items:
+            continue
+        shown = ", ".join(str(item) for item in items[:20])
+        more = f" (+{len(items) - 20} more)" if len(items) > 20 else ""
+        lines.append(f"{label}: {len(items)} — {shown}{more}")
+    return "\n".join(lines)
+
+async def bulk_approve(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Approve many users at once (ids as arguments or in a CSV/JSON document)."""
+    if not is_authorized(update.effective_user.id):
+        await update.message.reply_text("⛔ You are not authorized to use this command.")
+        return
+
+    user_ids, invalid = split_numeric_ids(await collect_bulk_ids(update, context))
+    if not user_ids:
+        await update.message.reply_text("Please provide user IDs or a CSV/JSON document. Example: /bulk_approve 123 456")
+        return
+
+    results: Dict[str, List[Any]] = {"approved": [], "already_verified": [], "not_found": []}
+    for user_id in user_ids:
+        status, _ = approve(user_id)
+        results[status].append(user_id)
+        if status == "approved":
+            refresh_commands(context.bot, int(user_id))
+    await PERSISTENCE.flush()  # One transaction for the whole batch
+
+    await update.message.reply_text(bulk_summary(
+        f"Bulk approve finished ({len(user_ids)} IDs).",
+        {
+            "✅ Approved": results["approved"],
+            "ℹ️ Already verified": results["already_verified"],
+            "❌ Not found": results["not_found"],
+            "⚠️ Invalid": invalid,
+        },
+    ))
+    logger.info(f"Bulk approve by {update.effective_user.username}: {len(results['approved'])} approved.")
+
+async def bulk_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Add many users to the forward list at once, looking them up concurrently."""
+    if not is_authorized(update.effective_user.id):
+        await update.message.reply_text("⛔ You are not authorized to use this command.")
+        return
+
+    raw_ids, invalid = split_numeric_ids(await collect_bulk_ids(update, context))
+    if not raw_ids:
+        await update.message.reply_text("Please provide user IDs or a CSV/JSON document. Example: /bulk_add 123 456")
+        return
+
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def resolve(user_id):
+        async with semaphore:
+            return user_id, await resolve_user(context.bot, user_id)
+
+    added, already, failed = [], [], []
+    for user_id, subscriber in await asyncio.gather(*(resolve(int(value)) for value in raw_ids)):
+        if subscriber is None:
+            failed.append(user_id)
+        elif add_to_forward_list(subscriber):
+            added.append(user_id)
+        else:
+            already.append(user_id)
+    await PERSISTENCE.flush()  # One transaction for the whole batch
+
+    await update.message.reply_text(bulk_summary(
+        f"Bulk add finished ({len(raw_ids)} IDs).",
+        {"✅ Added": added, "ℹ️ Already listed": already, "❌ Not found": failed, "⚠️ Invalid": invalid},
+    ))
+    logger.info(f"Bulk add by {update.effective_user.username}: {len(added)} added.")
+
+async def bulk_remove(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Remove many usernames or user IDs from the forward list at once."""
+    if not is_authorized(update.effective_user.id):
+        await update.message.reply_text("⛔ You are not authorized to use this command.")
+        return
+
+    values = await collect_bulk_ids(update, context)
+    if not values:
+        await update.message.reply_text("Please provide usernames/IDs or a CSV/JSON document. Example: /bulk_remove alice 123")
+        return
+
+    removed, missing = [], []
+    for value in values:
+        if remove_from_forward_list(value):
+            removed.append(value)
+        else:
+            missing.append(value)
+    await PERSISTENCE.flush()  # One transaction for the whole batch
+
+    await update.message.reply_text(bulk_summary(
+        f"Bulk remove finished ({len(values)} entries).",
+        {"✅ Removed": removed, "ℹ️ Not in list": missing},
+    ))
+    logger.info(f"Bulk remove by {update.effective_user.username}: {len(removed)} removed.")
+
+BULK_COMMANDS = {
+    "bulk_approve": bulk_approve,
+    "bulk_add": bulk_add,
+    "bulk_remove": bulk_remove,
+}
+
+async def bulk_from_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Run a bulk command given as the caption of an uploaded document."""
+    words = (update.message.caption or "").split()
+    command = words[0][1:].split("@")[0].lower()
+    context.args = words[1:]
+    await BULK_COMMANDS[command](update, context)
+
+async def throttle_updates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Stop updates from users over their inbound limits before any handler runs."""
+    if not THROTTLE.allow(update):
+        raise ApplicationHandlerStop
+
 # Function for graceful shutdown and saving user data
 async def stop_application(application):
     """Shutdown the bot gracefully, saving user data."""
     logger.info("Shutting down bot...")
-    save_user_data()  # Persist data to JSON
-    logger.info("User data saved.")
+    # Pending changes are written by post_shutdown (PERSISTENCE.close), on every exit path
     await application.stop()
     logger.info("Application stopped.")
 
-# Main function to start the bot
-async def main() -> None:
-    """Start the bot."""
-
-    logger.info("Starting bot")
-    
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+def build_application(base_url=None):
+    """Build the Application and register every handler."""
+    # Handle updates concurrently across chats, in order within each chat
+    processor = ChatOrderedUpdateProcessor()
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(processor)
+        .update_queue(BackpressureQueue(processor))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    # Separate pools for getUpdates and sends, sized for broadcast concurrency (see transport.py)
+    builder = configure_transport(builder)
+    if base_url:
+        # Used to point the bot at a local Bot API server (see benchmarks/)
+        builder = builder.base_url(base_url)
+        WORKER_POOL.base_url = base_url
+    application = builder.build()
 
-   # Set bot commands
-    await set_bot_commands(application)
+    # Runs before every other group; a dropped update never reaches the handlers below
+    application.add_handler(TypeHandler(Update, throttle_updates), group=-1)
 
    # Register command handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("add_user", add_user))
     application.add_handler(CommandHandler("show_users", show_users))
+    application.add_handler(CallbackQueryHandler(show_users_page, pattern=r"^users:"))
     application.add_handler(CommandHandler("remove_user", remove_user))
     application.add_handler(CommandHandler("clear_users", clear_users))
     application.add_handler(MessageHandler(filters.PHOTO, handle_image))
     application.add_handler(CommandHandler("send_image", send_image))
+    application.add_handler(CommandHandler("scheduled", list_scheduled))
+    application.add_handler(CommandHandler("unschedule", unschedule))
     application.add_handler(CommandHandler("approve", approve_user))
     application.add_handler(CommandHandler("reject", reject_user))
     # Add the `/authorize` command
     application.add_handler(CommandHandler("authorize", authorize_user))
+    application.add_handler(CommandHandler("cache_stats", cache_stats))
+    for command, callback in BULK_COMMANDS.items():
+        application.add_handler(CommandHandler(command, callback))
+    application.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r"^/bulk_(approve|add|remove)\b"), bulk_from_document
+    ))
 
 
    # Register shutdown handler using post_shutdown instead of on_shutdown.
        # Register shutdown handler using post_shutdown instead of on_shutdown.
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, stop_application))
 
-   # Start polling
-    await application.run_polling()
+    # Record latency and errors of every handler registered above
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = timed_handler(handler.callback)
+
+    UPDATE_QUEUE_DEPTH.set_function(application.update_queue.qsize)
+    UPDATES_IN_FLIGHT.set_function(lambda: processor.pending)
+    PERSIST_PENDING.set_function(lambda: PERSISTENCE.pending)
+
+    return application
+
+def load_state() -> Dict[str, float]:
+    """Load all persisted state, each table once; returns seconds spent per step."""
+    steps = [
+        # Import the legacy JSON files the first time the store is used
+        ("migrate", lambda: STORE.migrate_from_json(USER_DATA_FILE, VERIFIED_USERS_FILE, FORWARD_LIST_FILE)),
+        ("verified_users", load_verified_users),
+        ("forward_list", load_forward_list),
+        ("users", load_user_data),
+        ("chat_cache", lambda: CHAT_CACHE.prewarm(USER_DATA)),
+        ("media_cache", lambda: MEDIA_CACHE.load(STORE.media_cache.items())),
+        ("command_scopes", lambda: COMMAND_SCOPES.load(STORE.command_scopes.items())),
+        ("scheduled", lambda: SCHEDULER.load(STORE.scheduled.items())),
+        ("recipient_health", lambda: HEALTH.load(STORE.recipient_health.items())),
+    ]
+    timings = {}
+    for name, step in steps:
+        started = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - started
+        STARTUP_SECONDS.set(timings[name], step=name)
+    breakdown = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings.items())
+    logger.info(f"State loaded in {sum(timings.values()):.2f}s ({breakdown}).")
+    return timings
+
+# Main function to start the bot
+async def main() -> None:
+    """Start the bot."""
+
+    logger.info(f"Starting bot in {BOT_MODE} mode")
+
+    application = build_application()
+
+   # Set the default command menu (skipped when it is already up to date)
+    await COMMAND_SCOPES.apply_default(application.bot)
+
+    if BOT_MODE == "webhook":
+        # aiohttp is only needed in webhook mode, so import it lazily
+        from webhook import run_webhook
+        await run_webhook(application)
+    else:
+        # Polling removes any webhook left behind by a previous webhook run
+        application.run_polling()
 
 
 if __name__ == "__main__":
@@ -589,9 +1406,7 @@ if __name__ == "__main__":
         # Allow nested event loops for environments where a loop is already running
         nest_asyncio.apply()
 
-        load_verified_users()
-        save_user_data()
-        load_user_data()
+        load_state()
 
         # Retrieve or create the event loop
         loop = asyncio.get_event_loop()
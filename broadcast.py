@@ -0,0 +1,400 @@
+import asyncio
+import logging
+import os
+import struct
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+try:
+    import fcntl
+except ImportError:  # Windows: no shared budget, see SharedTokenBucket
+    fcntl = None
+
+from metrics import BROADCAST_DURATION, BROADCAST_PENDING, BROADCAST_RATE, FLOOD_WAITS, SEND_LATENCY, SENDS, LogSampler
+
+logger = logging.getLogger(__name__)
+# Per-recipient problems repeat across a whole broadcast; log a sample of them
+sampled_log = LogSampler(logger)
+
+# Telegram allows roughly 30 messages per second in bulk and about one message
+# per second to the same chat. Both can be tuned from the .env file.
+GLOBAL_RATE = float(os.getenv("BROADCAST_GLOBAL_RATE", "30"))
+PER_CHAT_INTERVAL = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1.0"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "5"))
+# Adapt the global rate to flood control: cut it on every 429, win it back slowly
+BROADCAST_ADAPTIVE = os.getenv("BROADCAST_ADAPTIVE", "1") == "1"
+# Floor of the adaptive rate (messages per second)
+BROADCAST_MIN_RATE = float(os.getenv("BROADCAST_MIN_RATE", "1"))
+# Messages per second regained per second of sending without a 429
+BROADCAST_RATE_STEP = float(os.getenv("BROADCAST_RATE_STEP", "2"))
+# Fraction of the rate kept per second of wait a 429 asks for, so longer waits cut deeper
+RATE_DECREASE = 0.7
+# Never cut the rate below this fraction in one step
+MAX_RATE_DECREASE = 0.1
+
+# Back-off used when a send times out (doubled on every further attempt)
+TIMEOUT_BACKOFF = 2.0
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Return the delay requested by a RetryAfter error in seconds."""
+    retry_after = error.retry_after
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+async def call_with_flood_retry(call: Callable[[], Awaitable[Any]], attempts: int) -> Any:
+    """Await call(), waiting out flood control up to attempts times; the last RetryAfter is raised."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return await call()
+        except RetryAfter as e:
+            if attempt == attempts:
+                raise
+            await asyncio.sleep(retry_after_seconds(e))
+
+
+class TokenBucket:
+    """Async token bucket that hands out tokens at a fixed rate."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for the given number of seconds."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        # No tokens build up while paused; sending resumes at the rate, not in a burst
+        self._updated = self._blocked_until
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it."""
+        # The lock keeps waiters in FIFO order so no sender starves
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SharedTokenBucket:
+    """Token bucket whose state lives in a small file, shared by several processes.
+
+    Every acquire takes the next free send slot (a GCRA-style schedule) under
+    an exclusive flock, so any number of processes pointing at the same file
+    stay under one global rate together. A pause (RetryAfter) is written to
+    the file as well and holds back every process.
+    """
+
+    _STATE = struct.Struct("dd")  # next free slot, blocked until (wall clock)
+
+    def __init__(self, path: str, rate: float, capacity: Optional[float] = None):
+        if fcntl is None:
+            raise RuntimeError("SharedTokenBucket needs fcntl (POSIX) file locks.")
+        self.path = os.path.abspath(path)
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def _update(self, change: Callable[[float, float, float], Tuple[float, float, float]]) -> float:
+        """Apply change(now, next_free, blocked_until) under the lock; returns its wait time."""
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            raw = os.pread(self._fd, self._STATE.size, 0)
+            next_free, blocked_until = self._STATE.unpack(raw) if len(raw) == self._STATE.size else (0.0, 0.0)
+            next_free, blocked_until, wait = change(time.time(), next_free, blocked_until)
+            os.pwrite(self._fd, self._STATE.pack(next_free, blocked_until), 0)
+            return wait
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def pause(self, seconds: float) -> None:
+        """Stop every process from sending for the given number of seconds."""
+        def change(now, next_free, blocked_until):
+            blocked_until = max(blocked_until, now + seconds)
+            return max(next_free, blocked_until), blocked_until, 0.0
+
+        self._update(change)
+
+    async def acquire(self) -> None:
+        """Wait for the next free slot of the shared budget."""
+        interval = 1 / self.rate
+
+        def reserve(now, next_free, blocked_until):
+            # Up to `capacity` sends may go out back to back after an idle period
+            slot = max(next_free, now - (self.capacity - 1) * interval, blocked_until)
+            return slot + interval, blocked_until, slot - now
+
+        def blocked(now, next_free, blocked_until):
+            return next_free, blocked_until, blocked_until - now
+
+        while True:
+            wait = self._update(reserve)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            # A pause may have started while we slept; take a new slot after it
+            if self._update(blocked) <= 0:
+                return
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PacedBucket:
+    """Hold one job to its own, lower rate while still drawing from a shared bucket.
+
+    Used to spread a broadcast over a time window: the job never goes faster
+    than `rate`, and never takes more than its share of the global budget.
+    """
+
+    def __init__(self, rate: float, shared: Any):
+        self.own = TokenBucket(rate, capacity=1)
+        self.shared = shared
+
+    @property
+    def rate(self) -> float:
+        return self.own.rate
+
+    @rate.setter
+    def rate(self, rate: float) -> None:
+        self.own.rate = rate
+
+    def pause(self, seconds: float) -> None:
+        self.shared.pause(seconds)
+
+    async def acquire(self) -> None:
+        await self.own.acquire()
+        await self.shared.acquire()
+
+
+class RateLimiter:
+    """Combine the global token bucket with a minimum interval per chat.
+
+    When adaptive, the bucket's rate follows flood control AIMD-style: every
+    RetryAfter cuts it (once per flood wait, however many sends hit it), by
+    30% for a 1s wait and deeper for longer ones, and every successful send
+    wins back a little, up to the configured rate. Close to the rate that
+    last hit flood control the increase slows down, so 429s stay rare.
+    """
+
+    def __init__(
+        self,
+        rate: float = GLOBAL_RATE,
+        per_chat_interval: float = PER_CHAT_INTERVAL,
+        bucket: Optional[Any] = None,
+        adaptive: bool = BROADCAST_ADAPTIVE,
+        min_rate: float = BROADCAST_MIN_RATE,
+        step: float = BROADCAST_RATE_STEP,
+    ):
+        # Pass a SharedTokenBucket to share the global budget with other processes
+        self.bucket = bucket or TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.adaptive = adaptive
+        self.max_rate = self.bucket.rate
+        self._burst = self.bucket.capacity / self.max_rate if hasattr(self.bucket, "capacity") else None
+        self.min_rate = min(min_rate, self.max_rate)
+        self.step = step
+        self._next_chat_slot: Dict[Any, float] = {}
+        self._flood_until = 0.0
+        # Rate at the last 429: the increase slows down when getting close to it again
+        self._flood_rate = self.max_rate
+        if adaptive:
+            BROADCAST_RATE.set(self.max_rate)
+
+    async def acquire(self, chat_id: Any) -> None:
+        """Wait until a message may be sent to chat_id."""
+        now = time.monotonic()
+        slot = self._next_chat_slot.get(chat_id, now)
+        # Reserve the slot before sleeping so concurrent senders queue up behind it
+        self._next_chat_slot[chat_id] = max(slot, now) + self.per_chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        await self.bucket.acquire()
+        self._forget_idle_chats(now)
+
+    def pause(self, seconds: float) -> None:
+        """Pause all sending, e.g. after Telegram answered with RetryAfter."""
+        self.bucket.pause(seconds)
+        now = time.monotonic()
+        # Sends already in flight when the flood started report it too; count it once
+        if self.adaptive and now >= self._flood_until:
+            self._flood_rate = self.bucket.rate
+            factor = max(MAX_RATE_DECREASE, RATE_DECREASE ** max(1.0, seconds))
+            self._set_rate(self.bucket.rate * factor)
+            logger.info("Flood control: broadcast rate lowered to %.1f/s.", self.bucket.rate)
+        self._flood_until = max(self._flood_until, now + seconds)
+
+    def record_success(self) -> None:
+        """Win back some rate after a send went through."""
+        if self.adaptive and self.bucket.rate < self.max_rate:
+            rate = self.bucket.rate
+            step = self.step if rate < 0.9 * self._flood_rate else self.step / 10
+            self._set_rate(rate + step / rate)
+
+    def _set_rate(self, rate: float) -> None:
+        self.bucket.rate = min(self.max_rate, max(self.min_rate, rate))
+        if self._burst is not None:
+            # Bursts shrink with the rate, or a refilled bucket would trip flood control again
+            self.bucket.capacity = max(1.0, self.bucket.rate * self._burst)
+        BROADCAST_RATE.set(self.bucket.rate)
+
+    def _forget_idle_chats(self, now: float) -> None:
+        # Keep the per-chat table from growing with every chat ever sent to
+        if len(self._next_chat_slot) > 10000:
+            self._next_chat_slot = {
+                chat_id: slot for chat_id, slot in self._next_chat_slot.items() if slot > now
+            }
+
+
+class BroadcastResult:
+    """Outcome of a single broadcast."""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed: Dict[Any, str] = {}
+        self.retries = 0
+        self.started = time.monotonic()
+        self.duration = 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"BroadcastResult(sent={self.sent}, failed={len(self.failed)}, "
+            f"retries={self.retries}, duration={self.duration:.2f}s)"
+        )
+
+
+class BroadcastEngine:
+    """Send one payload to many chats in parallel without tripping flood control.
+
+    RetryAfter pauses the whole engine for the requested time and reschedules the
+    recipient; TimedOut and other network errors (but not BadRequest) reschedule
+    the recipient with an exponential back-off.
+    A recipient is given up on after max_attempts tries.
+    """
+
+    def __init__(
+        self,
+        limiter: Optional[RateLimiter] = None,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        max_attempts: int = BROADCAST_MAX_ATTEMPTS,
+    ):
+        self.limiter = limiter or RateLimiter()
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+    async def broadcast(
+        self,
+        chat_ids: Iterable[Any],
+        send: Callable[[Any], Awaitable[Any]],
+        on_result: Optional[Callable[[Any, Optional[str], int], None]] = None,
+    ) -> BroadcastResult:
+        """Call send(chat_id) once for every chat id and return the result.
+
+        If given, on_result(chat_id, error, attempts) is called as soon as a
+        recipient is finished; error is None when the send succeeded.
+        """
+        result = BroadcastResult()
+        queue: asyncio.Queue = asyncio.Queue()
+        pending = 0
+        for chat_id in chat_ids:
+            queue.put_nowait((chat_id, 1))
+            pending += 1
+
+        if not pending:
+            return result
+        BROADCAST_PENDING.inc(pending)
+
+        done = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        timers: List[asyncio.TimerHandle] = []
+
+        def finish_one(chat_id: Any, error: Optional[str], attempt: int) -> None:
+            nonlocal pending
+            if error is None:
+                result.sent += 1
+            else:
+                result.failed[chat_id] = error
+            if on_result:
+                on_result(chat_id, error, attempt)
+            SENDS.inc(outcome="sent" if error is None else "failed")
+            BROADCAST_PENDING.dec()
+            pending -= 1
+            if pending == 0:
+                done.set()
+
+        def reschedule(chat_id: Any, attempt: int, delay: float) -> None:
+            result.retries += 1
+            timers.append(loop.call_later(delay, queue.put_nowait, (chat_id, attempt + 1)))
+
+        async def worker() -> None:
+            while True:
+                chat_id, attempt = await queue.get()
+                await self.limiter.acquire(chat_id)
+                error = None
+                started = time.perf_counter()
+                try:
+                    await send(chat_id)
+                    SEND_LATENCY.observe(time.perf_counter() - started)
+                    self.limiter.record_success()
+                except RetryAfter as e:
+                    delay = retry_after_seconds(e)
+                    FLOOD_WAITS.inc()
+                    sampled_log(logging.WARNING, "Flood control hit while sending to %s; pausing %ss.", chat_id, delay)
+                    self.limiter.pause(delay)
+                    if attempt < self.max_attempts:
+                        reschedule(chat_id, attempt, delay)
+                        continue
+                    error = str(e)
+                except TimedOut as e:
+                    SENDS.inc(outcome="timed_out")
+                    if attempt < self.max_attempts:
+                        reschedule(chat_id, attempt, TIMEOUT_BACKOFF * 2 ** (attempt - 1))
+                        continue
+                    error = str(e)
+                except NetworkError as e:
+                    # Server errors and dropped connections are worth retrying; bad requests are not
+                    if not isinstance(e, BadRequest) and attempt < self.max_attempts:
+                        sampled_log(logging.WARNING, "Network error sending to %s, retrying: %s", chat_id, e)
+                        reschedule(chat_id, attempt, TIMEOUT_BACKOFF * 2 ** (attempt - 1))
+                        continue
+                    sampled_log(logging.ERROR, "Failed to send to %s: %s", chat_id, e)
+                    error = str(e)
+                except Exception as e:
+                    sampled_log(logging.ERROR, "Failed to send to %s: %s", chat_id, e)
+                    error = str(e)
+                finish_one(chat_id, error, attempt)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, pending))]
+        try:
+            await done.wait()
+        finally:
+            for timer in timers:
+                timer.cancel()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # Recipients left over when the broadcast is cancelled
+            BROADCAST_PENDING.dec(pending)
+
+        result.duration = time.monotonic() - result.started
+        BROADCAST_DURATION.observe(result.duration)
+        return result
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from telegram import Bot
+
+from broadcast import BROADCAST_CONCURRENCY, GLOBAL_RATE, BroadcastEngine, RateLimiter, SharedTokenBucket
+from delivery_queue import DELIVERY_DB_FILE, DeliveryQueue
+from metrics import SENDS
+from senders import make_sender
+from transport import make_request
+
+logger = logging.getLogger(__name__)
+
+# Worker processes per broadcast; 0 keeps every broadcast in the bot process
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "0"))
+# Smaller broadcasts are not worth starting processes for
+BROADCAST_WORKER_MIN_RECIPIENTS = int(os.getenv("BROADCAST_WORKER_MIN_RECIPIENTS", "5000"))
+# File holding the send budget shared by the bot and its workers
+BROADCAST_RATE_FILE = os.getenv("BROADCAST_RATE_FILE", "broadcast_rate.state")
+# Seconds between progress log lines while workers run
+PROGRESS_INTERVAL = 10.0
+
+
+def shared_limiter(rate: float = GLOBAL_RATE, path: str = BROADCAST_RATE_FILE) -> RateLimiter:
+    """A rate limiter drawing from the budget shared by every process using path."""
+    return RateLimiter(rate, bucket=SharedTokenBucket(path, rate))
+
+
+def worker_main(
+    index: int,
+    count: int,
+    job_id: str,
+    token: str,
+    base_url: Optional[str],
+    db_path: str,
+    rate: float,
+    rate_path: str,
+    progress: Any,
+) -> None:
+    """Entry point of a worker process: deliver one shard of a job."""
+    # force: spawn has already re-run the bot's main module, and with it its basicConfig
+    logging.basicConfig(
+        format=f"%(asctime)s - worker {index} - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+        force=True,
+    )
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(_deliver_shard(index, count, job_id, token, base_url, db_path, rate, rate_path, progress))
+
+
+async def _deliver_shard(index, count, job_id, token, base_url, db_path, rate, rate_path, progress) -> None:
+    deliveries = DeliveryQueue(db_path)
+    job = deliveries.get_job(job_id)
+    # One connection per concurrent send; the default pool of one would serialise them
+    request = make_request(f"worker-{index}", BROADCAST_CONCURRENCY)
+    bot = Bot(token, base_url=base_url, request=request) if base_url else Bot(token, request=request)
+    limiter = shared_limiter(rate, rate_path)
+    # Failures since the last report, handed to the bot for recipient health
+    failures: List[tuple] = []
+
+    def report(sent: int, failed: int) -> None:
+        progress.put(("progress", index, sent, failed, failures[:]))
+        failures.clear()
+
+    def on_result(chat_id: Any, error: Optional[str]) -> None:
+        if error is not None:
+            failures.append((chat_id, error))
+
+    try:
+        async with bot:
+            engine = BroadcastEngine(limiter)
+            await deliveries.run(
+                job_id,
+                engine,
+                make_sender(bot, job["kind"], job["payload"]),
+                shard=(index, count),
+                on_progress=report,
+                on_result=on_result,
+            )
+    finally:
+        limiter.bucket.close()
+
+
+class BroadcastWorkerPool:
+    """Deliver large broadcast jobs from several processes at once.
+
+    The recipients of a job are split by chat_id modulo the number of workers,
+    so every chat is handled by exactly one process (and per-chat limits hold).
+    All workers draw from one send budget kept in a locked file, and report
+    progress back over a queue. Processes are started per job with the spawn
+    method, so they share nothing with the bot's event loop. Spawn imports the
+    parent's main module again in every worker; bot_script checks
+    IN_BROADCAST_WORKER to skip opening its stores there.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        base_url: Optional[str] = None,
+        workers: int = BROADCAST_WORKERS,
+        rate: float = GLOBAL_RATE,
+        db_path: str = DELIVERY_DB_FILE,
+        rate_path: str = BROADCAST_RATE_FILE,
+        min_recipients: int = BROADCAST_WORKER_MIN_RECIPIENTS,
+    ):
+        self.token = token
+        self.base_url = base_url
+        self.workers = workers
+        self.rate = rate
+        # Workers may not start in the same working directory
+        self.db_path = os.path.abspath(db_path)
+        self.rate_path = os.path.abspath(rate_path)
+        self.min_recipients = min_recipients
+        self._context = multiprocessing.get_context("spawn")
+
+    def wants(self, recipients: int) -> bool:
+        """Tell whether a job with this many pending recipients should go to the workers."""
+        return self.workers > 0 and recipients >= self.min_recipients
+
+    async def run(
+        self,
+        job_id: str,
+        deliveries: DeliveryQueue,
+        on_progress: Optional[Callable[[int, int, int], None]] = None,
+        on_failure: Optional[Callable[[Any, str], None]] = None,
+    ) -> Dict[str, int]:
+        """Deliver a job with the worker processes and return its final state counts.
+
+        on_progress(sent, failed, total) is called whenever a worker reports,
+        on_failure(chat_id, error) for every recipient that failed in this run.
+        A job with recipients still pending afterwards (a worker died) is left
+        unfinished, so it is resumed on the next start.
+        """
+        total = deliveries.counts(job_id).get("pending", 0)
+        progress = self._context.Queue()
+        processes: List[Any] = []
+        for index in range(self.workers):
+            process = self._context.Process(
+                target=worker_main,
+                args=(index, self.workers, job_id, self.token, self.base_url, self.db_path,
+                      self.rate, self.rate_path, progress),
+                name=f"broadcast-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            processes.append(process)
+        logger.info(f"Broadcast job {job_id}: {total} recipients split across {self.workers} worker processes.")
+
+        sent = failed = 0
+        last_log = time.monotonic()
+        try:
+            while True:
+                try:
+                    _, index, batch_sent, batch_failed, failures = progress.get_nowait()
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes):
+                        break
+                    await asyncio.sleep(0.2)
+                    continue
+                sent += batch_sent
+                failed += batch_failed
+                if on_failure:
+                    for chat_id, error in failures:
+                        on_failure(chat_id, error)
+                SENDS.inc(batch_sent, outcome="sent")
+                SENDS.inc(batch_failed, outcome="failed")
+                if on_progress:
+                    on_progress(sent, failed, total)
+                if time.monotonic() - last_log >= PROGRESS_INTERVAL:
+                    last_log = time.monotonic()
+                    logger.info(f"Broadcast job {job_id}: {sent + failed}/{total} done ({failed} failed).")
+        except asyncio.CancelledError:
+            for process in processes:
+                process.terminate()
+            raise
+        finally:
+            for process in processes:
+                process.join(timeout=5)
+            progress.close()
+
+        for process in processes:
+            if process.exitcode:
+                logger.error(f"Broadcast worker {process.name} exited with code {process.exitcode}.")
+
+        counts = deliveries.counts(job_id)
+        if counts.get("pending"):
+            logger.error(f"Broadcast job {job_id} left {counts['pending']} recipients pending; it will be resumed.")
+        else:
+            deliveries.finish_job(job_id)
+            logger.info(f"Broadcast job {job_id} finished: {counts}")
+        return counts
@@ -0,0 +1,119 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "3600"))
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "10000"))
+
+
+class ChatProfile:
+    """The parts of a chat the bot needs, whether fetched or rebuilt from USER_DATA."""
+
+    __slots__ = ("id", "username", "first_name", "last_name")
+
+    def __init__(self, id: int, username: Optional[str], first_name: Optional[str], last_name: Optional[str]):
+        self.id = id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+
+    @classmethod
+    def from_chat(cls, chat: Any) -> "ChatProfile":
+        return cls(chat.id, chat.username, chat.first_name, chat.last_name)
+
+    @classmethod
+    def from_user_data(cls, user_id: int, data: Dict[str, Any]) -> "ChatProfile":
+        username = data.get("username")
+        if username == "Unknown":
+            username = None
+        return cls(data.get("chat_id") or user_id, username, data.get("full_name"), None)
+
+
+class ChatCache:
+    """Async TTL + LRU cache in front of bot.get_chat.
+
+    Concurrent lookups of an id that is not cached share one in-flight request.
+    Failed lookups are not cached.
+    """
+
+    def __init__(self, ttl: float = CHAT_CACHE_TTL, maxsize: int = CHAT_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[int, Tuple[float, ChatProfile]]" = OrderedDict()
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def put(self, chat_id: int, profile: ChatProfile) -> None:
+        """Store a profile, evicting the least recently used one if full."""
+        self._entries[chat_id] = (time.monotonic() + self.ttl, profile)
+        self._entries.move_to_end(chat_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, chat_id: int) -> None:
+        """Forget a profile that no longer matches what the bot knows about the chat."""
+        self._entries.pop(chat_id, None)
+
+    def prewarm(self, user_data: Dict[Any, Dict[str, Any]]) -> None:
+        """Seed the cache from stored user data so known users need no API call."""
+        # Only the last maxsize entries would survive eviction; skip the rest
+        skip = max(0, len(user_data) - self.maxsize)
+        for user_id, data in itertools.islice(user_data.items(), skip, None):
+            self.put(int(user_id), ChatProfile.from_user_data(int(user_id), data))
+        logger.info(f"Chat cache pre-warmed with {len(self._entries)} profiles.")
+
+    async def get(self, bot: Any, chat_id: int) -> ChatProfile:
+        """Return the profile for chat_id, calling bot.get_chat only when needed."""
+        entry = self._entries.get(chat_id)
+        if entry and entry[0] > time.monotonic():
+            self._entries.move_to_end(chat_id)
+            self.hits += 1
+            return entry[1]
+
+        future = self._inflight.get(chat_id)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[chat_id] = future
+        try:
+            profile = ChatProfile.from_chat(await bot.get_chat(chat_id))
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; avoid "exception was never retrieved"
+            future.exception()
+            raise
+        else:
+            self.put(chat_id, profile)
+            future.set_result(profile)
+            return profile
+        finally:
+            del self._inflight[chat_id]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the current size."""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+from telegram import BotCommand, BotCommandScopeChat
+from telegram.error import RetryAfter, TelegramError
+
+from batching import BatchTimer
+from broadcast import call_with_flood_retry
+
+logger = logging.getLogger(__name__)
+
+# Seconds role changes are collected before they are sent to Telegram
+COMMAND_SCOPE_WINDOW = float(os.getenv("COMMAND_SCOPE_WINDOW", "1.0"))
+# Scope updates sent at the same time
+COMMAND_SCOPE_CONCURRENCY = int(os.getenv("COMMAND_SCOPE_CONCURRENCY", "4"))
+# Attempts per scope update when Telegram answers with flood control
+COMMAND_SCOPE_ATTEMPTS = 3
+# Key under which the state of the default (unscoped) menu is stored
+DEFAULT_SCOPE_KEY = "default"
+
+
+def commands_digest(commands: List[BotCommand]) -> str:
+    """Fingerprint a command list, so a changed menu is pushed again after a deploy."""
+    pairs = [[command.command, command.description] for command in commands]
+    return hashlib.sha256(json.dumps(pairs).encode()).hexdigest()[:16]
+
+
+class CommandScopeManager:
+    """Keep each chat's command menu in line with its role with as few API calls as possible.
+
+    The default scope carries the commands of the default role, so chats with
+    that role need no scope of their own; only other roles get a chat scope,
+    and a chat going back to the default role has its scope deleted. The role
+    and command fingerprint applied to each chat are remembered (and handed to
+    on_applied for persisting), so asking for the role a chat already has
+    costs nothing. Changes are collected for a short window and sent in the
+    background.
+    """
+
+    def __init__(
+        self,
+        command_sets: Dict[str, List[BotCommand]],
+        default_role: str,
+        on_applied: Optional[Callable[[Any, Optional[Dict[str, Any]]], None]] = None,
+        window: float = COMMAND_SCOPE_WINDOW,
+        concurrency: int = COMMAND_SCOPE_CONCURRENCY,
+    ):
+        self.command_sets = command_sets
+        self.default_role = default_role
+        self.on_applied = on_applied
+        self.concurrency = concurrency
+        self._digests = {role: commands_digest(commands) for role, commands in command_sets.items()}
+        self._applied: Dict[Any, Dict[str, Any]] = {}
+        self._pending: Dict[int, str] = {}
+        self._bot: Any = None
+        self._batch = BatchTimer(window, self.flush)
+        self.api_calls = 0
+        self.skipped = 0
+
+    def load(self, items: Any) -> None:
+        """Fill the applied state from stored (key, record) pairs."""
+        for key, record in items:
+            self._applied[key if key == DEFAULT_SCOPE_KEY else int(key)] = record
+
+    def role_of(self, chat_id: int) -> str:
+        """Return the role whose menu the chat currently has."""
+        record = self._applied.get(chat_id)
+        return record["role"] if record else self.default_role
+
+    def _is_current(self, key: Any, role: str) -> bool:
+        record = self._applied.get(key)
+        if record is None:
+            # Chats without a scope of their own fall back to the default menu
+            return key != DEFAULT_SCOPE_KEY and role == self.default_role
+        return record["role"] == role and record["digest"] == self._digests[role]
+
+    def _record(self, key: Any, record: Optional[Dict[str, Any]]) -> None:
+        if record is None:
+            self._applied.pop(key, None)
+        else:
+            self._applied[key] = record
+        if self.on_applied:
+            self.on_applied(key, record)
+
+    def set_role(self, bot: Any, chat_id: int, role: str) -> bool:
+        """Ask for chat_id to get the menu of role; returns True if an update was queued."""
+        if role not in self.command_sets:
+            raise ValueError(f"Unknown command role {role!r}")
+        self._bot = bot
+        if chat_id not in self._pending and self._is_current(chat_id, role):
+            self.skipped += 1
+            return False
+        # The latest role wins if the chat changes again before the flush
+        self._pending[chat_id] = role
+        self._batch.schedule()
+        return True
+
+    async def flush(self) -> None:
+        """Send every queued scope change now."""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def apply(chat_id, role):
+            async with semaphore:
+                await self._apply(chat_id, role)
+
+        await asyncio.gather(*(apply(chat_id, role) for chat_id, role in pending.items()))
+        logger.info(f"Applied command menus for {len(pending)} chats.")
+
+    async def _apply(self, chat_id: int, role: str) -> None:
+        if self._is_current(chat_id, role):
+            self.skipped += 1
+            return
+        scope = BotCommandScopeChat(chat_id)
+        if role == self.default_role:
+            call = partial(self._bot.delete_my_commands, scope=scope)
+        else:
+            call = partial(self._bot.set_my_commands, self.command_sets[role], scope=scope)
+        try:
+            await call_with_flood_retry(call, COMMAND_SCOPE_ATTEMPTS)
+        except RetryAfter as e:
+            logger.error(f"Giving up on the command menu for chat {chat_id}: {e}")
+            return
+        except TelegramError as e:
+            # Left unrecorded, so the next set_role for this chat tries again
+            logger.error(f"Failed to set the command menu for chat {chat_id}: {e}")
+            return
+        self.api_calls += 1
+        if role == self.default_role:
+            self._record(chat_id, None)
+        else:
+            self._record(chat_id, {"role": role, "digest": self._digests[role]})
+
+    async def apply_default(self, bot: Any) -> None:
+        """Set the default menu, unless it already has the current default commands."""
+        if self._is_current(DEFAULT_SCOPE_KEY, self.default_role):
+            self.skipped += 1
+            return
+        await bot.set_my_commands(self.command_sets[self.default_role])
+        self.api_calls += 1
+        self._record(DEFAULT_SCOPE_KEY, {"role": self.default_role, "digest": self._digests[self.default_role]})
+
+    async def close(self) -> None:
+        """Send what is still queued and wait for running updates."""
+        await self._batch.close()
+        if self._bot is not None:
+            await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "scoped_chats": sum(1 for key in self._applied if key != DEFAULT_SCOPE_KEY),
+            "pending": len(self._pending),
+            "api_calls": self.api_calls,
+            "skipped": self.skipped,
+        }
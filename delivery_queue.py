@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from broadcast import BroadcastEngine
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_DB_FILE = "deliveries.db"
+
+# How many recipients are loaded from disk and handed to the engine at a time
+PAGE_SIZE = 1000
+# How many finished recipients are buffered before their state is committed
+COMMIT_EVERY = 100
+# Seconds to wait for another process (a broadcast worker) holding the write lock
+BUSY_TIMEOUT = 30.0
+# Days finished jobs and their delivery rows are kept (0 keeps them forever)
+DELIVERY_RETENTION_DAYS = float(os.getenv("DELIVERY_RETENTION_DAYS", "7"))
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    job_id TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    PRIMARY KEY (job_id, chat_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS deliveries_state ON deliveries (job_id, state, chat_id);
+"""
+
+
+class DeliveryQueue:
+    """Durable, SQLite-backed queue of broadcast jobs and their recipients.
+
+    Every broadcast becomes a job with one delivery row per recipient. Rows move
+    from pending to sent or failed as the engine reports back, so a job that was
+    interrupted by a crash can be resumed with only the pending rows.
+
+    Several processes may work on the same job, each on its own shard of the
+    recipients (chat_id modulo the number of shards).
+    """
+
+    def __init__(self, path: str = DELIVERY_DB_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def create_job(self, kind: str, payload: Dict[str, Any], chat_ids: Iterable[Any]) -> str:
+        """Persist a new job with one pending delivery per chat and return its id."""
+        job_id = uuid.uuid4().hex
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO jobs (job_id, kind, payload, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), PENDING, time.time()),
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO deliveries (job_id, chat_id, state) VALUES (?, ?, ?)",
+                ((job_id, int(chat_id), PENDING) for chat_id in chat_ids),
+            )
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the job row as a dict, or None if it does not exist."""
+        row = self.conn.execute(
+            "SELECT job_id, kind, payload, status, created_at FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+        return {
+            "job_id": row[0],
+            "kind": row[1],
+            "payload": json.loads(row[2]),
+            "status": row[3],
+            "created_at": row[4],
+        }
+
+    def unfinished_jobs(self) -> List[str]:
+        """Return the ids of jobs that still have work to do, oldest first."""
+        rows = self.conn.execute(
+            "SELECT job_id FROM jobs WHERE status = ? ORDER BY created_at", (PENDING,)
+        )
+        return [row[0] for row in rows]
+
+    def iter_pending(
+        self, job_id: str, page_size: int = PAGE_SIZE, shard: Optional[Tuple[int, int]] = None
+    ) -> Iterator[List[int]]:
+        """Yield pages of pending chat ids without loading the whole job into memory.
+
+        With shard=(index, count) only chat ids with chat_id % count == index
+        are returned.
+        """
+        # SQLite's % keeps the sign of negative (group) chat ids; normalise like Python's
+        shard_sql, shard_args = "", ()
+        if shard is not None:
+            index, count = shard
+            shard_sql = " AND ((chat_id % ?) + ?) % ? = ?"
+            shard_args = (count, count, count, index)
+        last_chat_id = None
+        while True:
+            if last_chat_id is None:
+                rows = self.conn.execute(
+                    "SELECT chat_id FROM deliveries WHERE job_id = ? AND state = ?" + shard_sql +
+                    " ORDER BY chat_id LIMIT ?",
+                    (job_id, PENDING, *shard_args, page_size),
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT chat_id FROM deliveries WHERE job_id = ? AND state = ? AND chat_id > ?" + shard_sql +
+                    " ORDER BY chat_id LIMIT ?",
+                    (job_id, PENDING, last_chat_id, *shard_args, page_size),
+                ).fetchall()
+            if not rows:
+                return
+            page = [row[0] for row in rows]
+            last_chat_id = page[-1]
+            yield page
+
+    def results(self, job_id: str, state: str) -> Iterator[Tuple[int, Optional[str]]]:
+        """Yield (chat_id, last_error) for the deliveries of a job in one state."""
+        yield from self.conn.execute(
+            "SELECT chat_id, last_error FROM deliveries WHERE job_id = ? AND state = ?", (job_id, state)
+        )
+
+    def record_results(self, job_id: str, results: List[tuple]) -> None:
+        """Store a batch of (chat_id, error, attempts) results in one transaction."""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE deliveries SET state = ?, attempts = attempts + ?, last_error = ? "
+                "WHERE job_id = ? AND chat_id = ?",
+                (
+                    (SENT if error is None else FAILED, attempts, error, job_id, chat_id)
+                    for chat_id, error, attempts in results
+                ),
+            )
+
+    def finish_job(self, job_id: str) -> None:
+        """Mark a job as done and drop jobs that finished longer ago than the retention period."""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ? WHERE job_id = ?",
+                (time.time(), job_id),
+            )
+        self.purge_finished()
+
+    def purge_finished(self, retention_days: float = DELIVERY_RETENTION_DAYS) -> int:
+        """Delete finished jobs older than retention_days with their deliveries; returns how many."""
+        if retention_days <= 0:
+            return 0
+        cutoff = time.time() - retention_days * 86400
+        with self.conn:
+            job_ids = [
+                row[0] for row in self.conn.execute(
+                    "SELECT job_id FROM jobs WHERE status = 'done' AND finished_at < ?", (cutoff,)
+                )
+            ]
+            # Deliveries are keyed by (job_id, chat_id), so each delete is a range scan
+            self.conn.executemany("DELETE FROM deliveries WHERE job_id = ?", ((job_id,) for job_id in job_ids))
+            self.conn.executemany("DELETE FROM jobs WHERE job_id = ?", ((job_id,) for job_id in job_ids))
+        if job_ids:
+            logger.info(f"Purged {len(job_ids)} broadcast jobs finished more than {retention_days:g} days ago.")
+        return len(job_ids)
+
+    def counts(self, job_id: str) -> Dict[str, int]:
+        """Return the number of deliveries per state for a job."""
+        rows = self.conn.execute(
+            "SELECT state, COUNT(*) FROM deliveries WHERE job_id = ? GROUP BY state", (job_id,)
+        )
+        return {state: count for state, count in rows}
+
+    async def run(
+        self,
+        job_id: str,
+        engine: BroadcastEngine,
+        send: Callable[[Any], Awaitable[Any]],
+        shard: Optional[Tuple[int, int]] = None,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        on_result: Optional[Callable[[Any, Optional[str]], None]] = None,
+    ) -> Dict[str, int]:
+        """Deliver all pending recipients of a job and return the final state counts.
+
+        With a shard only that part of the recipients is delivered and the job
+        is left for the caller to finish. on_progress(sent, failed) is called
+        with the outcome of every committed batch, on_result(chat_id, error)
+        with that of every recipient delivered in this run.
+        """
+        buffer: List[tuple] = []
+
+        def commit() -> None:
+            self.record_results(job_id, buffer)
+            if on_progress:
+                failed = sum(1 for _, error, _ in buffer if error is not None)
+                on_progress(len(buffer) - failed, failed)
+            buffer.clear()
+
+        def record(chat_id: Any, error: Optional[str], attempts: int) -> None:
+            if on_result:
+                on_result(chat_id, error)
+            buffer.append((chat_id, error, attempts))
+            if len(buffer) >= COMMIT_EVERY:
+                commit()
+
+        try:
+            for page in self.iter_pending(job_id, shard=shard):
+                await engine.broadcast(page, send, on_result=record)
+        finally:
+            # Keep whatever progress was made, even if the job was cancelled
+            if buffer:
+                commit()
+
+        if shard is not None:
+            return self.counts(job_id)
+        self.finish_job(job_id)
+        counts = self.counts(job_id)
+        logger.info(f"Broadcast job {job_id} finished: {counts}")
+        return counts
@@ -0,0 +1,317 @@
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from metrics import STORE_BYTES_WRITTEN, STORE_COMPACTION_SECONDS
+
+try:
+    import msgpack
+except ImportError:  # optional: without it snapshots and logs are compact JSON
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Rewrite the snapshot once the change log is this many times its size...
+STORE_COMPACT_RATIO = float(os.getenv("STORE_COMPACT_RATIO", "1.0"))
+# ...but never for a log smaller than this many bytes
+STORE_COMPACT_MIN_BYTES = int(os.getenv("STORE_COMPACT_MIN_BYTES", str(1 << 20)))
+# fsync the change log after every append (1) or leave it to the OS (0), like SQLite's synchronous=NORMAL
+STORE_LOG_FSYNC = os.getenv("STORE_LOG_FSYNC", "0") == "1"
+
+SNAPSHOT_MAGIC = b"BSNP\x01"
+LOG_MAGIC = b"BLOG\x01"
+# Length and CRC32 of the payload in front of every log frame and every snapshot
+FRAME = struct.Struct(">II")
+
+
+def _json_dumps(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+# Codec byte stored in each file -> (encode, decode)
+CODECS: Dict[bytes, Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]] = {b"j": (_json_dumps, json.loads)}
+if msgpack is not None:
+    CODECS[b"m"] = (
+        lambda value: msgpack.packb(value, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False, strict_map_key=False),
+    )
+DEFAULT_CODEC = b"m" if msgpack is not None else b"j"
+
+
+def _codec(tag: bytes, path: str) -> Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]:
+    try:
+        return CODECS[tag]
+    except KeyError:
+        raise RuntimeError(f"{path} is msgpack-encoded; install msgpack to read it") from None
+
+
+class LogTable:
+    """A keyed record table kept as a compact snapshot plus an append-only change log.
+
+    Drop-in for storage.Table for tables the bot keeps in memory anyway (users,
+    verified users): a write appends one CRC-checked frame with just the
+    changed records instead of rewriting anything, and reads are meant to go
+    through load_all() at startup. Once the log outgrows the snapshot it is
+    rotated and folded into a new snapshot on a background thread, so writers
+    never wait for a compaction. A torn frame at the end of the log (crash
+    mid-append) is dropped on load.
+
+    Files: <base>.snap, <base>.log and, while compacting, <base>.log.compacting.
+    """
+
+    def __init__(self, base: str, name: str, codec: bytes = DEFAULT_CODEC):
+        self.name = name
+        self.snapshot_path = base + ".snap"
+        self.log_path = base + ".log"
+        self.compacting_path = self.log_path + ".compacting"
+        self.codec = codec
+        self.lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+        self._log = None
+        # Codec of the open log, which may predate self.codec
+        self._log_codec = codec
+        self.snapshot_bytes = os.path.getsize(self.snapshot_path) if os.path.exists(self.snapshot_path) else 0
+        self.log_bytes = 0
+        self.compactions = 0
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.log_path)
+
+    # Reading
+
+    def load_all(self) -> Dict[str, Any]:
+        """Return every record as a {key: record} dict: the snapshot with the log replayed on top."""
+        with self.lock:
+            data = self._read_snapshot()
+            if os.path.exists(self.compacting_path):
+                # A compaction was interrupted; its log still has to be applied
+                self._replay(self.compacting_path, data, repair=False)
+            self._replay(self.log_path, data, repair=True)
+            return data
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        return iter(self.load_all().items())
+
+    def get(self, key: Any) -> Optional[Any]:
+        """Return the record stored under key, or None (reads the whole table)."""
+        return self.load_all().get(str(key))
+
+    def __contains__(self, key: Any) -> bool:
+        return str(key) in self.load_all()
+
+    def __len__(self) -> int:
+        return len(self.load_all())
+
+    def find_by_username(self, username: str) -> List[Tuple[str, Any]]:
+        return [(key, record) for key, record in self.items() if isinstance(record, dict) and record.get("username") == username]
+
+    def find_by_chat_id(self, chat_id: int) -> List[Tuple[str, Any]]:
+        return [(key, record) for key, record in self.items() if isinstance(record, dict) and record.get("chat_id") == chat_id]
+
+    def _read_snapshot(self) -> Dict[str, Any]:
+        if not os.path.exists(self.snapshot_path):
+            return {}
+        with open(self.snapshot_path, "rb") as f:
+            content = f.read()
+        header = len(SNAPSHOT_MAGIC) + 1
+        if content[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise RuntimeError(f"{self.snapshot_path} is not a snapshot file")
+        _, decode = _codec(content[len(SNAPSHOT_MAGIC):header], self.snapshot_path)
+        length, crc = FRAME.unpack_from(content, header)
+        payload = content[header + FRAME.size:header + FRAME.size + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            raise RuntimeError(f"{self.snapshot_path} is corrupted")
+        try:
+            return decode(payload)
+        except Exception as e:
+            raise RuntimeError(f"{self.snapshot_path} does not decode with the codec in its header: {e}") from e
+
+    def _replay(self, path: str, data: Dict[str, Any], repair: bool) -> None:
+        """Apply the frames of a log file to data, in order."""
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            content = f.read()
+        header = len(LOG_MAGIC) + 1
+        if len(content) < header:
+            good = 0
+        else:
+            if content[:len(LOG_MAGIC)] != LOG_MAGIC:
+                raise RuntimeError(f"{path} is not a change log")
+            _, decode = _codec(content[len(LOG_MAGIC):header], path)
+            offset = good = header
+            while offset + FRAME.size <= len(content):
+                length, crc = FRAME.unpack_from(content, offset)
+                payload = content[offset + FRAME.size:offset + FRAME.size + length]
+                if len(payload) != length or zlib.crc32(payload) != crc:
+                    break
+                try:
+                    frame = decode(payload)
+                except Exception as e:
+                    # The frame is intact, so this is not a torn write; don't drop it
+                    raise RuntimeError(f"{path}: change at offset {offset} does not decode with the codec in its header: {e}") from e
+                self._apply(data, frame)
+                offset = good = offset + FRAME.size + length
+        if good < len(content):
+            logger.warning(f"Dropping {len(content) - good} bytes of incomplete changes at the end of {path}.")
+            if repair:
+                # Later appends must not land behind the garbage
+                with open(path, "r+b") as f:
+                    f.truncate(good)
+        if repair:
+            self.log_bytes = good
+
+    @staticmethod
+    def _apply(data: Dict[str, Any], frame: List[Any]) -> None:
+        op, value = frame
+        if op == "u":
+            data.update(value)
+        elif op == "d":
+            for key in value:
+                data.pop(key, None)
+        elif op == "c":
+            data.clear()
+
+    # Writing
+
+    def upsert(self, key: Any, record: Any) -> None:
+        self.upsert_many([(key, record)])
+
+    def upsert_many(self, items: Iterable[Tuple[Any, Any]]) -> None:
+        """Append one frame with all the records."""
+        records = {str(key): record for key, record in items}
+        if records:
+            self._append(["u", records])
+
+    def delete(self, key: Any) -> None:
+        self.delete_many([key])
+
+    def delete_many(self, keys: Iterable[Any]) -> None:
+        keys = [str(key) for key in keys]
+        if keys:
+            self._append(["d", keys])
+
+    def clear(self) -> None:
+        self._append(["c", None])
+
+    def _append(self, frame: List[Any]) -> None:
+        with self.lock:
+            if self._log is None:
+                self._open_log()
+            payload = CODECS[self._log_codec][0](frame)
+            self._write(self._log, FRAME.pack(len(payload), zlib.crc32(payload)) + payload, "log")
+            self._log.flush()
+            if STORE_LOG_FSYNC:
+                os.fsync(self._log.fileno())
+            self.log_bytes += FRAME.size + len(payload)
+        if self.log_bytes > max(STORE_COMPACT_MIN_BYTES, self.snapshot_bytes * STORE_COMPACT_RATIO):
+            self.compact_in_background()
+
+    def _open_log(self) -> None:
+        """Open the change log for appending, starting it if it is new or was rotated.
+
+        An existing log keeps the codec it was started with (e.g. JSON from
+        before msgpack was installed); self.codec is used from the next
+        rotation on.
+        """
+        if os.path.exists(self.log_path) and not self.log_bytes:
+            # Opened before load_all(): check the tail now
+            self._replay(self.log_path, {}, repair=True)
+        if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > 0:
+            with open(self.log_path, "rb") as f:
+                tag = f.read(len(LOG_MAGIC) + 1)[len(LOG_MAGIC):]
+            _codec(tag, self.log_path)
+            self._log_codec = tag
+            self._log = open(self.log_path, "ab")
+            return
+        self._log = open(self.log_path, "wb")
+        self._write(self._log, LOG_MAGIC + self.codec, "log")
+        self._log.flush()
+        self._log_codec = self.codec
+        self.log_bytes = len(LOG_MAGIC) + 1
+
+    def _write(self, f: Any, data: bytes, kind: str) -> None:
+        f.write(data)
+        STORE_BYTES_WRITTEN.inc(len(data), table=self.name, file=kind)
+
+    def write_snapshot(self, data: Dict[str, Any]) -> None:
+        """Atomically replace the snapshot with data (the log must already be folded in)."""
+        tmp, size = self._write_snapshot_file(data)
+        with self.lock:
+            os.replace(tmp, self.snapshot_path)
+            self.snapshot_bytes = size
+
+    def _write_snapshot_file(self, data: Dict[str, Any]) -> Tuple[str, int]:
+        payload = CODECS[self.codec][0](data)
+        content = SNAPSHOT_MAGIC + self.codec + FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "wb") as f:
+            self._write(f, content, "snapshot")
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp, len(content)
+
+    # Compaction
+
+    def compact_in_background(self) -> None:
+        """Start a compaction thread unless one is already running."""
+        with self.lock:
+            if self._compactor and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self._compact_logged, name=f"compact-{self.name}", daemon=True)
+            self._compactor.start()
+
+    def _compact_logged(self) -> None:
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error(f"Compacting {self.name} failed: {e}")
+
+    def compact(self) -> None:
+        """Fold the change log into a new snapshot.
+
+        Only the rotation happens under the write lock; reading the old
+        snapshot, replaying the rotated log and writing the new snapshot run
+        while writers keep appending to a fresh log. Replaying is idempotent,
+        so a crash at any point leaves files load_all() reads correctly.
+        """
+        with self._compact_lock:
+            started = time.perf_counter()
+            with self.lock:
+                if not os.path.exists(self.compacting_path):
+                    if self._log:
+                        self._log.close()
+                        self._log = None
+                    if os.path.exists(self.log_path):
+                        os.replace(self.log_path, self.compacting_path)
+                    self.log_bytes = 0
+                    self._open_log()
+            data = self._read_snapshot()
+            self._replay(self.compacting_path, data, repair=False)
+            tmp, size = self._write_snapshot_file(data)
+            with self.lock:
+                # Swap both at once so load_all() never sees the new snapshot without the log or vice versa
+                os.replace(tmp, self.snapshot_path)
+                os.remove(self.compacting_path)
+                self.snapshot_bytes = size
+            elapsed = time.perf_counter() - started
+            self.compactions += 1
+            STORE_COMPACTION_SECONDS.observe(elapsed, table=self.name)
+            logger.info(f"Compacted {self.name}: {len(data)} records, {self.snapshot_bytes} bytes in {elapsed:.2f}s.")
+
+    def close(self) -> None:
+        """Wait for a running compaction and close the log."""
+        compactor = self._compactor
+        if compactor:
+            compactor.join()
+        with self.lock:
+            if self._log:
+                self._log.close()
+                self._log = None
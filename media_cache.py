@@ -0,0 +1,70 @@
+import hashlib
+import logging
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects photos above 10 MB, so there is no point downloading more
+MAX_PHOTO_BYTES = 10 * 1024 * 1024
+DOWNLOAD_TIMEOUT = float(os.getenv("MEDIA_DOWNLOAD_TIMEOUT", "30"))
+
+
+def is_url(image: str) -> bool:
+    """Tell a URL apart from a Telegram file id."""
+    return image.startswith(("http://", "https://"))
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+async def download(url: str) -> bytes:
+    """Fetch an image, refusing anything larger than Telegram would accept."""
+    async with httpx.AsyncClient(timeout=DOWNLOAD_TIMEOUT, follow_redirects=True) as client:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            chunks = []
+            size = 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > MAX_PHOTO_BYTES:
+                    raise ValueError(f"Image at {url} is larger than {MAX_PHOTO_BYTES} bytes.")
+                chunks.append(chunk)
+    return b"".join(chunks)
+
+
+class MediaCache:
+    """Map image content hashes to the Telegram file_id they were uploaded as.
+
+    Entries are loaded from the store at startup and written back through the
+    write-behind persistence, so an image is uploaded once and then reused for
+    every recipient and every later broadcast, across restarts.
+    """
+
+    def __init__(self):
+        self._file_ids: Dict[str, str] = {}
+        self.hits = 0
+        self.uploads = 0
+
+    def load(self, items: Any) -> None:
+        """Fill the cache from (hash, record) pairs."""
+        for digest, record in items:
+            self._file_ids[digest] = record["file_id"]
+
+    def get(self, digest: str) -> Optional[str]:
+        file_id = self._file_ids.get(digest)
+        if file_id:
+            self.hits += 1
+        return file_id
+
+    def remember(self, digest: str, file_id: str) -> Dict[str, Any]:
+        """Record an upload and return the record to persist."""
+        self._file_ids[digest] = file_id
+        self.uploads += 1
+        return {"file_id": file_id}
+
+    def __len__(self) -> int:
+        return len(self._file_ids)
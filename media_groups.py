@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait after the last photo of an album before sending it on
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.5"))
+
+
+class MediaGroupAggregator:
+    """Collect the photos of an album (same media_group_id) into one batch.
+
+    Telegram delivers every photo of an album as its own update. Each new photo
+    restarts a short timer; when it runs out, on_complete(context, items) is
+    called once with all photos in message order and the context passed with
+    the first photo.
+    """
+
+    def __init__(
+        self,
+        on_complete: Callable[[Any, List[Any]], Awaitable[None]],
+        window: float = MEDIA_GROUP_WINDOW,
+    ):
+        self.on_complete = on_complete
+        self.window = window
+        self._groups: Dict[str, List[Tuple[int, Any]]] = {}
+        self._contexts: Dict[str, Any] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def add(self, group_id: str, order: int, item: Any, context: Any = None) -> bool:
+        """Buffer one item of a group; returns True for the first item of the group."""
+        first = group_id not in self._groups
+        if first:
+            self._contexts[group_id] = context
+        self._groups.setdefault(group_id, []).append((order, item))
+
+        timer = self._timers.pop(group_id, None)
+        if timer:
+            timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timers[group_id] = loop.call_later(self.window, self._complete, group_id)
+        return first
+
+    def _complete(self, group_id: str) -> None:
+        self._timers.pop(group_id, None)
+        items = [item for _, item in sorted(self._groups.pop(group_id, []), key=lambda pair: pair[0])]
+        context = self._contexts.pop(group_id, None)
+        task = asyncio.create_task(self._run(group_id, context, items))
+        # Keep a reference so the task is not garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, group_id: str, context: Any, items: List[Any]) -> None:
+        try:
+            await self.on_complete(context, items)
+        except Exception as e:
+            logger.error(f"Failed to send media group {group_id}: {e}")
@@ -0,0 +1,299 @@
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from telegram.ext import ApplicationHandlerStop
+
+logger = logging.getLogger(__name__)
+
+# Where /metrics is served; METRICS_PORT=0 turns the endpoint off
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+# Repeated hot-path warnings are logged once per this many occurrences
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "100"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; the Prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+LONG_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Base for metrics with optional labels, rendered in the Prometheus text format."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    """A value that goes up and down; can also be read from a function at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the (unlabelled) value from function whenever metrics are rendered."""
+        self._function = function
+
+    def samples(self) -> Iterator[str]:
+        if self._function is not None:
+            try:
+                yield f"{self.name} {_format_value(self._function())}"
+            except Exception as e:
+                logger.debug(f"Could not read gauge {self.name}: {e}")
+            return
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label set: [count per bucket..., sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        counts = self._values.get(key)
+        if counts is None:
+            counts = self._values[key] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observe how long the with-block took."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: Any) -> int:
+        counts = self._values.get(self._key(labels))
+        return int(sum(counts[:-1])) if counts else 0
+
+    def samples(self) -> Iterator[str]:
+        for key, counts in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {int(cumulative)}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{labels} {int(cumulative)}"
+
+
+class Registry:
+    """The set of metrics served on /metrics."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram("bot_handler_seconds", "Time spent in each update handler.", ["handler"])
+HANDLER_ERRORS = REGISTRY.counter("bot_handler_errors_total", "Handler calls that raised.", ["handler"])
+UPDATE_QUEUE_DEPTH = REGISTRY.gauge("bot_update_queue_depth", "Updates waiting in the update queue.")
+UPDATES_IN_FLIGHT = REGISTRY.gauge("bot_updates_in_flight", "Updates taken off the queue and not finished.")
+BROADCAST_DURATION = REGISTRY.histogram(
+    "bot_broadcast_seconds", "Wall time of a whole broadcast.", buckets=LONG_BUCKETS
+)
+BROADCAST_PENDING = REGISTRY.gauge("bot_broadcast_pending_recipients", "Recipients of running broadcasts not done yet.")
+SEND_LATENCY = REGISTRY.histogram("bot_send_seconds", "Time of one send to one broadcast recipient.")
+SENDS = REGISTRY.counter("bot_sends_total", "Broadcast recipients by final outcome, plus timed-out attempts.", ["outcome"])
+FLOOD_WAITS = REGISTRY.counter("bot_flood_waits_total", "RetryAfter (429) answers from Telegram.")
+BROADCAST_RATE = REGISTRY.gauge("bot_broadcast_rate", "Current adaptive broadcast send rate (messages per second).")
+RECIPIENT_ERRORS = REGISTRY.counter("bot_recipient_errors_total", "Failed broadcast recipients by kind of error.", ["kind"])
+RECIPIENTS_SKIPPED = REGISTRY.counter("bot_recipients_skipped_total", "Recipients left out of a broadcast as failing or dead.")
+THROTTLED_UPDATES = REGISTRY.counter(
+    "bot_throttled_updates_total", "Inbound updates dropped before the handlers, by reason and kind.", ["reason", "kind"]
+)
+FLUSH_LATENCY = REGISTRY.histogram("bot_persist_flush_seconds", "Time to write one write-behind batch.")
+FLUSHED_RECORDS = REGISTRY.counter("bot_persist_records_total", "Records written by the write-behind flusher.")
+PERSIST_PENDING = REGISTRY.gauge("bot_persist_pending_records", "Changed records waiting to be flushed.")
+STORE_BYTES_WRITTEN = REGISTRY.counter(
+    "bot_store_bytes_written_total", "Bytes written to snapshot-and-log tables, per table and file.", ["table", "file"]
+)
+STORE_COMPACTION_SECONDS = REGISTRY.histogram(
+    "bot_store_compaction_seconds", "Time to fold a change log into a new snapshot.", ["table"]
+)
+STARTUP_SECONDS = REGISTRY.gauge("bot_startup_seconds", "Time spent loading persisted state, per step.", ["step"])
+HTTP_LATENCY = REGISTRY.histogram("bot_http_seconds", "Time of one Bot API call.", ["endpoint"])
+HTTP_REQUESTS = REGISTRY.counter(
+    "bot_http_requests_total", "Bot API calls by method and HTTP status (or timeout/pool_timeout).", ["endpoint", "outcome"]
+)
+HTTP_IN_FLIGHT = REGISTRY.gauge("bot_http_in_flight", "Bot API calls waiting for a response, per connection pool.", ["pool"])
+HTTP_POOL_SIZE = REGISTRY.gauge("bot_http_pool_size", "Connections allowed per pool.", ["pool"])
+
+
+def timed_handler(callback: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap a handler callback so its latency and errors are recorded under its name."""
+    name = getattr(callback, "__name__", type(callback).__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update: Any, context: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+
+    return wrapper
+
+
+class LogSampler:
+    """Log only the first of every `every` occurrences of a repeated message.
+
+    Arguments are formatted lazily by logging, so suppressed calls cost a
+    counter increment.
+    """
+
+    def __init__(self, log: logging.Logger, every: int = LOG_SAMPLE_EVERY):
+        self.log = log
+        self.every = max(1, every)
+        self._counts: Dict[str, int] = {}
+
+    def __call__(self, level: int, msg: str, *args: Any) -> None:
+        count = self._counts.get(msg, 0)
+        self._counts[msg] = count + 1
+        if count % self.every == 0 and self.log.isEnabledFor(level):
+            if count:
+                msg = f"{msg} (%d similar messages suppressed)"
+                args = args + (self.every - 1,)
+            self.log.log(level, msg, *args)
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, registry: Registry) -> None:
+    try:
+        request_line = await reader.readline()
+        # Skip the headers; nothing in them matters here
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] in ("GET", "HEAD") and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", registry.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        head = (
+            f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+        )
+        writer.write(head.encode() + (body if parts[:1] != ["HEAD"] else b""))
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(
+    listen: str = METRICS_LISTEN, port: int = METRICS_PORT, registry: Registry = REGISTRY
+) -> asyncio.AbstractServer:
+    """Serve the registry on http://listen:port/metrics; close the returned server to stop."""
+    server = await asyncio.start_server(lambda r, w: _serve(r, w, registry), listen, port)
+    logger.info(f"Metrics available on http://{listen}:{port}/metrics")
+    return server
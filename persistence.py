@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from metrics import FLUSH_LATENCY, FLUSHED_RECORDS
+from storage import Store
+
+logger = logging.getLogger(__name__)
+
+# Flush at least this often (seconds) while there are pending changes...
+FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL", "2.0"))
+# ...or as soon as this many records are waiting to be written.
+FLUSH_THRESHOLD = int(os.getenv("PERSIST_FLUSH_THRESHOLD", "500"))
+
+# Marker for a pending delete in the dirty map
+DELETED = object()
+
+
+class WriteBehind:
+    """Coalesce store writes in memory and flush them in batches off the event loop.
+
+    Handlers only mark records as changed; repeated changes to the same key are
+    merged so a burst of /start commands becomes a handful of transactions. Each
+    flush runs in the default executor as a single SQLite transaction, so it is
+    applied completely or not at all.
+    """
+
+    def __init__(self, store: Store, interval: float = FLUSH_INTERVAL, threshold: int = FLUSH_THRESHOLD):
+        self.store = store
+        self.interval = interval
+        self.threshold = threshold
+        self._dirty: Dict[str, Dict[str, Any]] = {}
+        self._size = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.flushes = 0
+        self.records_written = 0
+
+    def upsert(self, table: str, key: Any, record: Any) -> None:
+        """Schedule record to be stored under key."""
+        # Copy dicts so later in-place edits cannot race with the writer thread
+        self._mark(table, key, dict(record) if isinstance(record, dict) else record)
+
+    def delete(self, table: str, key: Any) -> None:
+        """Schedule key to be removed."""
+        self._mark(table, key, DELETED)
+
+    def _mark(self, table: str, key: Any, value: Any) -> None:
+        pending = self._dirty.setdefault(table, {})
+        key = str(key)
+        if key not in pending:
+            self._size += 1
+        pending[key] = value
+        if self._size >= self.threshold and self._wakeup:
+            self._wakeup.set()
+
+    @property
+    def pending(self) -> int:
+        """Number of records waiting to be written."""
+        return self._size
+
+    def start(self) -> None:
+        """Start the background flusher on the running event loop."""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Background flush failed: {e}")
+
+    async def flush(self) -> None:
+        """Write every pending change in one transaction, off the event loop."""
+        async with self._flush_lock:
+            if not self._size:
+                return
+            batch, self._dirty, size = self._dirty, {}, self._size
+            self._size = 0
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            try:
+                await loop.run_in_executor(None, self._write, batch)
+            except Exception:
+                # Put the batch back (newer changes win) so nothing is lost
+                for table, changes in batch.items():
+                    pending = self._dirty.setdefault(table, {})
+                    for key, value in changes.items():
+                        if key not in pending:
+                            pending[key] = value
+                            self._size += 1
+                raise
+            elapsed = time.perf_counter() - started
+            self.flushes += 1
+            self.records_written += size
+            FLUSH_LATENCY.observe(elapsed)
+            FLUSHED_RECORDS.inc(size)
+            logger.debug("Flushed %d records in %.4fs.", size, elapsed)
+
+    def _write(self, batch: Dict[str, Dict[str, Any]]) -> None:
+        with self.store.transaction():
+            for table_name, changes in batch.items():
+                table = getattr(self.store, table_name)
+                upserts = [(key, value) for key, value in changes.items() if value is not DELETED]
+                deletes = [key for key, value in changes.items() if value is DELETED]
+                if upserts:
+                    table.upsert_many(upserts)
+                if deletes:
+                    table.delete_many(deletes)
+
+    async def close(self) -> None:
+        """Stop the background flusher and write whatever is still pending."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        logger.info(f"Persistence closed after {self.flushes} flushes ({self.records_written} records).")
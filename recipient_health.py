@@ -0,0 +1,186 @@
+import logging
+import os
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from metrics import RECIPIENT_ERRORS, RECIPIENTS_SKIPPED
+
+logger = logging.getLogger(__name__)
+
+# Seconds a failing chat is skipped after its first failure; doubled on every further one
+HEALTH_BACKOFF = float(os.getenv("HEALTH_BACKOFF", "3600"))
+# Longest a failing chat is skipped before it is tried again
+HEALTH_MAX_BACKOFF = float(os.getenv("HEALTH_MAX_BACKOFF", str(7 * 86400)))
+# Permanent failures (blocked, chat not found) in a row before a chat is declared dead
+HEALTH_DEAD_AFTER = int(os.getenv("HEALTH_DEAD_AFTER", "3"))
+# Remove dead chats from the forward list (1) or just keep skipping them (0)
+HEALTH_PRUNE = os.getenv("HEALTH_PRUNE", "1") == "1"
+# Share of a broadcast's recipients failing with the same kind that is taken for
+# a problem with the broadcast (bad file id, outage) rather than with the chats...
+HEALTH_OUTAGE_SHARE = float(os.getenv("HEALTH_OUTAGE_SHARE", "0.5"))
+# ...in broadcasts to at least this many recipients
+HEALTH_OUTAGE_MIN_RECIPIENTS = int(os.getenv("HEALTH_OUTAGE_MIN_RECIPIENTS", "20"))
+
+# Error kinds that will not go away by retrying the same chat; only these mark a chat as failing
+PERMANENT = {"blocked", "deactivated", "chat_not_found", "forbidden", "migrated"}
+# Telegram's descriptions, matched against stored error strings as well as exceptions
+DESCRIPTIONS = (
+    ("bot was blocked by the user", "blocked"),
+    ("user is deactivated", "deactivated"),
+    ("chat not found", "chat_not_found"),
+    ("bot was kicked", "forbidden"),
+    ("bot can't initiate conversation", "forbidden"),
+)
+
+
+def classify_error(error: Any) -> str:
+    """Sort a send error (exception or its stored text) into a kind of failure."""
+    text = str(error).lower()
+    for description, kind in DESCRIPTIONS:
+        if description in text:
+            return kind
+    if isinstance(error, str):
+        if text.startswith("forbidden"):
+            return "forbidden"
+        if "timed out" in text:
+            return "timeout"
+        return "flood" if "retry" in text else "other"
+    if isinstance(error, Forbidden):
+        return "forbidden"
+    if isinstance(error, ChatMigrated):
+        return "migrated"
+    if isinstance(error, RetryAfter):
+        return "flood"
+    if isinstance(error, TimedOut):
+        return "timeout"
+    if isinstance(error, BadRequest):
+        return "bad_request"
+    if isinstance(error, NetworkError):
+        return "network"
+    return "other"
+
+
+class RecipientHealth:
+    """Track failing broadcast recipients and skip them for a while.
+
+    Every chat that failed for a reason of its own (a PERMANENT kind) is kept
+    with its consecutive failure count and is skipped for an exponentially
+    growing period; timeouts, flood control and bad requests say nothing
+    about the chat and are only counted. A chat is declared dead
+    straight away when the account was deleted, or after HEALTH_DEAD_AFTER
+    permanent failures in a row; on_dead(chat_id, kind) is then called (e.g.
+    to drop it from the forward list). One successful send forgets the chat.
+    on_change(chat_id, record) persists changes (record None: forget).
+    """
+
+    def __init__(
+        self,
+        backoff: float = HEALTH_BACKOFF,
+        max_backoff: float = HEALTH_MAX_BACKOFF,
+        dead_after: int = HEALTH_DEAD_AFTER,
+        on_change: Optional[Callable[[int, Optional[Dict[str, Any]]], None]] = None,
+        on_dead: Optional[Callable[[int, str], None]] = None,
+    ):
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.dead_after = dead_after
+        self.on_change = on_change
+        self.on_dead = on_dead
+        self._chats: Dict[int, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def load(self, items: Iterable[Tuple[Any, Dict[str, Any]]]) -> None:
+        for chat_id, record in items:
+            self._chats[int(chat_id)] = record
+        logger.info(f"Loaded health records for {len(self._chats)} failing chats.")
+
+    def get(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        return self._chats.get(chat_id)
+
+    def is_dead(self, chat_id: int) -> bool:
+        record = self._chats.get(chat_id)
+        return bool(record and record["dead"])
+
+    def record_success(self, chat_id: int) -> None:
+        if self._chats.pop(chat_id, None) is not None and self.on_change:
+            self.on_change(chat_id, None)
+
+    def forget(self, chat_id: int) -> None:
+        """Start over with a chat, e.g. when the user talks to the bot again."""
+        self.record_success(chat_id)
+
+    def record_failure(self, chat_id: int, kind: str, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        RECIPIENT_ERRORS.inc(kind=kind)
+        if kind not in PERMANENT:
+            return
+        record = self._chats.get(chat_id) or {"chat_id": chat_id, "failures": 0, "permanent": 0, "dead": False}
+        record["failures"] += 1
+        record["permanent"] += 1
+        record["kind"] = kind
+        delay = min(self.max_backoff, self.backoff * 2 ** (record["failures"] - 1))
+        record["skip_until"] = now + delay
+        newly_dead = not record["dead"] and (kind == "deactivated" or record["permanent"] >= self.dead_after)
+        if newly_dead:
+            record["dead"] = True
+        self._chats[chat_id] = record
+        if self.on_change:
+            self.on_change(chat_id, record)
+        if newly_dead:
+            logger.info("Chat %s is dead (%s after %d failures).", chat_id, kind, record["failures"])
+            if self.on_dead:
+                self.on_dead(chat_id, kind)
+
+    def record_run(self, failures: Iterable[Tuple[int, Any]], attempted: int) -> None:
+        """Record the (chat_id, error) failures of one broadcast run to attempted recipients.
+
+        A kind of failure that hit most of the run is about the broadcast
+        itself (e.g. a blocked bot token), so it is not held against the chats.
+        """
+        failures = [(chat_id, classify_error(error or "")) for chat_id, error in failures]
+        totals = Counter(kind for _, kind in failures)
+        widespread = set()
+        if attempted >= HEALTH_OUTAGE_MIN_RECIPIENTS:
+            widespread = {kind for kind, count in totals.items() if count > attempted * HEALTH_OUTAGE_SHARE}
+        for kind in widespread:
+            RECIPIENT_ERRORS.inc(totals[kind], kind=kind)
+            logger.warning(f"{totals[kind]} of {attempted} sends failed with {kind}; not counted against the recipients.")
+        for chat_id, kind in failures:
+            if kind not in widespread:
+                self.record_failure(chat_id, kind)
+
+    def should_send(self, chat_id: int, now: Optional[float] = None) -> bool:
+        record = self._chats.get(chat_id)
+        if record is None:
+            return True
+        if record["dead"]:
+            return False
+        return (time.time() if now is None else now) >= record["skip_until"]
+
+    def filter(self, chat_ids: Iterable[int]) -> List[int]:
+        """Return the chats that should get the next broadcast."""
+        if not self._chats:
+            return list(chat_ids)
+        now = time.time()
+        chosen = []
+        skipped = 0
+        for chat_id in chat_ids:
+            if self.should_send(chat_id, now):
+                chosen.append(chat_id)
+            else:
+                skipped += 1
+        if skipped:
+            RECIPIENTS_SKIPPED.inc(skipped)
+            logger.info(f"Skipping {skipped} failing or dead chats.")
+        return chosen
+
+    def stats(self) -> Dict[str, int]:
+        now = time.time()
+        dead = sum(1 for record in self._chats.values() if record["dead"])
+        backing_off = sum(1 for record in self._chats.values() if not record["dead"] and record["skip_until"] > now)
+        return {"tracked": len(self._chats), "dead": dead, "backing_off": backing_off}
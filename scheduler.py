@@ -0,0 +1,195 @@
+import asyncio
+import heapq
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Longest single sleep; the timer is re-armed at least this often so clock
+# changes (NTP, suspend) are picked up
+SCHEDULER_MAX_SLEEP = float(os.getenv("SCHEDULER_MAX_SLEEP", "60"))
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)([smhd])")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(text: str) -> float:
+    """Parse durations like 90s, 15m, 2h or 1h30m into seconds."""
+    text = text.strip().lower()
+    parts = DURATION_PART.findall(text)
+    if not parts or "".join(number + unit for number, unit in parts) != text:
+        raise ValueError(f"Invalid duration {text!r}; use e.g. 30m, 2h or 1h30m.")
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+def parse_send_at(text: str, now: Optional[datetime] = None) -> float:
+    """Parse HH:MM (next occurrence) or an ISO date-time (local time) into a timestamp."""
+    now = now or datetime.now()
+    try:
+        if re.fullmatch(r"\d{1,2}:\d{2}", text):
+            hour, minute = (int(part) for part in text.split(":"))
+            when = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if when <= now:
+                when += timedelta(days=1)
+        else:
+            when = datetime.fromisoformat(text.replace("_", "T"))
+    except ValueError:
+        raise ValueError(f"Invalid time {text!r}; use HH:MM or YYYY-MM-DDTHH:MM.") from None
+    return when.timestamp()
+
+
+def split_schedule(words: List[str], now: Optional[datetime] = None) -> Tuple[Optional[float], Optional[float], List[str]]:
+    """Pull --at TIME, --in DURATION and --over DURATION out of a list of words.
+
+    Returns (due timestamp or None, spread in seconds or None, remaining words).
+    Raises ValueError for a flag without a valid value.
+    """
+    due = spread = None
+    remaining = []
+    words = list(words)
+    while words:
+        word = words.pop(0)
+        if word not in ("--at", "--in", "--over"):
+            remaining.append(word)
+            continue
+        if not words:
+            raise ValueError(f"{word} needs a value.")
+        value = words.pop(0)
+        if word == "--at":
+            due = parse_send_at(value, now)
+        elif word == "--in":
+            due = time.time() + parse_duration(value)
+        else:
+            spread = parse_duration(value)
+    return due, spread, remaining
+
+
+class Scheduler:
+    """Run jobs at a wall-clock time.
+
+    Jobs sit in a heap ordered by due time and a single event loop timer is
+    armed for the earliest one, so thousands of pending jobs cost nothing
+    until they are due. on_change(job_id, record) is called when a job is
+    added or removed (record is None) so it can be persisted; load() restores
+    them after a restart and overdue jobs run as soon as start() is called.
+    When a job is due, on_due(context, job_id, record) runs in a task; its
+    stored record stays until on_due calls done(job_id) (e.g. once the work is
+    handed to something that survives restarts itself) or returns.
+    """
+
+    def __init__(
+        self,
+        on_due: Callable[[Any, str, Dict[str, Any]], Awaitable[None]],
+        on_change: Optional[Callable[[str, Optional[Dict[str, Any]]], None]] = None,
+        max_sleep: float = SCHEDULER_MAX_SLEEP,
+    ):
+        self.on_due = on_due
+        self.on_change = on_change
+        self.max_sleep = max_sleep
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._heap: List[Tuple[float, str]] = []
+        # Jobs that fired but are still stored
+        self._firing: Set[str] = set()
+        self._context: Any = None
+        self._running = False
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def load(self, items: Any) -> None:
+        """Restore stored (job_id, record) pairs."""
+        for job_id, record in items:
+            self._jobs[job_id] = record
+            self._heap.append((record["due"], job_id))
+        heapq.heapify(self._heap)
+        logger.info(f"Loaded {len(self._jobs)} scheduled jobs.")
+
+    def add(self, due: float, record: Dict[str, Any]) -> str:
+        """Schedule a job for timestamp due and return its id."""
+        job_id = uuid.uuid4().hex[:8]
+        record = dict(record, due=due)
+        self._jobs[job_id] = record
+        heapq.heappush(self._heap, (due, job_id))
+        if self.on_change:
+            self.on_change(job_id, record)
+        if self._heap[0][1] == job_id:
+            self._arm()
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        """Drop a pending job; returns False if there is no such job."""
+        if self._jobs.pop(job_id, None) is None:
+            return False
+        if self.on_change:
+            self.on_change(job_id, None)
+        # The heap entry is skipped when it comes up; rebuild if most entries are stale
+        if len(self._heap) > 2 * len(self._jobs) + 16:
+            self._heap = [(due, job) for due, job in self._heap if job in self._jobs]
+            heapq.heapify(self._heap)
+        return True
+
+    def pending(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Return the pending jobs, earliest first."""
+        return sorted(self._jobs.items(), key=lambda item: item[1]["due"])
+
+    def start(self, context: Any = None) -> None:
+        """Start firing jobs; context is handed to on_due (e.g. the bot)."""
+        self._context = context
+        self._running = True
+        self._arm()
+
+    def _arm(self) -> None:
+        if not self._running:
+            return
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        while self._heap and self._heap[0][1] not in self._jobs:
+            heapq.heappop(self._heap)
+        if self._heap:
+            delay = min(max(0.0, self._heap[0][0] - time.time()), self.max_sleep)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._fire)
+
+    def _fire(self) -> None:
+        self._timer = None
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            _, job_id = heapq.heappop(self._heap)
+            record = self._jobs.pop(job_id, None)
+            if record is None:
+                continue
+            self._firing.add(job_id)
+            task = asyncio.create_task(self._run(job_id, record))
+            # Keep a reference so the task is not garbage collected mid-flight
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        self._arm()
+
+    async def _run(self, job_id: str, record: Dict[str, Any]) -> None:
+        try:
+            await self.on_due(self._context, job_id, record)
+        except Exception as e:
+            logger.error(f"Scheduled job {job_id} failed: {e}")
+        finally:
+            self.done(job_id)
+
+    def done(self, job_id: str) -> None:
+        """Forget the stored record of a job that fired; it will not run again after a restart."""
+        if job_id in self._firing:
+            self._firing.discard(job_id)
+            if self.on_change:
+                self.on_change(job_id, None)
+
+    def stop(self) -> None:
+        """Stop the timer; pending jobs stay stored and run after the next start."""
+        self._running = False
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
@@ -0,0 +1,45 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from telegram import InputMediaPhoto
+
+
+def album_media(file_ids, caption=""):
+    """Build the InputMediaPhoto list for an album; the caption goes on the first photo."""
+    return [
+        InputMediaPhoto(file_id, caption=caption if index == 0 else None)
+        for index, file_id in enumerate(file_ids)
+    ]
+
+
+def make_sender(bot: Any, kind: str, payload: Dict[str, Any]) -> Callable[[Any], Awaitable[Any]]:
+    """Build the per-recipient send function for a stored broadcast payload."""
+    if kind == "copy":
+        from_chat_id = payload["from_chat_id"]
+        message_ids = payload["message_ids"]
+        if len(message_ids) == 1:
+            async def send(chat_id):
+                await bot.copy_message(
+                    chat_id=chat_id,
+                    from_chat_id=from_chat_id,
+                    message_id=message_ids[0],
+                    caption=payload.get("caption"),
+                )
+        else:
+            # Several posts (or a whole album) in a single call
+            async def send(chat_id):
+                await bot.copy_messages(chat_id=chat_id, from_chat_id=from_chat_id, message_ids=message_ids)
+
+        return send
+
+    if kind == "media_group":
+        media = album_media(payload["photos"], payload.get("caption", ""))
+
+        async def send(chat_id):
+            await bot.send_media_group(chat_id=chat_id, media=media)
+
+        return send
+
+    async def send(chat_id):
+        await bot.send_photo(chat_id=chat_id, photo=payload["photo"], caption=payload.get("caption", ""))
+
+    return send
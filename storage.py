@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from logstore import LogTable
+from subscribers import Subscriber
+
+logger = logging.getLogger(__name__)
+
+STORE_FILE = "bot_data.db"
+
+# Tables sharing the same keyed-record layout
+TABLES = ("users", "verified_users", "forward_list", "media_cache", "command_scopes", "scheduled", "recipient_health")
+# Tables kept as a snapshot plus change log next to the database instead of in SQLite
+# (see logstore.LogTable); only for tables that are loaded whole at startup
+STORE_LOG_TABLES = [name for name in os.getenv("STORE_LOG_TABLES", "users,verified_users").split(",") if name]
+
+TABLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    key TEXT PRIMARY KEY,
+    username TEXT,
+    chat_id INTEGER,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS {table}_username ON {table} (username);
+CREATE INDEX IF NOT EXISTS {table}_chat_id ON {table} (chat_id);
+"""
+
+META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _index_columns(record: Any) -> Tuple[Optional[str], Optional[int]]:
+    """Pull the indexed username and chat_id out of a record, if present."""
+    if not isinstance(record, dict):
+        return None, None
+    chat_id = record.get("chat_id")
+    return record.get("username"), chat_id if isinstance(chat_id, int) else None
+
+
+class Table:
+    """A keyed collection of JSON records stored in one SQLite table.
+
+    Keys are stored as text (matching the keys of the old JSON files); the
+    username and chat_id of each record are copied into indexed columns so they
+    can be looked up without scanning.
+    """
+
+    def __init__(self, store: "Store", name: str):
+        self.store = store
+        self.name = name
+
+    def get(self, key: Any) -> Optional[Any]:
+        """Return the record stored under key, or None."""
+        row = self.store.conn.execute(
+            f"SELECT data FROM {self.name} WHERE key = ?", (str(key),)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __contains__(self, key: Any) -> bool:
+        row = self.store.conn.execute(
+            f"SELECT 1 FROM {self.name} WHERE key = ?", (str(key),)
+        ).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        return self.store.conn.execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()[0]
+
+    def upsert(self, key: Any, record: Any) -> None:
+        """Insert or replace the record stored under key."""
+        self.upsert_many([(key, record)])
+
+    def upsert_many(self, items: Iterable[Tuple[Any, Any]]) -> None:
+        """Insert or replace many records in a single transaction."""
+        rows = (
+            (str(key), *_index_columns(record), json.dumps(record, separators=(",", ":")))
+            for key, record in items
+        )
+        with self.store.transaction():
+            self.store.conn.executemany(
+                f"INSERT OR REPLACE INTO {self.name} (key, username, chat_id, data) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def delete(self, key: Any) -> None:
+        """Remove the record stored under key, if any."""
+        self.delete_many([key])
+
+    def delete_many(self, keys: Iterable[Any]) -> None:
+        """Remove many records in a single transaction."""
+        with self.store.transaction():
+            self.store.conn.executemany(
+                f"DELETE FROM {self.name} WHERE key = ?", ((str(key),) for key in keys)
+            )
+
+    def clear(self) -> None:
+        """Remove every record from the table."""
+        with self.store.transaction():
+            self.store.conn.execute(f"DELETE FROM {self.name}")
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """Iterate over (key, record) pairs without loading them all at once."""
+        cursor = self.store.conn.execute(f"SELECT key, data FROM {self.name}")
+        for key, data in cursor:
+            yield key, json.loads(data)
+
+    def load_all(self) -> Dict[str, Any]:
+        """Return every record as a {key: record} dict.
+
+        SQLite joins the stored JSON into one document, so the whole table is
+        parsed by a single json.loads instead of one call per record; much
+        faster for large tables at startup.
+        """
+        try:
+            (document,) = self.store.conn.execute(
+                f"SELECT '{{' || group_concat(json_quote(key) || ':' || data, ',') || '}}' FROM {self.name}"
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # SQLite built without the JSON functions
+            return dict(self.items())
+        return json.loads(document) if document else {}
+
+    def find_by_username(self, username: str) -> List[Tuple[str, Any]]:
+        """Return the (key, record) pairs with the given username."""
+        rows = self.store.conn.execute(
+            f"SELECT key, data FROM {self.name} WHERE username = ?", (username,)
+        )
+        return [(key, json.loads(data)) for key, data in rows]
+
+    def find_by_chat_id(self, chat_id: int) -> List[Tuple[str, Any]]:
+        """Return the (key, record) pairs with the given chat id."""
+        rows = self.store.conn.execute(
+            f"SELECT key, data FROM {self.name} WHERE chat_id = ?", (chat_id,)
+        )
+        return [(key, json.loads(data)) for key, data in rows]
+
+
+class Store:
+    """Embedded SQLite store shared by user data, verified users, the forward list and media ids.
+
+    Tables named in log_tables are LogTables instead; they are written next to
+    the database and are not part of its transactions.
+    """
+
+    def __init__(self, path: str = STORE_FILE, log_tables: Iterable[str] = STORE_LOG_TABLES):
+        self.path = path
+        # Writes may come from an executor thread; self.lock serialises them
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(META_SCHEMA)
+        for table in TABLES:
+            self.conn.executescript(TABLE_SCHEMA.format(table=table))
+        self._depth = 0
+        self.log_tables: List[LogTable] = []
+
+        log_tables = set(log_tables)
+        self.users = self._table("users", log_tables)
+        self.verified_users = self._table("verified_users", log_tables)
+        self.forward_list = self._table("forward_list", log_tables)
+        self.media_cache = self._table("media_cache", log_tables)
+        self.command_scopes = self._table("command_scopes", log_tables)
+        self.scheduled = self._table("scheduled", log_tables)
+        self.recipient_health = self._table("recipient_health", log_tables)
+
+    def _table(self, name: str, log_tables: set) -> Union[Table, LogTable]:
+        table = Table(self, name)
+        if name not in log_tables:
+            return table
+        log_table = LogTable(f"{os.path.splitext(self.path)[0]}.{name}", name)
+        if not log_table.exists:
+            # First run with this table outside SQLite: start from what SQLite has
+            records = table.load_all()
+            log_table.write_snapshot(records)
+            if records:
+                logger.info(f"Moved {len(records)} records of {name} from SQLite into {log_table.snapshot_path}.")
+        self.log_tables.append(log_table)
+        return log_table
+
+    @contextmanager
+    def transaction(self):
+        """Group writes into one atomic transaction (nested calls join the outer one)."""
+        with self.lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+                return
+
+            self.conn.execute("BEGIN")
+            self._depth = 1
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            else:
+                self.conn.execute("COMMIT")
+            finally:
+                self._depth = 0
+
+    def close(self) -> None:
+        """Wait for background compactions and close the database."""
+        for table in self.log_tables:
+            table.close()
+        self.conn.close()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def migrate_from_json(self, user_data_file: str, verified_users_file: str, forward_list_file: str) -> None:
+        """Import the legacy JSON files once; later calls are no-ops.
+
+        The forward list is seeded once with every known user, as the bot used
+        to do on every start; from then on the stored list is authoritative.
+        """
+        if self.get_meta("json_migrated") and self.get_meta("forward_list_seeded"):
+            return
+
+        sources = (
+            (self.users, user_data_file),
+            (self.verified_users, verified_users_file),
+            (self.forward_list, forward_list_file),
+        )
+        with self.transaction():
+            if not self.get_meta("json_migrated"):
+                for table, path in sources:
+                    data = _read_json(path)
+                    if table is self.forward_list:
+                        # The forward list maps a name or id straight to a chat id
+                        data = {key: {"chat_id": value} for key, value in data.items()}
+                    table.upsert_many(data.items())
+                    logger.info(f"Migrated {len(data)} records from {path} into {table.name}.")
+                self.set_meta("json_migrated", "1")
+            # Separate flag: stores migrated before the list was kept whole still need it
+            if not self.get_meta("forward_list_seeded"):
+                self._seed_forward_list()
+                self.set_meta("forward_list_seeded", "1")
+
+    def _seed_forward_list(self) -> None:
+        """Add every user with a chat id to the forward list, except chats already found dead."""
+        listed = self.forward_list.load_all()
+        dead = {record.get("chat_id") for _, record in self.recipient_health.items() if record.get("dead")}
+        added = []
+        for user_id, data in self.users.items():
+            chat_id = data.get("chat_id")
+            if chat_id and user_id not in listed and chat_id not in dead:
+                subscriber = Subscriber(int(user_id), chat_id, data.get("username"), data.get("full_name"))
+                added.append((user_id, subscriber.to_record()))
+        self.forward_list.upsert_many(added)
+        logger.info(f"Seeded the forward list with {len(added)} known users.")
+
+
+def _read_json(path: str) -> Dict[str, Any]:
+    """Read a legacy JSON file, treating a missing or corrupted file as empty."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            logger.warning(f"{path} is empty or corrupted; skipping it.")
+            return {}
@@ -0,0 +1,106 @@
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class Subscriber:
+    """One entry of the forward list."""
+
+    __slots__ = ("user_id", "chat_id", "username", "display_name")
+
+    def __init__(self, user_id: int, chat_id: int, username: Optional[str] = None, display_name: Optional[str] = None):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.username = username if username and username != "Unknown" else None
+        self.display_name = display_name or (f"@{self.username}" if self.username else str(user_id))
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "user_id": self.user_id,
+            "chat_id": self.chat_id,
+            "username": self.username,
+            "display_name": self.display_name,
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Subscriber":
+        return cls(record["user_id"], record["chat_id"], record.get("username"), record.get("display_name"))
+
+    def __repr__(self) -> str:
+        return f"Subscriber({self.user_id}, chat_id={self.chat_id}, {self.display_name})"
+
+
+class SubscriberRegistry:
+    """The forward list, keyed by user id with username and chat id indexes.
+
+    Every subscriber appears once no matter how they were added, so a broadcast
+    sends exactly one message per chat. `version` changes on every update so
+    derived views know when to rebuild.
+    """
+
+    def __init__(self):
+        self._by_id: Dict[int, Subscriber] = {}
+        self._by_username: Dict[str, int] = {}
+        self._by_chat: Dict[int, int] = {}
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, user_id: Any) -> bool:
+        return user_id in self._by_id
+
+    def __iter__(self) -> Iterator[Subscriber]:
+        return iter(self._by_id.values())
+
+    def get(self, user_id: int) -> Optional[Subscriber]:
+        return self._by_id.get(user_id)
+
+    def by_username(self, username: str) -> Optional[Subscriber]:
+        user_id = self._by_username.get(username.lstrip("@").lower())
+        return self._by_id.get(user_id) if user_id is not None else None
+
+    def by_chat(self, chat_id: int) -> Optional[Subscriber]:
+        user_id = self._by_chat.get(chat_id)
+        return self._by_id.get(user_id) if user_id is not None else None
+
+    def resolve(self, key: Any) -> Optional[Subscriber]:
+        """Find a subscriber by user id, chat id or (@)username."""
+        if isinstance(key, int) or str(key).lstrip("-").isdigit():
+            key = int(key)
+            return self._by_id.get(key) or self.by_chat(key)
+        return self.by_username(str(key))
+
+    def add(self, subscriber: Subscriber) -> bool:
+        """Add or update a subscriber; returns True if they were not listed before."""
+        existing = self._by_id.get(subscriber.user_id)
+        if existing:
+            self._unindex(existing)
+        self.version += 1
+        self._by_id[subscriber.user_id] = subscriber
+        if subscriber.username:
+            self._by_username[subscriber.username.lower()] = subscriber.user_id
+        self._by_chat[subscriber.chat_id] = subscriber.user_id
+        return existing is None
+
+    def remove(self, user_id: int) -> Optional[Subscriber]:
+        """Remove a subscriber by user id and return them, if listed."""
+        subscriber = self._by_id.pop(user_id, None)
+        if subscriber:
+            self._unindex(subscriber)
+            self.version += 1
+        return subscriber
+
+    def clear(self) -> None:
+        self.version += 1
+        self._by_id.clear()
+        self._by_username.clear()
+        self._by_chat.clear()
+
+    def chat_ids(self) -> List[int]:
+        """Return every chat id exactly once."""
+        return list(self._by_chat)
+
+    def _unindex(self, subscriber: Subscriber) -> None:
+        if subscriber.username and self._by_username.get(subscriber.username.lower()) == subscriber.user_id:
+            del self._by_username[subscriber.username.lower()]
+        if self._by_chat.get(subscriber.chat_id) == subscriber.user_id:
+            del self._by_chat[subscriber.chat_id]
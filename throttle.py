@@ -0,0 +1,167 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from telegram import Update
+
+from metrics import THROTTLED_UPDATES, LogSampler
+
+logger = logging.getLogger(__name__)
+sampled_log = LogSampler(logger)
+
+# /start commands a user may send per THROTTLE_START_WINDOW seconds
+THROTTLE_START_LIMIT = int(os.getenv("THROTTLE_START_LIMIT", "3"))
+THROTTLE_START_WINDOW = float(os.getenv("THROTTLE_START_WINDOW", "60"))
+# Photos a non-admin may send per THROTTLE_PHOTO_WINDOW seconds (each one only earns a refusal)
+THROTTLE_PHOTO_LIMIT = int(os.getenv("THROTTLE_PHOTO_LIMIT", "1"))
+THROTTLE_PHOTO_WINDOW = float(os.getenv("THROTTLE_PHOTO_WINDOW", "300"))
+# Any other updates a non-admin may send per THROTTLE_WINDOW seconds
+THROTTLE_LIMIT = int(os.getenv("THROTTLE_LIMIT", "20"))
+THROTTLE_WINDOW = float(os.getenv("THROTTLE_WINDOW", "60"))
+# Seconds an identical message (same text or photo) from the same user is dropped as a repeat
+THROTTLE_DUPLICATE_WINDOW = float(os.getenv("THROTTLE_DUPLICATE_WINDOW", "10"))
+# Update ids remembered to drop updates Telegram delivers twice (e.g. webhook retries)
+SEEN_UPDATES = 2048
+
+
+def classify(update: Update) -> Tuple[str, Optional[str]]:
+    """Return the kind of an update and a fingerprint for spotting repeats (or None)."""
+    if update.callback_query:
+        return "other", update.callback_query.data
+    message = update.effective_message
+    if message is None:
+        return "other", None
+    if message.photo:
+        return "photo", message.photo[-1].file_unique_id
+    text = message.text or ""
+    if text.split("@", 1)[0].split(maxsplit=1)[:1] == ["/start"]:
+        return "start", text
+    return "other", text or None
+
+
+class SlidingWindow:
+    """Approximate sliding-window counter: two fixed windows, the previous one weighted.
+
+    Constant memory per user and kind, unlike keeping a timestamp per event.
+    """
+
+    __slots__ = ("started", "current", "previous")
+
+    def __init__(self, now: float):
+        self.started = now
+        self.current = 0
+        self.previous = 0
+
+    def hit(self, now: float, limit: int, window: float) -> bool:
+        """Count one event unless it would exceed limit; returns whether it was allowed."""
+        elapsed = now - self.started
+        if elapsed >= window:
+            # Roll over; a gap of two windows or more forgets everything
+            self.previous = self.current if elapsed < 2 * window else 0
+            self.current = 0
+            self.started += window * int(elapsed // window)
+            elapsed = now - self.started
+        estimate = self.previous * (1 - elapsed / window) + self.current
+        if estimate + 1 > limit:
+            return False
+        self.current += 1
+        return True
+
+
+class InboundThrottle:
+    """Shed updates from users who send too much, before any handler runs.
+
+    Every user gets a sliding-window budget per kind of update (/start, photos,
+    everything else), so one client flooding /start cannot turn it into store
+    writes, command menu calls and admin notifications. An identical message
+    repeated within the duplicate window and an update id seen before are
+    dropped outright. Admins are never limited (except for redelivered
+    updates). Idle users are forgotten, so memory follows active senders only.
+    """
+
+    def __init__(
+        self,
+        admins: Iterable[int],
+        limits: Optional[Dict[str, Tuple[int, float]]] = None,
+        duplicate_window: float = THROTTLE_DUPLICATE_WINDOW,
+    ):
+        # Kept by reference, so admins authorized later are exempt too
+        self.admins = admins
+        self.limits = limits or {
+            "start": (THROTTLE_START_LIMIT, THROTTLE_START_WINDOW),
+            "photo": (THROTTLE_PHOTO_LIMIT, THROTTLE_PHOTO_WINDOW),
+            "other": (THROTTLE_LIMIT, THROTTLE_WINDOW),
+        }
+        self.duplicate_window = duplicate_window
+        self.idle_after = 2 * max(window for _, window in self.limits.values())
+        # user id -> [last seen, {kind: SlidingWindow}, {fingerprint: time}], least recently active first
+        self._users: "OrderedDict[int, list]" = OrderedDict()
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self.allowed = 0
+        self.shed: Dict[str, int] = {}
+
+    def allow(self, update: Update, now: Optional[float] = None) -> bool:
+        """Return whether the update should reach the handlers."""
+        now = time.monotonic() if now is None else now
+        if update.update_id in self._seen:
+            return self._shed("redelivered", None, "other")
+        self._seen[update.update_id] = None
+        if len(self._seen) > SEEN_UPDATES:
+            self._seen.popitem(last=False)
+
+        user = update.effective_user
+        if user is None or user.id in self.admins:
+            self.allowed += 1
+            return True
+        kind, fingerprint = classify(update)
+
+        self._forget_idle(now)
+        state = self._users.get(user.id)
+        if state is None:
+            state = self._users[user.id] = [now, {}, {}]
+        else:
+            self._users.move_to_end(user.id)
+            state[0] = now
+        _, windows, recent = state
+
+        if fingerprint is not None:
+            last = recent.get(fingerprint)
+            if last is not None and now - last < self.duplicate_window:
+                return self._shed("duplicate", user.id, kind)
+            recent[fingerprint] = now
+            if len(recent) > 8:
+                # Only the last few messages matter for spotting repeats
+                del recent[next(iter(recent))]
+
+        limit, window = self.limits[kind]
+        counter = windows.get(kind)
+        if counter is None:
+            counter = windows[kind] = SlidingWindow(now)
+        if not counter.hit(now, limit, window):
+            return self._shed("rate", user.id, kind)
+        self.allowed += 1
+        return True
+
+    def _shed(self, reason: str, user_id: Optional[int], kind: str) -> bool:
+        THROTTLED_UPDATES.inc(reason=reason, kind=kind)
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+        sampled_log(logging.INFO, "Dropped %s update from %s (%s).", kind, user_id, reason)
+        return False
+
+    def _forget_idle(self, now: float) -> None:
+        while self._users:
+            user_id, state = next(iter(self._users.items()))
+            if now - state[0] < self.idle_after:
+                break
+            del self._users[user_id]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "tracked": len(self._users),
+            "allowed": self.allowed,
+            "rate": self.shed.get("rate", 0),
+            "duplicate": self.shed.get("duplicate", 0),
+            "redelivered": self.shed.get("redelivered", 0),
+        }
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Optional, Tuple
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+from broadcast import BROADCAST_CONCURRENCY
+from metrics import HTTP_IN_FLIGHT, HTTP_LATENCY, HTTP_POOL_SIZE, HTTP_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Connections for Bot API calls other than getUpdates: broadcasts plus handler replies
+HTTP_POOL_SIZE_SENDS = int(os.getenv("HTTP_POOL_SIZE", str(BROADCAST_CONCURRENCY + 16)))
+# getUpdates is one long poll at a time; its own pool keeps it from waiting behind sends
+HTTP_POOL_SIZE_UPDATES = int(os.getenv("HTTP_UPDATES_POOL_SIZE", "2"))
+# "auto" uses HTTP/2 when the h2 package is installed, otherwise "1.1" or "2"
+HTTP_VERSION = os.getenv("HTTP_VERSION", "auto")
+# Seconds an idle connection is kept open for reuse
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "60"))
+# Timeouts for ordinary (text) calls
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "10"))
+# Seconds to wait for a free connection before giving up on a call
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5"))
+# Uploads (multipart requests) get longer timeouts to send the file and wait for Telegram
+HTTP_MEDIA_WRITE_TIMEOUT = float(os.getenv("HTTP_MEDIA_WRITE_TIMEOUT", "60"))
+HTTP_MEDIA_READ_TIMEOUT = float(os.getenv("HTTP_MEDIA_READ_TIMEOUT", "60"))
+
+
+def http_version(setting: str = HTTP_VERSION) -> str:
+    """Resolve the HTTP_VERSION setting to a version HTTPXRequest accepts."""
+    if setting != "auto":
+        return setting
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return "1.1"
+    return "2"
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records latency and outcome per Bot API method.
+
+    Multipart requests (uploads) use the media timeouts unless the caller
+    passed its own. In-flight calls are tracked per pool, so pool exhaustion
+    shows up as in-flight reaching the pool size and as pool_timeout outcomes.
+    """
+
+    def __init__(self, pool: str, connection_pool_size: int, media_read_timeout: float = HTTP_MEDIA_READ_TIMEOUT, **kwargs: Any):
+        version = kwargs.pop("http_version", http_version())
+        limits = httpx.Limits(
+            max_connections=connection_pool_size,
+            max_keepalive_connections=connection_pool_size,
+            keepalive_expiry=HTTP_KEEPALIVE,
+        )
+        super().__init__(
+            connection_pool_size=connection_pool_size,
+            http_version=version,
+            httpx_kwargs={"limits": limits},
+            **kwargs,
+        )
+        self.pool = pool
+        self.media_read_timeout = media_read_timeout
+        HTTP_POOL_SIZE.set(connection_pool_size, pool=pool)
+        logger.info(f"HTTP pool {pool!r}: {connection_pool_size} connections over HTTP/{version}.")
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout: Any = BaseRequest.DEFAULT_NONE,
+        write_timeout: Any = BaseRequest.DEFAULT_NONE,
+        connect_timeout: Any = BaseRequest.DEFAULT_NONE,
+        pool_timeout: Any = BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        if read_timeout is BaseRequest.DEFAULT_NONE and request_data and request_data.multipart_data:
+            read_timeout = self.media_read_timeout
+        HTTP_IN_FLIGHT.inc(pool=self.pool)
+        started = time.perf_counter()
+        outcome = "network_error"
+        try:
+            status, body = await super().do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
+            outcome = str(status)
+            return status, body
+        except TimedOut as e:
+            outcome = "pool_timeout" if isinstance(e.__cause__, httpx.PoolTimeout) else "timeout"
+            raise
+        except asyncio.CancelledError:
+            # e.g. the long poll being stopped at shutdown
+            outcome = "cancelled"
+            raise
+        finally:
+            HTTP_IN_FLIGHT.dec(pool=self.pool)
+            HTTP_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+            HTTP_REQUESTS.inc(endpoint=endpoint, outcome=outcome)
+
+
+def make_request(pool: str, connection_pool_size: int, **kwargs: Any) -> InstrumentedRequest:
+    """Build a request object with the configured timeouts."""
+    settings = {
+        "connect_timeout": HTTP_CONNECT_TIMEOUT,
+        "read_timeout": HTTP_READ_TIMEOUT,
+        "write_timeout": HTTP_WRITE_TIMEOUT,
+        "pool_timeout": HTTP_POOL_TIMEOUT,
+        "media_write_timeout": HTTP_MEDIA_WRITE_TIMEOUT,
+    }
+    settings.update(kwargs)
+    return InstrumentedRequest(pool, connection_pool_size, **settings)
+
+
+def configure_transport(builder: Any) -> Any:
+    """Give an ApplicationBuilder separate, tuned pools for getUpdates and everything else."""
+    return (
+        builder
+        .request(make_request("sends", HTTP_POOL_SIZE_SENDS))
+        .get_updates_request(make_request("updates", HTTP_POOL_SIZE_UPDATES))
+    )
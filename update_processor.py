@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Updates whose handlers may run at the same time
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+# Updates taken off the queue but not finished yet; beyond this the queue stops draining
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "256"))
+# Updates allowed to wait in the queue before polling / the webhook is slowed down
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1024"))
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently across chats but in order within a chat.
+
+    Each chat has a FIFO lock, so updates from one chat run one after another in
+    arrival order while other chats proceed. A separate semaphore bounds how
+    many handlers actually run at once; it is taken after the chat lock so a
+    chat with a long backlog does not hold slots other chats could use.
+    """
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, max_pending: int = UPDATE_MAX_PENDING):
+        # The base class semaphore bounds admitted updates; ours bounds running handlers
+        super().__init__(max_pending)
+        self.concurrency = concurrency
+        self._running = asyncio.Semaphore(concurrency)
+        self._admission = asyncio.Semaphore(max_pending)
+        self._pending = 0
+        self._chat_locks: Dict[Any, asyncio.Lock] = {}
+        self._chat_waiters: Dict[Any, int] = {}
+
+    @staticmethod
+    def _chat_key(update: object) -> Optional[Any]:
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    @property
+    def pending(self) -> int:
+        """Number of updates admitted but not finished."""
+        return self._pending
+
+    async def admit(self) -> None:
+        """Wait until another update may be taken off the queue."""
+        await self._admission.acquire()
+        self._pending += 1
+
+    def release(self) -> None:
+        """Give back the slot taken by admit()."""
+        self._pending -= 1
+        self._admission.release()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._chat_key(update)
+        try:
+            if key is None:
+                async with self._running:
+                    await coroutine
+                return
+
+            lock = self._chat_locks.get(key)
+            if lock is None:
+                lock = self._chat_locks[key] = asyncio.Lock()
+            self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+            try:
+                async with lock:
+                    async with self._running:
+                        await coroutine
+            finally:
+                self._chat_waiters[key] -= 1
+                if not self._chat_waiters[key]:
+                    del self._chat_waiters[key]
+                    del self._chat_locks[key]
+        finally:
+            self.release()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class BackpressureQueue(asyncio.Queue):
+    """Update queue that only hands out updates while the processor has room.
+
+    When the processor is saturated the queue fills up, and putting new updates
+    into it (from polling or the webhook endpoint) waits, which slows intake
+    down instead of piling up unbounded tasks.
+    """
+
+    def __init__(self, processor: ChatOrderedUpdateProcessor, maxsize: int = UPDATE_QUEUE_SIZE):
+        super().__init__(maxsize)
+        self.processor = processor
+
+    async def get(self) -> Any:
+        # The stop signal also takes a slot; it is never released, which is fine on shutdown
+        await self.processor.admit()
+        try:
+            return await super().get()
+        except BaseException:
+            self.processor.release()
+            raise
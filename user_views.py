@@ -0,0 +1,114 @@
+import csv
+import io
+import os
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from subscribers import Subscriber, SubscriberRegistry
+
+# Entries per /show_users page; 50 short lines stay well under Telegram's 4096 characters
+SHOW_USERS_PAGE_SIZE = int(os.getenv("SHOW_USERS_PAGE_SIZE", "50"))
+# CSV exports are kept in memory up to this size, then spill to a temporary file
+EXPORT_SPOOL_BYTES = 1024 * 1024
+EXPORT_COLUMNS = ("user_id", "chat_id", "username", "name", "status", "start_time")
+
+
+class UserRow:
+    """One forward list entry as shown by /show_users."""
+
+    __slots__ = ("subscriber", "name", "status", "start_time", "search_text")
+
+    def __init__(self, subscriber: Subscriber, name: str, status: str, start_time: str = ""):
+        self.subscriber = subscriber
+        self.name = name
+        self.status = status
+        self.start_time = start_time
+        self.search_text = f"{name} {subscriber.username or ''} {subscriber.user_id}".lower()
+
+    def line(self) -> str:
+        username = self.subscriber.username
+        username = f" (@{username})" if username and self.name != f"@{username}" else ""
+        return f"{self.name}{username}: {self.subscriber.chat_id} [{self.status}]"
+
+
+def parse_filter(words: List[str]) -> Tuple[Optional[str], str]:
+    """Split /show_users arguments into a status filter (status:<name>) and search text."""
+    status = None
+    text = []
+    for word in words:
+        if word.lower().startswith("status:"):
+            status = word.split(":", 1)[1].lower() or None
+        else:
+            text.append(word.lower())
+    return status, " ".join(text)
+
+
+class UserListView:
+    """A name-sorted snapshot of the forward list, filtered and paged in memory.
+
+    The sorted rows are rebuilt only when the registry has changed since the
+    last call or invalidate() was called, so paging through a large list costs
+    a slice, not a sort. Rows also depend on data outside the registry (names,
+    statuses); whoever changes that must call invalidate().
+    """
+
+    def __init__(
+        self,
+        registry: SubscriberRegistry,
+        describe: Callable[[Subscriber], UserRow],
+        page_size: int = SHOW_USERS_PAGE_SIZE,
+    ):
+        self.registry = registry
+        self.describe = describe
+        self.page_size = page_size
+        self._rows: List[UserRow] = []
+        self._version: Optional[int] = None
+
+    def invalidate(self) -> None:
+        """Force a rebuild, e.g. after user details or statuses changed."""
+        self._version = None
+
+    def rows(self, status: Optional[str] = None, text: str = "") -> List[UserRow]:
+        if self._version != self.registry.version:
+            self._rows = sorted((self.describe(subscriber) for subscriber in self.registry), key=lambda row: row.name.lower())
+            self._version = self.registry.version
+        rows = self._rows
+        if status:
+            rows = [row for row in rows if row.status == status]
+        if text:
+            rows = [row for row in rows if text in row.search_text]
+        return rows
+
+    def page(self, rows: List[UserRow], page: int) -> Tuple[List[UserRow], int, int]:
+        """Return the rows of one page, the page number (clamped) and the page count."""
+        pages = max(1, -(-len(rows) // self.page_size))
+        page = min(max(page, 0), pages - 1)
+        start = page * self.page_size
+        return rows[start:start + self.page_size], page, pages
+
+
+def export_csv(rows: List[UserRow]) -> Any:
+    """Write rows to a CSV file object positioned at the start, ready to upload."""
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES, mode="w+b")
+    text = io.TextIOWrapper(spool, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        subscriber = row.subscriber
+        writer.writerow((subscriber.user_id, subscriber.chat_id, subscriber.username or "", row.name, row.status, row.start_time))
+    text.flush()
+    # Hand the binary file over without closing it along with the wrapper
+    text.detach()
+    spool.seek(0)
+    return spool
+
+
+def view_state(chat_data: Dict[str, Any], message_id: int, query: Optional[Tuple[Optional[str], str]] = None, keep: int = 20):
+    """Remember (or look up) the filter a /show_users message was opened with."""
+    views = chat_data.setdefault("user_views", {})
+    if query is None:
+        return views.get(message_id, (None, ""))
+    views[message_id] = query
+    while len(views) > keep:
+        del views[next(iter(views))]
+    return query
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import time
+from functools import partial
+from typing import Any, Dict, Iterable, List
+
+from telegram.error import RetryAfter, TelegramError
+from telegram.helpers import escape_markdown
+
+from batching import BatchTimer
+from broadcast import call_with_flood_retry
+
+logger = logging.getLogger(__name__)
+
+# Seconds access requests are collected before the admins are notified
+VERIFY_BATCH_WINDOW = float(os.getenv("VERIFY_BATCH_WINDOW", "1.0"))
+# Batches larger than this go out as one digest message per admin
+VERIFY_DIGEST_THRESHOLD = int(os.getenv("VERIFY_DIGEST_THRESHOLD", "3"))
+# Seconds a repeated /start from a pending user is not announced again
+VERIFY_DEDUPE_TTL = float(os.getenv("VERIFY_DEDUPE_TTL", "3600"))
+VERIFY_SEND_ATTEMPTS = 3
+# Telegram's limit on the length of one message
+MESSAGE_LIMIT = 4096
+
+
+class AccessRequest:
+    """A pending access request, rendered once as a message and as a digest line."""
+
+    __slots__ = ("user_id", "message", "line", "requested_at")
+
+    def __init__(self, user_id: int, full_name: str, username: str):
+        name = f"{escape_markdown(full_name, version=2)} @{escape_markdown(username, version=2)}"
+        self.user_id = user_id
+        self.message = (
+            f"🔔 *Access Request*\n"
+            f"{name}\n"
+            f"ID: {user_id}\n\n"
+            f"Approve: `/add_user {user_id}`\n"
+            f"Reject: `/reject {user_id}`"
+        )
+        self.line = f"{name} \\({user_id}\\)\n`/add_user {user_id}`  `/reject {user_id}`"
+        self.requested_at = time.monotonic()
+
+
+def render_digest(requests: List[AccessRequest]) -> List[str]:
+    """Roll requests into as few messages as fit Telegram's length limit."""
+    messages = []
+    header = f"🔔 *{len(requests)} Access Requests*"
+    current = header
+    for request in requests:
+        if len(current) + len(request.line) + 2 > MESSAGE_LIMIT:
+            messages.append(current)
+            current = header + " \\(continued\\)"
+        current += "\n\n" + request.line
+    messages.append(current)
+    return messages
+
+
+class VerificationNotifier:
+    """Tell the admins about new access requests without holding up /start.
+
+    submit() only records the request; requests arriving within `window`
+    seconds are sent together, to every admin concurrently. Small batches go
+    out as one message per request, larger ones as a digest per admin, so a
+    signup spike costs each admin a few messages instead of one per user. A
+    user who repeats /start while their request is pending is not announced
+    again until `ttl` has passed or the request was resolved.
+    """
+
+    def __init__(
+        self,
+        admins: Iterable[int],
+        window: float = VERIFY_BATCH_WINDOW,
+        digest_threshold: int = VERIFY_DIGEST_THRESHOLD,
+        ttl: float = VERIFY_DEDUPE_TTL,
+    ):
+        # Kept by reference, so admins authorized later are included
+        self.admins = admins
+        self.digest_threshold = digest_threshold
+        self.ttl = ttl
+        self._pending: Dict[int, AccessRequest] = {}
+        self._queue: List[AccessRequest] = []
+        self._bot: Any = None
+        self._batch = BatchTimer(window, self.flush)
+        self.requests = 0
+        self.duplicates = 0
+        self.messages = 0
+
+    def submit(self, bot: Any, user_id: int, full_name: str, username: str) -> bool:
+        """Queue an access request; returns False if the user already has one pending."""
+        previous = self._pending.get(user_id)
+        if previous and time.monotonic() - previous.requested_at < self.ttl:
+            self.duplicates += 1
+            return False
+        request = AccessRequest(user_id, full_name, username)
+        self._pending[user_id] = request
+        self._queue.append(request)
+        self._bot = bot
+        self.requests += 1
+        self._batch.schedule()
+        return True
+
+    def resolve(self, user_id: Any) -> None:
+        """Forget a request once it was approved or rejected."""
+        self._pending.pop(int(user_id), None)
+
+    async def flush(self) -> None:
+        """Send the queued requests now."""
+        batch, self._queue = self._queue, []
+        # Skip requests resolved (or re-submitted) while they waited
+        batch = [request for request in batch if self._pending.get(request.user_id) is request]
+        self._forget_expired()
+        if not batch:
+            return
+        if len(batch) <= self.digest_threshold:
+            messages = [request.message for request in batch]
+        else:
+            messages = render_digest(batch)
+        admins = list(self.admins)
+        await asyncio.gather(*(self._send_all(admin, messages) for admin in admins))
+        logger.info(f"Sent {len(batch)} access requests to {len(admins)} admins in {len(messages)} messages each.")
+
+    async def _send_all(self, admin: int, messages: List[str]) -> None:
+        for text in messages:
+            await self._send(admin, text)
+
+    async def _send(self, admin: int, text: str) -> None:
+        try:
+            send = partial(self._bot.send_message, chat_id=admin, text=text, parse_mode="MarkdownV2")
+            await call_with_flood_retry(send, VERIFY_SEND_ATTEMPTS)
+        except RetryAfter:
+            logger.error(f"Gave up sending verification request to authorized user {admin} after flood control.")
+            return
+        except TelegramError as e:
+            logger.error(f"Failed to send verification request to authorized user {admin}: {e}")
+            return
+        self.messages += 1
+
+    def _forget_expired(self) -> None:
+        now = time.monotonic()
+        expired = [user_id for user_id, request in self._pending.items() if now - request.requested_at >= self.ttl]
+        for user_id in expired:
+            del self._pending[user_id]
+
+    async def close(self) -> None:
+        """Send whatever is still queued."""
+        await self._batch.close()
+        if self._queue and self._bot:
+            await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "requests": self.requests,
+            "duplicates": self.duplicates,
+            "messages": self.messages,
+        }
@@ -0,0 +1,120 @@
+import asyncio
+import hmac
+import logging
+import os
+import secrets
+import signal
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# Public HTTPS address Telegram should post updates to (without the path)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Shared secret Telegram echoes back in every request; generated when unset
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Concurrent webhook requests accepted (also sent to Telegram as max_connections)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "40"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def make_webhook_app(application: Application, path: str, secret_token: str, workers: int) -> web.Application:
+    """Build the aiohttp app that feeds posted updates into the application's queue."""
+    semaphore = asyncio.Semaphore(workers)
+
+    async def receive_update(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token):
+            logger.warning(f"Rejected webhook request from {request.remote}: bad secret token.")
+            return web.Response(status=403)
+
+        async with semaphore:
+            try:
+                data = await request.json()
+            except ValueError:
+                return web.Response(status=400)
+            update = Update.de_json(data, application.bot)
+            # Waits when the update queue is full, which slows Telegram down
+            await application.update_queue.put(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, receive_update)
+    return app
+
+
+async def start_webhook_server(
+    application: Application,
+    listen: str = WEBHOOK_LISTEN,
+    port: int = WEBHOOK_PORT,
+    path: str = WEBHOOK_PATH,
+    secret_token: str = WEBHOOK_SECRET,
+    workers: int = WEBHOOK_WORKERS,
+) -> web.AppRunner:
+    """Start serving the webhook endpoint and return the runner to clean it up."""
+    runner = web.AppRunner(make_webhook_app(application, path, secret_token, workers), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, listen, port).start()
+    logger.info(f"Webhook server listening on http://{listen}:{port}{path}")
+    return runner
+
+
+async def run_webhook(
+    application: Application,
+    url: str = WEBHOOK_URL,
+    listen: str = WEBHOOK_LISTEN,
+    port: int = WEBHOOK_PORT,
+    path: str = WEBHOOK_PATH,
+    secret_token: Optional[str] = WEBHOOK_SECRET,
+    workers: int = WEBHOOK_WORKERS,
+) -> None:
+    """Run the application on a webhook until SIGINT/SIGTERM.
+
+    The webhook is deleted again on the way out, so the next start can switch
+    back to polling without leftovers on Telegram's side.
+    """
+    if not url:
+        raise ValueError("WEBHOOK_URL must be set to run in webhook mode.")
+    secret_token = secret_token or secrets.token_urlsafe(32)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    runner = await start_webhook_server(application, listen, port, path, secret_token, workers)
+    try:
+        await application.bot.set_webhook(
+            url=url.rstrip("/") + path,
+            secret_token=secret_token,
+            max_connections=workers,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await application.start()
+        logger.info(f"Webhook set to {url.rstrip('/')}{path}")
+        await stop.wait()
+    finally:
+        logger.info("Stopping webhook mode.")
+        try:
+            await application.bot.delete_webhook()
+        except Exception as e:
+            logger.error(f"Failed to delete webhook: {e}")
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)